@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Measures the per-call overhead of checking arguments (and optionally return values) against
+# each kind of type hint for a range of container sizes, as well as the time it takes to
+# decorate functions, and writes the results as JSON, e.g.:
+#
+#     python benchmarks/handlers.py --output before.json
+#     python benchmarks/handlers.py --output after.json --compare before.json
+#
+# Results are keyed by case name so that runs of different versions can be diffed; with
+# `--compare`, cases slower than in the given results by more than `--threshold` are listed
+# and the exit code is 1.
+
+import argparse
+import collections
+import json
+import platform
+import sys
+import time
+import timeit
+
+from typing import Any, Dict, List, MutableSequence, Sequence, Tuple, TypeVar, Union
+
+import typo
+
+from typo._version import __version__
+
+T = TypeVar('T')
+
+# Case name, type hint and function building the argument of the given size (or an argument
+# without a size, if the size is None).
+Case = collections.namedtuple('Case', ['name', 'hint', 'make'])
+
+scalar_cases = [
+    Case('TypeHandler', int, lambda n: 1),
+    Case('TupleHandler (fixed)', Tuple[int, str, float], lambda n: (1, 'a', 1.0)),
+    Case('UnionHandler (simple)', Union[int, str], lambda n: 'a'),
+    Case('TypeVarHandler', T, lambda n: 1),
+]
+
+sized_cases = [
+    Case('ListHandler', List[int], lambda n: list(range(n))),
+    Case('ListHandler (nested)', List[List[int]], lambda n: [[i] for i in range(n)]),
+    Case('DictHandler', Dict[str, int], lambda n: {str(i): i for i in range(n)}),
+    Case('TupleHandler (variadic)', Tuple[int, ...], lambda n: tuple(range(n))),
+    Case('UnionHandler', Union[int, List[int]], lambda n: list(range(n))),
+    Case('TypeVarHandler (items)', List[T], lambda n: list(range(n))),
+    Case('SequenceHandler', Sequence[int], lambda n: list(range(n))),
+    Case('MutableSequenceHandler', MutableSequence[int], lambda n: list(range(n))),
+]
+
+# Type hints of the functions decorated when measuring decoration time.
+decorated_hints = [int, List[int], Dict[str, List[int]], Tuple[int, str], Union[int, str],
+                   Sequence[float], List[T]]
+
+
+def identity(x):
+    return x
+
+
+def make_func(hint: Any, returns: bool) -> Any:
+    def func(x):
+        return x
+    func.__annotations__ = {'x': hint, 'return': hint} if returns else {'x': hint}
+    return func
+
+
+def measure(func: Any, arg: Any, budget: float, repeat: int) -> float:
+    # Best time of a single call in nanoseconds, calling the function for about `budget`
+    # seconds per repetition.
+    timer = timeit.Timer(lambda: func(arg))
+    once = timer.timeit(1)
+    number = max(1, int(budget / max(once, 1e-7)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def bench_handlers(sizes: List[int], budget: float, repeat: int) -> Dict[str, dict]:
+    results = collections.OrderedDict()
+    for case, size in ([(case, None) for case in scalar_cases] +
+                       [(case, size) for case in sized_cases for size in sizes]):
+        arg = case.make(size)
+        baseline = measure(identity, arg, budget, repeat)
+        for returns in (False, True):
+            checked = typo.type_check(make_func(case.hint, returns))
+            ns = measure(checked, arg, budget, repeat)
+            name = case.name
+            if size is not None:
+                name += ', size={}'.format(size)
+            if returns:
+                name += ', return'
+            results[name] = collections.OrderedDict([
+                ('hint', repr(case.hint)),
+                ('size', size),
+                ('return', returns),
+                ('ns', round(ns, 1)),
+                ('baseline_ns', round(baseline, 1)),
+                ('overhead_ns', round(ns - baseline, 1)),
+            ])
+            print('{:<48} {:14.1f} ns/call  {:8.2f}x'.format(name, ns, ns / baseline),
+                  file=sys.stderr)
+    return results
+
+
+def bench_decoration(n: int) -> Dict[str, dict]:
+    # Functions are defined from source so that each of them has its own code object, as
+    # decorated functions in a real code base do.
+    source = ''.join('def func_{0}(x: h{1}, y: h{1}) -> h{1}:\n    return x\n'
+                     .format(i, i % len(decorated_hints)) for i in range(n))
+    results = collections.OrderedDict()
+    for name, options in [('type_check', {}), ('type_check, tiered', {'tiered': 100})]:
+        namespace = {'h{}'.format(i): h for i, h in enumerate(decorated_hints)}
+        exec(source, namespace)
+        funcs = [namespace['func_{}'.format(i)] for i in range(n)]
+        start = time.perf_counter()
+        for func in funcs:
+            typo.type_check(func, **options)
+        elapsed = time.perf_counter() - start
+        results[name] = collections.OrderedDict([
+            ('functions', n),
+            ('us_per_function', round(elapsed / n * 1e6, 1)),
+        ])
+        print('{:<48} {:14.1f} us/function'.format(name, elapsed / n * 1e6), file=sys.stderr)
+    return results
+
+
+def compare(results: dict, previous: dict, threshold: float) -> List[str]:
+    regressions = []
+    for section, key in [('handlers', 'ns'), ('decoration', 'us_per_function')]:
+        for name, result in results[section].items():
+            old = previous.get(section, {}).get(name)
+            if old is not None and result[key] > old[key] * (1 + threshold):
+                regressions.append('{}: {} -> {} ({:+.0%})'.format(
+                    name, old[key], result[key], result[key] / old[key] - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of type checks per handler.')
+    parser.add_argument('--sizes', default='0,10,1000,100000,1000000',
+                        help='comma-separated container sizes')
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help='seconds per measurement')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--functions', type=int, default=2000,
+                        help='number of functions to decorate')
+    parser.add_argument('--output', help='file to write JSON results to (default: stdout)')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = collections.OrderedDict([
+        ('python', platform.python_version()),
+        ('typo', __version__),
+        ('handlers', bench_handlers([int(s) for s in args.sizes.split(',')],
+                                    args.budget, args.repeat)),
+        ('decoration', bench_decoration(args.functions)),
+    ])
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print('regression: ' + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Measures the per-call overhead of enabled and disabled type-checked wrappers relative to
+# calling the function directly and via a plain forwarding wrapper, e.g.:
+#
+#     python benchmarks/switch.py --number 1000000
+
+import argparse
+import timeit
+
+from typing import List
+
+import typo
+
+
+def func(x: int, y: List[int]) -> int:
+    return x
+
+
+def forward(*args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Overhead of disabled type checks.')
+    parser.add_argument('--number', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    checked = typo.type_check(func)
+    disabled = typo.type_check(func)
+    typo.disable(disabled)
+
+    y = [1, 2, 3]
+    cases = [
+        ('direct call', func),
+        ('forwarding wrapper', forward),
+        ('type_check, disabled', disabled),
+        ('type_check, enabled', checked),
+    ]
+    baseline = None
+    for name, f in cases:
+        best = min(timeit.repeat(lambda: f(1, y), number=args.number, repeat=args.repeat))
+        ns = best / args.number * 1e9
+        baseline = baseline or ns
+        print('{:<24} {:8.1f} ns/call  {:6.2f}x'.format(name, ns, ns / baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,7 @@ setup(
     keywords='typing type checking annotations',
     extras_require={
         ':python_version == "3.3"': 'typing >= 3.5',
-        ':python_version == "3.4"': 'typing >= 3.5'
+        ':python_version == "3.4"': 'typing >= 3.5',
+        'numpy': 'numpy'
     }
 )
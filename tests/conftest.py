@@ -2,6 +2,10 @@
 
 import inspect
 import pytest
+import sys
+
+# Coroutine functions and async generators can't be even parsed in older Python versions.
+collect_ignore = ['test_async.py'] if sys.version_info < (3, 6) else []
 
 
 def pytest_namespace():
@@ -33,9 +37,11 @@ def add_handler_test(name, bound, exp_str, ok=[], fail=[]):
             assert str(h) == exp_str
         elif test == 'ok':
             f(arg)
+            h.validate(arg)
         elif test == 'fail':
             arg, msg = arg
             pytest.raises_regexp(TypeError, msg, f, arg)
+            pytest.raises_regexp(TypeError, msg, h.validate, arg)
 
     inspect.stack()[1][0].f_locals[name] = func
 
@@ -49,7 +55,7 @@ class _:
         return func(*self.args, **self.kwargs)
 
 
-def type_check_test(ok=[], fail=[]):
+def type_check_test(ok=[], fail=[], **options):
     from typo.decorator import type_check
 
     params, ids = [], []
@@ -63,20 +69,26 @@ def type_check_test(ok=[], fail=[]):
     ids += ['fail-{}'.format(i) for i in range(len(fail))]
 
     def decorator(func):
-        wrapped = type_check(func)
+        wrapped = type_check(func, **options)
 
         @pytest.mark.parametrize('test, arg', params, ids=ids)
         def test_runner(test, arg):
+            tiered = type_check(func, tiered=1, **options)
             if test == 'func':
                 for magic in ('module', 'name', 'qualname', 'doc', 'annotations'):
                     attr = '__' + magic + '__'
                     assert getattr(func, attr) == getattr(wrapped, attr)
+                    assert getattr(func, attr) == getattr(tiered, attr)
                 assert isinstance(wrapped.wrapper_code, str)
             elif test == 'ok':
                 arg.apply(wrapped)
+                for _ in range(2):
+                    arg.apply(tiered)
             elif test == 'fail':
                 arg, msg = arg
                 pytest.raises_regexp(TypeError, msg, arg.apply, wrapped)
+                for _ in range(2):
+                    pytest.raises_regexp(TypeError, msg, arg.apply, tiered)
 
         test_runner.__name__ == func.__name__
         return test_runner
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import inspect
+import pytest
+
+from typing import AsyncIterator, List
+
+from typo.decorator import type_check
+from typo.switch import disable, reset
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def collect(it):
+    async def collect():
+        return [x async for x in it]
+    return run(collect())
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 1, 100])
+def test_coroutine(tiered):
+    @type_check(tiered=tiered)
+    async def f(x: int, y: List[int]=[]) -> str:
+        await asyncio.sleep(0)
+        return str(x) if x else x
+
+    assert inspect.iscoroutinefunction(f)
+    for _ in range(2):
+        assert run(f(1)) == '1'
+        pytest.raises_regexp(TypeError, 'invalid `x`: expected int, got str', run, f('a'))
+        pytest.raises_regexp(TypeError, 'invalid item #0 of `y`: expected int, got str',
+                             run, f(1, ['a']))
+        pytest.raises_regexp(TypeError, 'invalid return value: expected str, got int',
+                             run, f(0))
+
+
+def test_coroutine_wrapper():
+    @type_check
+    async def f(x: int) -> int:
+        return x
+
+    assert 'async def f(' in f.wrapper_code and 'await ' in f.wrapper_code
+
+    disable(f)
+    try:
+        assert inspect.iscoroutinefunction(f)
+        assert run(f('a')) == 'a'
+    finally:
+        reset(f)
+    pytest.raises_regexp(TypeError, 'invalid `x`', run, f('a'))
+
+
+@pytest.mark.parametrize('every', [None, 2])
+def test_coroutine_partial(every):
+    @type_check(every=every)
+    async def f(x: int) -> int:
+        return x
+
+    assert run(f(1)) == 1
+    if every:
+        assert run(f('a')) == 'a'
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_async_generator(tiered):
+    @type_check(tiered=tiered)
+    async def f(xs: List[int]) -> AsyncIterator[str]:
+        for x in xs:
+            await asyncio.sleep(0)
+            yield str(x) if x else x
+
+    assert inspect.isasyncgenfunction(f)
+    assert collect(f([1, 2])) == ['1', '2']
+    # Arguments are checked when the iteration starts, as for any async generator.
+    pytest.raises_regexp(TypeError, 'invalid item #0 of `xs`: expected int, got str',
+                         collect, f(['a']))
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `f\\(\\)`: expected str, got int',
+                         collect, f([1, 0]))
+
+    @type_check(tiered=tiered)
+    def g() -> AsyncIterator[int]:
+        return [1]
+
+    pytest.raises_regexp(TypeError, 'invalid return value: expected async iterator, got list',
+                         g)
+
+
+def test_async_generator_wrapper():
+    @type_check(every=2)
+    async def f(x: int) -> AsyncIterator[int]:
+        yield x
+
+    assert 'async for ' in f.wrapper_code
+    assert collect(f(1)) == [1] and collect(f('a')) == ['a']
+    pytest.raises_regexp(TypeError, 'invalid `x`', collect, f('a'))
+
+    disable(f)
+    try:
+        assert inspect.isasyncgenfunction(f)
+        assert collect(f('a')) == ['a']
+    finally:
+        reset(f)
+    assert inspect.isasyncgenfunction(f)
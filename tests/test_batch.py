@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+from typing import Any, Dict, List, Tuple, TypeVar
+
+from typo import validate_many
+
+T = TypeVar('T')
+
+
+def test_validate_many():
+    rows = [(1, 'a'), (2, 3), (3, 'c'), ('4', 'd')]
+    assert list(validate_many(rows, Tuple[int, str])) == [
+        (1, 'invalid item #1 of row #1: expected str, got int'),
+        (3, 'invalid item #0 of row #3: expected int, got str')
+    ]
+    assert list(validate_many(rows, Tuple[int, str], fail_fast=True)) == [
+        (1, 'invalid item #1 of row #1: expected str, got int')
+    ]
+    assert list(validate_many(rows, Any)) == []
+    assert list(validate_many([], int)) == []
+
+
+def test_validate_many_typevars():
+    # typevars are bound separately for each row
+    rows = [{'a': 1, 'b': 2}, {'a': 'b'}, {'a': 1, 'b': 'c'}]
+    assert list(validate_many(rows, Dict[str, T])) == [
+        (2, "invalid value at 'b' of row #2: cannot assign str to T")
+    ]
+
+
+def test_validate_many_stream():
+    rows = ([i] if i % 1000 else ['x'] for i in itertools.count(1))
+    errors = validate_many(rows, List[int])
+    assert next(errors) == (999, 'invalid item #0 of row #999: expected int, got str')
+    assert next(errors)[0] == 1999
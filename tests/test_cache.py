@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+
+from typing import List
+
+from typo.cache import code_cache, enable_cache, disable_cache, cache_info
+from typo.decorator import type_check
+from typo.handlers import Handler, HandlerMeta
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    enable_cache(str(tmpdir))
+    code_cache.clear()
+    HandlerMeta.interned.clear()
+    yield str(tmpdir)
+    disable_cache()
+    code_cache.clear()
+
+
+def define(annotation):
+    def f(x: annotation) -> str:
+        return str(x)
+    return f
+
+
+def test_cache_hit(cache_dir):
+    f1 = type_check(define(int))
+    assert cache_info() == (0, 1)
+    assert len(os.listdir(cache_dir)) == 1
+    f2 = type_check(define(int))
+    assert cache_info() == (1, 1)
+    assert f1.wrapper_code == f2.wrapper_code
+    assert f2(1) == '1'
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected int, got str', f2, 'a')
+
+
+def test_cache_annotations(cache_dir):
+    type_check(define(int))
+    f = type_check(define(str))
+    assert cache_info() == (0, 2)
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected str, got int', f, 1)
+    type_check(define(str))
+    assert cache_info() == (1, 2)
+
+
+def test_cache_stale(cache_dir):
+    code_cache.compile('x = 1', 'key')
+    context = {}
+    exec(code_cache.compile('x = 2', 'key'), context)
+    assert context['x'] == 2
+    assert cache_info() == (0, 2)
+    assert len(os.listdir(cache_dir)) == 1
+    exec(code_cache.compile('x = 2', 'key'), context)
+    assert cache_info() == (1, 2)
+
+
+def test_cache_corrupt(cache_dir):
+    type_check(define(int))
+    filename, = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, filename), 'r+b') as f:
+        f.truncate(os.path.getsize(f.name) - 10)
+    f = type_check(define(int))
+    assert cache_info() == (0, 2)
+    assert f(1) == '1'
+    type_check(define(int))
+    assert cache_info() == (1, 2)
+
+
+def test_cache_handler(cache_dir):
+    Handler(List[int]).compile()
+    Handler(List[int]).compile(sample=1)
+    assert Handler(List[int]).compile() is Handler(List[int]).compile()
+    assert cache_info() == (0, 2)
+    HandlerMeta.interned.clear()
+    check = Handler(List[int]).compile()
+    assert cache_info() == (1, 2)
+    pytest.raises_regexp(TypeError, 'invalid item #0 of input', check, ['a'])
+
+
+def test_cache_disabled():
+    disable_cache()
+    type_check(define(int))
+    assert cache_info() == (0, 0)
+
+
+def test_memory_cache():
+    # functions differing only in their names share the compiled code
+    def g(x: int) -> str:
+        raise ValueError
+
+    code_cache.clear()
+    f1 = type_check(define(int))
+    f2 = type_check(define(int))
+    assert len(code_cache.memory) == 1
+    g = type_check(g)
+    assert len(code_cache.memory) == 1 and cache_info() == (0, 0)
+    assert f1 is not f2 and f1.__code__.co_code == g.__code__.co_code
+    assert (f1.__name__, g.__name__, g.__code__.co_name) == ('f', 'g', 'g')
+    assert g.wrapper_code.startswith('def g(')
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected int, got str', g, 'a')
+    with pytest.raises(ValueError) as exc:
+        g(1)
+    assert [entry.name for entry in exc.traceback[1:]] == ['g', 'g']
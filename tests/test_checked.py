@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import pytest
+
+from typing import Dict, List, Sequence, Tuple, TypeVar, Union
+
+from typo import checked_list, checked_dict, is_instance, type_check
+from typo.handlers import Handler
+from typo.utils import CheckedList, CheckedDict
+
+T = TypeVar('T')
+
+
+def test_checked_list():
+    xs = checked_list(List[Tuple[int, str]], [(1, 'a')])
+    xs.append((2, 'b'))
+    xs.extend([(3, 'c')])
+    xs += [(4, 'd')]
+    xs[0] = (0, 'a')
+    xs[1:3] = [(1, 'b')]
+    xs.insert(0, (-1, 'z'))
+    assert xs == [(-1, 'z'), (0, 'a'), (1, 'b'), (4, 'd')]
+    assert type(xs[:1]) is list and type(copy.copy(xs)) is list
+
+    msg = 'invalid item #{} of checked List\\[Tuple\\[int, str\\]\\]: expected tuple, got int'
+    pytest.raises_regexp(TypeError, msg.format(4), xs.append, 1)
+    pytest.raises_regexp(TypeError, msg.format(5), xs.extend, [(1, 'a'), 1])
+    pytest.raises_regexp(TypeError, msg.format(2), xs.__setitem__, 2, 1)
+    pytest.raises_regexp(TypeError, msg.format(3), xs.__setitem__, -1, 1)
+    pytest.raises_regexp(TypeError, msg.format(2), xs.insert, -2, 1)
+    pytest.raises_regexp(TypeError, msg.format(0), xs.insert, -10, 1)
+    pytest.raises_regexp(TypeError, msg.format(1), xs.__setitem__, slice(1, None), [1])
+    pytest.raises_regexp(TypeError, msg.format(0), xs.insert, 0, 1)
+    pytest.raises_regexp(TypeError, msg.format(1), checked_list, List[Tuple[int, str]],
+                         [(1, 'a'), 1])
+    assert len(xs) == 4
+    pytest.raises_regexp(TypeError, msg.format(1), xs.__init__, [(1, 'a'), 1])
+    assert len(xs) == 4
+    xs.__init__([(5, 'e')])
+    assert xs == [(5, 'e')]
+    pytest.raises_regexp(TypeError, 'can only be created by typo.checked_list', CheckedList,
+                         [1])
+
+
+def test_checked_dict():
+    d = checked_dict(Dict[str, Tuple[int, ...]], {'a': (1,)}, b=())
+    d['c'] = (2,)
+    d.update({'d': ()}, e=(3,))
+    assert d.setdefault('f', ()) == () and d.setdefault('a') == (1,)
+    assert d == {'a': (1,), 'b': (), 'c': (2,), 'd': (), 'e': (3,), 'f': ()}
+    pytest.raises_regexp(TypeError, "invalid item #0 of value at 'x' of checked "
+                         "Dict\\[str, Tuple\\[int, ...\\]\\]: expected int, got str",
+                         d.__setitem__, 'x', ('a',))
+    pytest.raises_regexp(TypeError, 'invalid key of checked', d.update, {1: ()})
+    pytest.raises_regexp(TypeError, "invalid value at 'x' of checked", d.setdefault, 'x')
+    assert 'x' not in d and 1 not in d
+    assert type(d.fromkeys('ab')) is dict and d.fromkeys('ab', 1) == {'a': 1, 'b': 1}
+    pytest.raises_regexp(TypeError, "invalid value at 'x' of checked", d.__init__, x=1)
+    d.__init__({'g': (4,)})
+    assert d['g'] == (4,) and len(d) == 7
+    pytest.raises_regexp(TypeError, 'can only be created by typo.checked_dict', CheckedDict)
+
+
+@pytest.mark.parametrize('hint', [Dict[str, int], List[T], Sequence[int]])
+def test_invalid_hint(hint):
+    pytest.raises_regexp(ValueError, 'invalid type hint of a checked container',
+                         checked_list, hint)
+
+
+@pytest.mark.parametrize('hint', [List[List[int]], List[Tuple[int, Dict[str, int]]],
+                                  List[Union[int, List[int]]]])
+def test_mutable_items(hint):
+    # items could be changed after they've been checked, without checking them again
+    pytest.raises_regexp(ValueError, 'items of a checked container must be checked by type '
+                         'only', checked_list, hint)
+    pytest.raises_regexp(ValueError, 'items of a checked container must be checked by type '
+                         'only', checked_dict, Dict[str, hint])
+    checked_list(List[Union[int, list, Tuple[str, ...]]], [1, [], ('a',)])
+
+
+@pytest.mark.parametrize('tiered', [None, 0])
+def test_skip_checks(tiered):
+    # items are not checked again by handlers of the same type hint
+    @type_check(tiered=tiered)
+    def f(xs: List[int], d: Dict[str, int]) -> Tuple[List[int], Dict[str, int]]:
+        return xs, d
+
+    xs, d = checked_list(List[int], [1]), checked_dict(Dict[str, int], a=1)
+    list.append(xs, 'a')
+    dict.__setitem__(d, 'b', 'c')
+    assert f(xs, d) == (xs, d)
+    assert is_instance(xs, List[int]) and Handler(List[int]).predicate()(xs)
+    Handler(List[int]).validate(xs)
+    assert not is_instance(xs, Sequence[int]) and not is_instance(d, Dict[str, str])
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `xs`', f, list(xs), d)
@@ -1,6 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import pytest
+
+from typing import Any, Iterable, List, Dict, Tuple, TypeVar, Union
+
 from pytest import _, type_check_test
+from typo import instrumentation
+from typo.decorator import type_check, type_check_class, call_stats
+from typo.handlers import Handler
+from typo.switch import disable, reset
+
+T = TypeVar('T')
+
+
+@pytest.fixture(autouse=True)
+def disable_stats(monkeypatch):
+    # Instrumented wrappers call compiled checkers differently, regardless of TYPO_STATS.
+    monkeypatch.setattr(instrumentation, 'enabled', False)
 
 
 @type_check_test()
@@ -8,6 +25,18 @@ def test_wrapper(x: int, *args, **kwargs: type('T', (), {})) -> int:
     "Test docstring."
 
 
+@type_check_test(
+    ok=[
+        _(1)
+    ],
+    fail=[
+        (_(0), 'invalid return value: expected NoneType, got int')
+    ]
+)
+def test_returns_none(x: int) -> None:
+    return x if not x else None
+
+
 @type_check_test(
     ok=[
         _(1.1)
@@ -65,3 +94,250 @@ def test_varargs(*args: int):
 )
 def test_mixed_args(a: int, *, b: str = 'foo', **kwargs: float):
     ...
+
+
+@type_check_test(
+    ok=[
+        _([1] * 100, *range(100), **{str(i): i for i in range(100)})
+    ],
+    fail=[
+        (_([1, 'a']), 'invalid item #1 of `x`: expected int, got str'),
+        (_([1] * 50 + ['a']), 'invalid item #50 of `x`: expected int, got str'),
+        (_([], *([1] * 50 + ['a'])), r'invalid item #50 of `\*args`: expected int, got str'),
+        (_([], a='a'), 'invalid keyword argument `a`: expected int, got str')
+    ],
+    sample=5
+)
+def test_sample(x: List[int], *args: int, **kwargs: int):
+    ...
+
+
+def test_tiered():
+    def f(x: int, *, y: List[int]=[1]) -> int:
+        return x
+
+    wrapped = type_check(f, tiered=2)
+    code = wrapped.__code__
+    assert wrapped.wrapper_code is None
+    assert wrapped(1) == 1
+    pytest.raises_regexp(TypeError, 'invalid item #0 of `y`', wrapped, 1, y=['a'])
+    assert wrapped.__code__ is code
+    assert wrapped(2, y=[]) == 2
+    assert wrapped.__code__ is not code
+    assert isinstance(wrapped.wrapper_code, str)
+    assert wrapped(3) == 3
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected int, got str', wrapped, 'a')
+    pytest.raises_regexp(TypeError, 'invalid item #0 of `y`', wrapped, 1, y=['a'])
+
+
+@pytest.mark.parametrize('tiered', [-1, 1.5])
+def test_tiered_invalid(tiered):
+    pytest.raises_regexp(ValueError, 'number of calls must be a non-negative integer',
+                         type_check, tiered=tiered, func=lambda: None)
+
+
+def test_shared_checkers():
+    def f(x: Dict[str, List[int]], y: int):
+        ...
+
+    def g(z: Dict[str, List[int]]):
+        ...
+
+    checker = Handler(Dict[str, List[int]]).compile()
+    f, g = type_check(f), type_check(g)
+    assert checker in f.__globals__.values()
+    assert checker in g.__globals__.values()
+    pytest.raises_regexp(TypeError, "invalid item #1 of value at 'a' of `z`",
+                         g, {'a': [1, 'b']})
+
+
+@pytest.mark.parametrize('tiered', [None, 0])
+def test_context_names(tiered):
+    # the name of the wrapper doesn't shadow the globals of the generated code
+    @type_check(tiered=tiered, sample=2)
+    def collections(xs: Iterable[int], ys: List[int]=[]) -> int:
+        return sum(xs)
+
+    for i in range(2):
+        assert collections([1, 2]) == 3 and collections(iter([1]), [1] * 10) == 1
+        pytest.raises_regexp(TypeError, 'invalid item #0 of `ys`', collections, [], ['a'])
+
+
+@pytest.mark.parametrize('tiered', [None, 0])
+def test_forward_reference_limits(tiered):
+    Tree = List[Union[int, 'Tree']]
+
+    @type_check(tiered=tiered, check_once=True)
+    def f(x: Tree, *args: Tree) -> Tree:
+        return x
+
+    @type_check(tiered=tiered, forward_ref_depth=2)
+    def g(x: Tree) -> int:
+        return 0
+
+    cyclic = [1]
+    cyclic.append(cyclic)
+    for i in range(2):
+        assert f(cyclic, cyclic) is cyclic and g([[['a']]]) == 0
+        pytest.raises_regexp(TypeError, 'invalid item #1 of `x`', f, [1, 'a'])
+        pytest.raises_regexp(TypeError, 'invalid item #0 of `x`', g, [['a']])
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_every(tiered):
+    @type_check(every=3, tiered=tiered)
+    def f(x: int) -> int:
+        return x
+
+    pytest.raises_regexp(TypeError, 'invalid `x`', f, 'a')
+    assert f('b') == 'b'
+    assert f('c') == 'c'
+    pytest.raises_regexp(TypeError, 'invalid `x`', f, 'd')
+    assert f(1) == 1
+    assert call_stats(f) == (2, 3)
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_rate(tiered, monkeypatch):
+    values = iter([0.1, 0.25, 0.9, 0.2])
+    monkeypatch.setattr('random.random', lambda: next(values))
+
+    @type_check(rate=0.25, tiered=tiered)
+    def f(x: int) -> int:
+        return x
+
+    pytest.raises_regexp(TypeError, 'invalid `x`', f, 'a')
+    assert f('b') == 'b'
+    assert f('c') == 'c'
+    assert f(1) == 1
+    assert call_stats(f) == (2, 2)
+
+
+def test_verdict_cache():
+    calls = []
+
+    class Spy(list):
+        def __iter__(self):
+            calls.append(self)
+            return super().__iter__()
+
+    @type_check(verdict_cache=2)
+    def f(x: Tuple[int, ...], y: List[int]) -> int:
+        return len(x)
+
+    a, b, c = tuple(range(10)), tuple(range(20)), tuple(range(30))
+    y = Spy([1])
+    for i in range(3):
+        assert f(a, y) == 10
+        assert f(b, y) == 20
+    assert len(calls) == 6
+
+    caches = [v for v in f.__globals__.values() if isinstance(v, collections.OrderedDict)]
+    assert len(caches) == 2
+    cache = caches[0] if a in caches[0].values() else caches[1]
+    assert list(cache.values()) == [a, b]
+    f(c, y)
+    assert list(cache.values()) == [b, c]
+
+    bad = (1, 'a')
+    for i in range(2):
+        pytest.raises_regexp(TypeError, 'invalid item #1 of `x`', f, bad, y)
+    assert bad not in cache.values()
+
+    @type_check(verdict_cache=2)
+    def g(x: Tuple[Any, ...]):
+        ...
+
+    nested = ((1, 2), 'a', b'b', 1.0, None, frozenset([1]))
+    g(nested)
+    g((1, [2]))
+    cache, = [v for v in g.__globals__.values() if isinstance(v, collections.OrderedDict)]
+    assert list(cache.values()) == [nested]
+
+
+@pytest.mark.parametrize('options, msg', [
+    ({'verdict_cache': 0}, 'cache size must be a positive integer'),
+    ({'rate': 0}, r'rate must be a number in \(0, 1\]'),
+    ({'rate': 1.5}, r'rate must be a number in \(0, 1\]'),
+    ({'every': 0}, 'number of calls must be a positive integer'),
+    ({'rate': 0.5, 'every': 2}, 'mutually exclusive'),
+    ({'sample': 2, 'verdict_cache': 2}, 'mutually exclusive')
+])
+def test_partial_invalid(options, msg):
+    pytest.raises_regexp(ValueError, msg, type_check, lambda: None, **options)
+
+
+def test_call_stats_invalid():
+    def f():
+        ...
+
+    pytest.raises_regexp(ValueError, 'call statistics are only collected',
+                         call_stats, type_check(f))
+
+
+def test_type_check_class():
+    @type_check_class(every=1)
+    class A:
+        def __init__(self, x: int) -> None:
+            self._x = x
+
+        @property
+        def x(self) -> int:
+            "Docstring."
+            return self._x
+
+        @x.setter
+        def x(self, value: int) -> None:
+            self._x = value
+
+        @staticmethod
+        def first(xs: List[int]) -> int:
+            return xs[0]
+
+        @classmethod
+        def pair(cls, a: T, b: T) -> Tuple[object, object]:
+            return cls(a), cls(b)
+
+        @type_check
+        def checked(self, x: int):
+            ...
+
+        def len(self, x: str) -> int:
+            return len(x)
+
+        def plain(self, x):
+            return x
+
+        def collections(self, xs: List[int]) -> int:
+            return len(xs)
+
+        def itertools(self, xs: Iterable[int]) -> int:
+            return sum(xs)
+
+    a = A(1)
+    a.x = 2
+    assert a.x == 2 and A.first([3]) == 3 and a.len('abc') == 3 and a.plain('a') == 'a'
+    assert a.collections([1]) == 1 and a.itertools([1, 2]) == 3
+    assert A.collections.__code__.co_name == 'collections'
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected int, got str', A, 'a')
+    pytest.raises_regexp(TypeError, 'invalid `value`: expected int, got str',
+                         setattr, a, 'x', 'a')
+    pytest.raises_regexp(TypeError, 'invalid item #0 of `xs`', A.first, ['a'])
+    pytest.raises_regexp(TypeError, 'invalid `b`: cannot assign str to T', A.pair, 1, 'a')
+    pytest.raises_regexp(TypeError, 'invalid `x`: expected str, got int', a.len, 1)
+    assert A.x.__doc__ == 'Docstring.'
+    assert A.__init__.__qualname__.endswith('.A.__init__')
+    assert 'plain' not in A.__dict__['plain'].__globals__
+
+    # all wrappers share the same globals, but can still be switched separately
+    wrappers = [A.__init__, A.x.fget, A.x.fset, A.__dict__['first'].__func__, A.len]
+    assert len(set(id(w.__globals__) for w in wrappers)) == 1
+    assert all(w.wrapper_code.startswith('def {}('.format(w.__name__)) for w in wrappers)
+    assert A.checked.__globals__ is not A.len.__globals__
+    assert call_stats(A.len) == (2, 0)
+    disable(A.len)
+    try:
+        pytest.raises_regexp(TypeError, 'has no len', a.len, 1)
+        pytest.raises_regexp(TypeError, 'invalid `x`', A, 'a')
+    finally:
+        reset(A.len)
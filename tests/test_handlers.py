@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import array
 import collections
 import pytest
+import struct
+import threading
 
 from collections import OrderedDict
 
-from typo.handlers import Handler
-from typing import Any, List, Tuple, Dict, Sequence, MutableSequence, Set, TypeVar
+from typo.codegen import Codegen
+from typo.handlers import Handler, HandlerMeta, ForwardRefHandler
+from typo.utils import RecursionGuard
+from typing import (Any, List, Tuple, Dict, Iterator, Sequence, MutableSequence, Set, TypeVar,
+                    Union)
 
 
 pytest.add_handler_test(
@@ -238,6 +244,50 @@ pytest.add_handler_test(
     ]
 )
 
+pytest.add_handler_test(
+    'test_sequence_buffer', Sequence[int], 'Sequence[int]',
+    ok=[
+        b'abc',
+        bytearray(b'abc'),
+        array.array('q', [1, 2]),
+        array.array('B'),
+        memoryview(b'abc'),
+        memoryview(array.array('h', [1, 2])),
+        memoryview(struct.pack('<3?', True, False, True)).cast('?')
+    ],
+    fail=[
+        (array.array('d', [1.0]), 'invalid item #0.*expected int, got float'),
+        (array.array('u', 'ab'), 'invalid item #0.*expected int, got str'),
+        (memoryview(b'ab').cast('c'), 'invalid item #0.*expected int, got bytes')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_sequence_buffer_float', Sequence[float], 'Sequence[float]',
+    ok=[
+        array.array('f', [1.0]),
+        memoryview(array.array('d', [1.0, 2.0]))
+    ],
+    fail=[
+        (b'ab', 'invalid item #0.*expected float, got int'),
+        (array.array('i', [1]), 'invalid item #0.*expected float, got int')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_mutable_sequence_buffer', MutableSequence[Union[int, float]],
+    'MutableSequence[Union[int, float]]',
+    ok=[
+        bytearray(b'abc'),
+        array.array('l', [1, 2]),
+        array.array('d', [1.0])
+    ],
+    fail=[
+        (b'ab', 'expected mutable sequence, got bytes'),
+        (array.array('u', 'a'), 'invalid item #0.*expected int or float, got str')
+    ]
+)
+
 pytest.add_handler_test(
     'test_set', Set[int], 'Set[int]',
     ok=[
@@ -262,13 +312,158 @@ pytest.add_handler_test(
     ]
 )
 
+pytest.add_handler_test(
+    'test_set_union', Set[Union[int, str]], 'Set[Union[int, str]]',
+    ok=[
+        set(),
+        {1, 'foo', True}
+    ],
+    fail=[
+        ({1, 'foo', 2.5}, 'invalid item of.*expected int or str, got float')
+    ]
+)
+
+
+class MyList(list):
+    ...
 
-@pytest.mark.parametrize('bound', [
-    List['T'], List[TypeVar('T', int, 'T')]
-])
-def test_forward_reference(bound):
-    pytest.raises_regexp(ValueError, 'forward references are not currently supported',
-                         Handler, bound)
+
+pytest.add_handler_test(
+    'test_union_dispatch', Union[List[int], Dict[str, int], Tuple[int, ...], Sequence[str]],
+    'Union[List[int], Dict[str, int], Tuple[int, ...], Sequence[str]]',
+    ok=[
+        [1, 2],
+        {'a': 1},
+        (1, 2),
+        ['a', 'b'],
+        ('a',),
+        MyList([1]),
+        MyList(['a']),
+        OrderedDict([('a', 1)]),
+        'abc'
+    ],
+    fail=[
+        ([1.5], 'expected List\\[int\\], .* or Sequence\\[str\\], got list'),
+        (MyList([1.5]), 'got test_handlers.MyList'),
+        ({1: 1}, 'got dict'),
+        (1, 'got int')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_union_dispatch_types', Union[collections.Hashable, List[int], Set[int]],
+    'Union[collections.abc.Hashable, List[int], Set[int]]',
+    ok=[
+        (1.5,),
+        [1],
+        {1},
+        'a'
+    ],
+    fail=[
+        ([1.5], 'got list'),
+        ({1.5}, 'got set')
+    ]
+)
+
+
+class Str(str):
+    ...
+
+
+pytest.add_handler_test(
+    'test_homogeneous_subclass', Dict[str, List[int]], 'Dict[str, List[int]]',
+    ok=[
+        {Str('a'): [True, 2], 'b': [False]},
+        {'a': list(range(100))}
+    ],
+    fail=[
+        ({'a': [1, 2], Str('b'): [True, 2.5]}, 'invalid item #1 of value at \'b\'.*got float'),
+        ({'a': [], 1: []}, 'invalid key of.*expected str, got int')
+    ]
+)
+
+
+Node = Dict[str, Union[int, List['Node']]]
+
+
+@pytest.mark.parametrize('sample', [None, 2])
+def test_forward_reference(sample):
+    handler = Handler(Node)
+    check = handler.compile(sample=sample)
+    value = {'a': 1, 'b': [{'c': 2}, {'d': [{}]}]}
+    check(value)
+    handler.validate(value)
+    assert handler.predicate()(value)
+    assert str(Handler(List['Node'])) == 'List[Node]'
+    for invalid in [{'a': [{'c': 'x'}]}, {'b': [{'d': [{1: []}]}]}]:
+        assert not handler.predicate()(invalid)
+        pytest.raises_regexp(TypeError, "^invalid value at '.' of input: expected int or "
+                             "List\\[Node\\], got list$", check, invalid)
+        pytest.raises_regexp(TypeError, "^invalid value at '.' of input", handler.validate,
+                             invalid)
+
+
+def test_forward_reference_invalid():
+    # forward references are only resolved when the values are checked
+    check = Handler(List['Undefined']).compile()  # noqa: F821
+    check([])
+    pytest.raises_regexp(ValueError, "cannot resolve forward reference 'Undefined'",
+                         check, [1])
+    T = TypeVar('T')
+    pytest.raises_regexp(ValueError, "forward references to generic type hints are not "
+                         "supported: 'List\\[T\\]'", Handler(Tuple['List[T]']).compile(), (1,))
+    It = Iterator[int]  # noqa: F841
+    pytest.raises_regexp(ValueError, "forward references to lazy type hints are not "
+                         "supported: 'It'", Handler(Union[int, 'It']).compile(), iter([]))
+    pytest.raises_regexp(ValueError, 'invalid typevar constraint', Handler,
+                         List[TypeVar('T', int, 'T')])
+
+
+def test_forward_reference_limits():
+    Tree = List[Union[int, 'Tree']]
+    deep, cyclic, shared = [1], [1], [1]
+    for _ in range(10000):
+        deep = [deep]
+    cyclic.append(cyclic)
+    for _ in range(100):
+        shared = [shared, shared]
+    handler = Handler(Tree, max_depth=100, check_once=True)
+    for value in (deep, cyclic, shared):
+        handler.compile()(value)
+        handler.compile(sample=2)(value)
+        assert handler.predicate()(value)
+        handler.validate(value)
+    pytest.raises_regexp(TypeError, '^invalid item #1 of input: expected int or Tree, got list$',
+                         handler.compile(), [1, [2, [cyclic, 'a']]])
+    assert not handler.predicate()([[cyclic], [[cyclic, 'a']]])
+    pytest.raises_regexp(ValueError, 'forward reference depth must be a positive integer',
+                         Handler, Tree, max_depth=0)
+
+
+def test_forward_reference_limits_per_handler(monkeypatch):
+    # handlers with different limits are separate, and the defaults only apply to new handlers
+    Tree = List[Union[int, 'Tree']]
+    handler = Handler(Tree)
+    handler.compile()([1, [2]])
+    assert Handler(Tree, check_once=True) is not handler
+    assert Handler(Tree, check_once=True) is Handler(Tree, check_once=True)
+    cyclic = [1]
+    cyclic.append(cyclic)
+    Handler(Tree, check_once=True).compile()(cyclic)
+    monkeypatch.setattr(ForwardRefHandler, 'check_once', True)
+    assert Handler(Tree) is not handler
+    Handler(Tree).validate(cyclic)
+    pytest.raises(RecursionError, handler.compile(), cyclic)
+
+
+def test_recursion_guard_threads():
+    guard = RecursionGuard(1, False)
+    assert guard.enter([])
+    entered = []
+    thread = threading.Thread(target=lambda: entered.append(guard.enter([])))
+    thread.start()
+    thread.join()
+    assert entered == [True] and not guard.enter([])
 
 
 @pytest.mark.parametrize('bound', [
@@ -367,3 +562,159 @@ pytest.add_handler_test(
         (([], 1, 'a'), 'cannot assign str to T')
     ]
 )
+
+pytest.add_handler_test(
+    'test_typevar_same_type', Tuple[List[T], Dict[U, T], T], 'Tuple[List[T], Dict[U, T], T]',
+    ok=[
+        ([], {}, 'a'),
+        ([1, 2], {'a': 3}, 4),
+        ([Int(1)], {}, Int(2))
+    ],
+    fail=[
+        (([1, 'a'], {}, 1), 'invalid item #1 of item #0.*cannot assign str to T'),
+        (([1, 2], {'a': 'b'}, 1), 'invalid value at \'a\' of item #1.*cannot assign str to T'),
+        (([1, 2], {'a': 3, 4: 5}, 1), 'invalid key of item #1.*cannot assign int to U'),
+        (([1, 2], {}, Int(3)), 'invalid item #2.*cannot assign test_handlers.Int to T')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_typevar_union', Tuple[Union[Tuple[T, T], T], T], 'Tuple[Union[Tuple[T, T], T], T]',
+    ok=[
+        ((1, 2), 3),
+        ((1, 'a'), (2, 3)),
+        ('a', 'b')
+    ],
+    fail=[
+        (((1, 'a'), 2), 'invalid item #1.*cannot assign int to T'),
+        (((1, 2), 'a'), 'invalid item #1.*cannot assign str to T')
+    ]
+)
+
+
+@pytest.mark.parametrize('bound, branches', [
+    (List[T], False),
+    (Tuple[T, Dict[U, V], W], False),
+    (Union[int, List[int]], False),
+    (Union[int, List[T]], True),
+    (Dict[int, X], True)
+])
+def test_typevar_branches(bound, branches):
+    assert Handler(bound).typevar_branches == branches
+
+
+@pytest.mark.parametrize('bound, value', [
+    (List[int], [1] * 100),
+    (Sequence[int], tuple(range(100))),
+    (Tuple[int, ...], (1,) * 100),
+    (Set[int], set(range(100))),
+    (Dict[int, str], {i: str(i) for i in range(100)})
+])
+def test_sample_ok(bound, value):
+    Handler(bound).compile(sample=3)(value)
+
+
+@pytest.mark.parametrize('value, msg', [
+    ([1, 2, 'a'], 'invalid item #2'),
+    (['a'] + [1] * 100, 'invalid item #0'),
+    ([1] * 100 + ['a'], 'invalid item #100'),
+    ([1] * 3 + ['a'] + [1] * 2, 'invalid item #3')
+])
+def test_sample_fail(value, msg):
+    check = Handler(List[int]).compile(sample=2)
+    pytest.raises_regexp(TypeError, msg, check, value)
+
+
+@pytest.mark.parametrize('bound', [Sequence[int], Union[None, Sequence[int]]])
+def test_sample_mapping(bound):
+    # sequences are checked by their interface, so they may not be indexed by position
+    handler = Handler(bound)
+    handler.compile(sample=2)({0: 1, 5: 2, 7: 3})
+    handler.validate({0: 1, 5: 2, 7: 3}, sample=2)
+    pytest.raises(TypeError, handler.compile(sample=2), {0: 1, 'a': 2})
+
+
+def test_sample_skips_middle():
+    check = Handler(List[int]).compile(sample=1)
+    value = [1] * 1000
+    value[500] = 'a'
+    failed = 0
+    for _ in range(100):
+        try:
+            check(value)
+        except TypeError:
+            failed += 1
+    assert failed < 100
+
+
+def test_diagnostic_checker():
+    # failures are only described (by a separately compiled checker) when the fast path fails
+    handler = Handler(Dict[str, List[Tuple[int, str]]])
+    check = handler.compile()
+    check({'a': [(1, 'b')]})
+    assert not handler.compiled_diagnostic
+    pytest.raises_regexp(TypeError, "invalid item #1 of item #0 of value at 'a' of `x`: "
+                         "expected str, got int", check, {'a': [(1, 2)]}, '`x`')
+    assert list(handler.compiled_diagnostic) == [None]
+    handler.compiled_diagnostic[None] = lambda value, desc: None
+    try:
+        pytest.raises_regexp(TypeError, 'invalid input: expected Dict\\[str, ',
+                             check, {'a': 1})
+    finally:
+        del handler.compiled_diagnostic[None]
+
+
+@pytest.mark.parametrize('sample', [0, -1, 1.5])
+def test_sample_invalid(sample):
+    pytest.raises_regexp(ValueError, 'sample size must be a positive integer',
+                         Handler(List[int]).compile, sample=sample)
+
+
+def test_interned():
+    assert Handler(Dict[str, List[int]]) is Handler(Dict[str, List[int]])
+    assert Handler(List[int]) is Handler(Dict[str, List[int]]).value_handler
+    assert Handler(Union[int, str]) is not Handler(Union[str, int])
+    assert str(Handler(Union[str, int])) == 'Union[str, int]'
+    assert Handler(List[int]).compile() is Handler(List[int]).compile()
+    assert Handler(List[int]).compile() is not Handler(List[int]).compile(sample=1)
+
+
+def test_interned_lru(monkeypatch):
+    monkeypatch.setattr(HandlerMeta, 'max_interned', 2)
+    HandlerMeta.interned.clear()
+    h1, h2 = Handler(int), Handler(str)
+    assert Handler(int) is h1
+    Handler(float)
+    assert len(HandlerMeta.interned) == 2
+    assert Handler(int) is h1
+    assert Handler(str) is not h2
+
+
+def test_deep_hint():
+    # nested handlers beyond the inlining depth are checked by calling their own checkers
+    hint, value, invalid = int, 1, 'a'
+    for _ in range(50):
+        hint, value, invalid = List[hint], [value], [invalid]
+    handler = Handler(hint)
+    handler.compile()(value)
+    assert handler.predicate()(value) and not handler.predicate()(invalid)
+    pytest.raises_regexp(TypeError, '^invalid (item #0 of ){50}input: expected int, got str$',
+                         handler.compile(), invalid)
+    pytest.raises_regexp(TypeError, '^invalid (item #0 of ){50}input: expected int, got str$',
+                         handler.compile(sample=1), invalid)
+
+
+@pytest.mark.parametrize('sample', [None, 2])
+def test_shared_checkers(sample, monkeypatch):
+    # checks of repeated (or all nested) handlers aren't inlined, with the same results
+    monkeypatch.setattr(Codegen, 'max_repeated_lines', 1)
+    handler = Handler(Tuple[Dict[str, List[Tuple[int, str]]], Dict[str, List[Tuple[int, str]]]])
+    check = handler.compile(sample=sample)
+    assert Handler(Dict[str, List[Tuple[int, str]]]).compiled_predicate is not None
+    check(({'a': [(1, 'b')]}, {}))
+    pytest.raises_regexp(TypeError, "^invalid item #1 of item #0 of value at 'a' of item #1 of "
+                         "input: expected str, got int$", check, ({}, {'a': [(1, 2)]}))
+    monkeypatch.setattr(Codegen, 'max_inline_depth', 0)
+    check = Handler(Union[int, List[Union[int, Tuple[str, List[int]]]]]).compile(sample=sample)
+    check([1, ('a', [1])])
+    pytest.raises_regexp(TypeError, '^invalid input: expected int or List', check, [('a', 'b')])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import io
+import pytest
+
+from typing import Dict, List, Tuple, Union
+
+from typo import instrumentation
+from typo.decorator import type_check, type_check_class
+from typo.instrumentation import enable_stats, disable_stats, reset_stats, stats, dump_stats
+
+
+@pytest.fixture(autouse=True)
+def clear_stats(monkeypatch):
+    # Tests start with instrumentation disabled, regardless of TYPO_STATS.
+    monkeypatch.setattr(instrumentation, 'enabled', False)
+    reset_stats()
+
+
+def function_stats(func):
+    name = instrumentation.function_name(func)
+    result, = [s for s in stats() if s.name == name]
+    return result
+
+
+@pytest.mark.parametrize('tiered', [None, 0])
+def test_instrument(tiered):
+    @type_check(instrument=True, tiered=tiered)
+    def f(x: Dict[str, List[int]], y: Union[int, List[Tuple[int, str]]]) -> int:
+        return len(x)
+
+    for _ in range(3):
+        assert f({'a': [1, 2], 'b': []}, [(1, 'a')]) == 2
+    assert f({}, 1) == 0
+    pytest.raises_regexp(TypeError, 'invalid `y`', f, {}, 'a')
+
+    func = function_stats(f)
+    assert func.calls == 5
+    nodes = {node.path: node for node in func.nodes}
+    assert set(nodes) == {
+        'f.x', 'f.x -> Dict.key', 'f.x -> Dict.value', 'f.x -> Dict.value -> List.item',
+        'f.y', 'f.y -> Union.List[Tuple[int, str]]',
+        'f.y -> Union.List[Tuple[int, str]] -> List.item',
+        'f.y -> Union.List[Tuple[int, str]] -> List.item -> Tuple.0',
+        'f.y -> Union.List[Tuple[int, str]] -> List.item -> Tuple.1',
+        'f.return'
+    }
+    assert nodes['f.x'].count == 5 and nodes['f.y'].count == 4
+    assert nodes['f.x -> Dict.value'].count == 6
+    assert nodes['f.y -> Union.List[Tuple[int, str]]'].count == 3
+    assert nodes['f.return'].count == 4
+    assert func.total_ns == sum(nodes[n].total_ns for n in ['f.x', 'f.y', 'f.return']) > 0
+    assert [node.total_ns for node in func.nodes] == \
+        sorted((node.total_ns for node in func.nodes), reverse=True)
+
+    out = io.StringIO()
+    dump_stats(out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].split() == ['calls', 'total', 'ms', 'us/call', 'function', '/', 'node']
+    assert any(line.split()[0] == '5' and line.endswith('.f') for line in lines)
+    assert any(line.endswith(' f.x -> Dict.value') for line in lines)
+
+    reset_stats()
+    func = function_stats(f)
+    assert func.calls == 0 and func.total_ns == 0
+    f({}, 1)
+    assert function_stats(f).calls == 1
+
+
+def test_instrument_disabled():
+    def f(x: List[int]) -> int:
+        return 1
+
+    assert 'rt_clock' not in type_check(f).wrapper_code
+    enable_stats()
+    try:
+        assert 'rt_clock' in type_check(f).wrapper_code
+        assert 'rt_clock' not in type_check(f, instrument=False).wrapper_code
+    finally:
+        disable_stats()
+    assert 'rt_clock' not in type_check(f).wrapper_code
+
+
+def test_instrument_class():
+    @type_check_class(instrument=True)
+    class A:
+        def f(self, x: int) -> None:
+            ...
+
+        @staticmethod
+        def g(x: List[int]) -> None:
+            ...
+
+        def h(self, x: int):
+            ...
+
+    A().f(1)
+    A.g([1])
+    assert {node.path for node in function_stats(A.f).nodes} == {'f.x', 'f.return'}
+    assert {node.path for node in function_stats(A.g).nodes} == \
+        {'g.x', 'g.x -> List.item', 'g.return'}
+    assert function_stats(A.h).calls == 0
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import pytest
+
+from typing import Any, Generator, Iterable, Iterator, List, TypeVar, Union
+
+from typo.decorator import type_check
+from typo.handlers import Handler
+from typo.utils import IterableProxy
+
+T = TypeVar('T')
+
+
+@pytest.mark.parametrize('hint, exp_str', [
+    (Iterator[int], 'Iterator[int]'),
+    (collections.Iterator, 'Iterator'),
+    (Iterable[List[T]], 'Iterable[List[T]]'),
+    (Generator[int, None, str], 'Generator[int, NoneType, str]'),
+])
+def test_str(hint, exp_str):
+    assert str(Handler(hint)) == exp_str
+
+
+def test_nested():
+    # nested lazy values can't be replaced, so only their interface is checked
+    check = Handler(List[Iterator[int]]).compile()
+    check([iter([1, 'a'])])
+    pytest.raises_regexp(TypeError, 'invalid item #0 of input: expected iterator, got list',
+                         check, [[1]])
+    check = Handler(List[Iterable[int]]).compile()
+    check([(1,), (i for i in 'a')])
+    pytest.raises_regexp(TypeError, "invalid item of item #1 of input: expected int, got str",
+                         check, [(1,), ('a',)])
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_iterator(tiered):
+    @type_check(tiered=tiered)
+    def f(xs: Iterator[int]) -> Iterator[str]:
+        for x in xs:
+            yield str(x) if x else x
+
+    assert list(f(iter([1, 2]))) == ['1', '2']
+    assert list(f(x for x in [])) == []
+    pytest.raises_regexp(TypeError, 'invalid `xs`: expected iterator, got list', f, [1])
+
+    it = f(iter([1, 'a']))
+    assert next(it) == '1'
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `xs`: expected int, got str', next, it)
+
+    it = f(iter([1, 0]))
+    assert next(it) == '1'
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `f\\(\\)`: expected str, got int',
+                         next, it)
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_iterable(tiered):
+    @type_check(tiered=tiered)
+    def f(xs: Iterable[int]) -> List[int]:
+        return list(xs) + list(xs)
+
+    assert f([1, 2]) == [1, 2, 1, 2]
+    assert f({1: 'a'}) == [1, 1]
+    assert f(iter([1, 2])) == [1, 2]
+    pytest.raises_regexp(TypeError, 'invalid `xs`: expected iterable, got int', f, 1)
+    pytest.raises_regexp(TypeError, 'invalid item of `xs`: expected int, got str', f, [1, 'a'])
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `xs`: expected int, got str',
+                         f, iter([1, 'a']))
+
+    class Numbers:
+        def __iter__(self):
+            return iter([1, 2, 'a'])
+
+    pytest.raises_regexp(TypeError, 'invalid item #2 of `xs`: expected int, got str',
+                         f, Numbers())
+
+    @type_check(tiered=tiered)
+    def g(xs: Iterable[int]) -> Any:
+        return xs
+
+    numbers = Numbers()
+    assert isinstance(g(numbers), IterableProxy) and g(numbers).__wrapped__ is numbers
+    assert g([1]) == [1]
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_generator(tiered):
+    def numbers(n, result='done'):
+        total = 0
+        for i in range(n):
+            sent = yield i
+            total += sent or 0
+        return result if result is not None else total
+
+    @type_check(tiered=tiered)
+    def f(n: int, result: Any='done') -> Generator[int, int, str]:
+        return numbers(n, result)
+
+    assert list(f(3)) == [0, 1, 2]
+
+    gen = f(2)
+    assert next(gen) == 0
+    assert gen.send(5) == 1
+    with pytest.raises(StopIteration) as exc:
+        gen.send(None)
+    assert exc.value.value == 'done'
+
+    gen = f(2)
+    next(gen)
+    pytest.raises_regexp(TypeError, 'invalid value sent to `f\\(\\)`: expected int, got str',
+                         gen.send, 'a')
+
+    gen = f(1, result=None)
+    next(gen)
+    pytest.raises_regexp(TypeError, 'invalid return value of `f\\(\\)`: expected str, got int',
+                         gen.send, 1)
+
+    # exceptions are thrown into the generator, closing it closes the generator as well
+    gen = f(3)
+    next(gen)
+    pytest.raises(ValueError, gen.throw, ValueError)
+    gen = f(3)
+    next(gen)
+    gen.close()
+    pytest.raises(StopIteration, next, gen)
+
+    @type_check(tiered=tiered)
+    def g() -> Generator[int, None, None]:
+        return [1]
+
+    pytest.raises_regexp(TypeError, 'expected generator, got list', g)
+
+
+@pytest.mark.parametrize('tiered', [None, 0, 100])
+def test_union(tiered):
+    @type_check(tiered=tiered)
+    def f(xs: Union[int, Iterator[int]]) -> list:
+        return [xs] if isinstance(xs, int) else list(xs)
+
+    assert f(1) == [1]
+    assert f(iter([1, 2])) == [1, 2]
+    pytest.raises_regexp(TypeError, 'invalid item #0 of `xs`: expected int, got str',
+                         f, iter(['a']))
+
+
+def test_typevars():
+    # typevars are bound separately for each of the proxies
+    @type_check
+    def f(xs: Iterator[T], x: T) -> List[T]:
+        return [x] + list(xs)[:0]
+
+    assert f(iter([1, 2]), 'a') == ['a']
+    pytest.raises_regexp(TypeError, 'invalid item #1 of `xs`: cannot assign str to T',
+                         f, iter([1, 'a']), 1)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from typing import Any, Optional, TypeVar
+
+from pytest import _, type_check_test
+from typo.ndarray import Array
+
+np = pytest.importorskip('numpy')
+
+N, M = TypeVar('N'), TypeVar('M')
+
+
+pytest.add_handler_test(
+    'test_array_any', Array, 'Array',
+    ok=[
+        np.zeros(0),
+        np.zeros((2, 3), dtype=int)
+    ],
+    fail=[
+        ([1, 2], 'expected numpy.ndarray, got list')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_array_dtype', (Array[np.float64], Array[float], Array['f8']), 'Array[float64]',
+    ok=[
+        np.zeros(3),
+        np.zeros((2, 3, 4))
+    ],
+    fail=[
+        (np.zeros(3, dtype='f4'), 'expected Array\\[float64\\], got array of float32'),
+        (np.zeros(3, dtype=int), 'got array of int')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_array_abstract_dtype', Array[np.floating], 'Array[floating]',
+    ok=[
+        np.zeros(3),
+        np.zeros(3, dtype='f2')
+    ],
+    fail=[
+        (np.zeros(3, dtype=int), 'got array of int'),
+        (np.zeros(3, dtype=complex), 'got array of complex128')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_array_ndim', (Array[Any, 2], Array[Any, (None, Any)]), 'Array[Any, (Any, Any)]',
+    ok=[
+        np.zeros((2, 3)),
+        np.zeros((0, 1), dtype=int)
+    ],
+    fail=[
+        (np.zeros(3), 'got array with shape \\(3,\\)'),
+        (np.zeros((1, 2, 3)), 'got array with shape \\(1, 2, 3\\)')
+    ]
+)
+
+pytest.add_handler_test(
+    'test_array_shape', Array[int, (N, 3, N)], 'Array[int64, (N, 3, N)]',
+    ok=[
+        np.zeros((2, 3, 2), dtype=int),
+        np.zeros((0, 3, 0), dtype=int)
+    ],
+    fail=[
+        (np.zeros((2, 4, 2), dtype=int), 'got array with shape \\(2, 4, 2\\)'),
+        (np.zeros((2, 3, 1), dtype=int), 'cannot assign dimension 1 to N')
+    ]
+)
+
+
+@type_check_test(
+    ok=[
+        _(np.zeros((4, 3)), np.zeros(4)),
+        _(np.zeros((1, 2)), np.zeros(1), np.zeros((2, 5)))
+    ],
+    fail=[
+        (_(np.zeros((4, 3)), np.zeros(5)), 'invalid `y`: cannot assign dimension 5 to N'),
+        (_(np.zeros((4, 3)), np.zeros(4), np.zeros((2, 3))),
+         'invalid `z`: expected Array.* or NoneType'),
+        (_(np.zeros(4), np.zeros(4)), 'invalid `x`: expected Array\\[float64, \\(N, M\\)\\]'),
+        (_(np.zeros((4, 3)), np.zeros(4, dtype=int)),
+         'invalid `y`: expected Array\\[floating, \\(N,\\)\\], got array of int')
+    ]
+)
+def test_symbolic_dims(x: Array[float, (N, M)], y: Array[np.floating, (N,)],
+                       z: Optional[Array[Any, (M, None)]]=None) -> Array[float, (N,)]:
+    return y
+
+
+def test_array_type():
+    assert Array[float, (N, 1)] == Array[float, (N, 1)]
+    assert Array[float, 2] == Array[float, (None, None)]
+    assert repr(Array[np.float32, (N,)]) == 'Array[float32, (N,)]'
+    pytest.raises_regexp(TypeError, 'cannot parametrize', lambda: Array[float][int])
+    pytest.raises_regexp(TypeError, 'invalid array dimension', lambda: Array[float, (1.5,)])
+    pytest.raises_regexp(TypeError, 'invalid array shape', lambda: Array[float, '2'])
+    pytest.raises_regexp(TypeError, 'cannot have bounds or constraints',
+                         lambda: Array[float, (TypeVar('K', bound=int),)])
+    pytest.raises_regexp(TypeError, 'cannot instantiate', Array)
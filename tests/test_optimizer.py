@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import io
+import pytest
+import textwrap
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
+
+from typo import optimizer
+from typo.cache import code_cache
+from typo.codegen import Codegen
+from typo.handlers import Handler
+
+T = TypeVar('T')
+
+
+def dedent(source):
+    return textwrap.dedent(source).lstrip()
+
+
+def optimize(source, namespace=None):
+    return optimizer.Optimizer(dedent(source), namespace or {}).run()
+
+
+def compile_checker(hint):
+    # Same as the diagnostic checker of the handler, but not cached.
+    handler = Handler(hint)
+    gen = Codegen(typevars=handler.typevars, typevar_branches=handler.typevar_branches)
+    var = gen.new_var()
+    gen.write_line("def check({}, v_desc='input'):".format(var))
+    with gen.indent():
+        if handler.typevars:
+            gen.init_typevars()
+        handler(gen, var, '{v_desc}')
+    return gen.compile('check')
+
+
+def test_dead_branches():
+    assert optimize('''
+        def check(x):
+            v_000 = True
+            v_001 = type(x)
+            if v_001 is list:
+                try:
+                    if not isinstance(x, list):
+                        raise TypeError
+                except TypeError:
+                    v_000 = False
+            elif v_001 is dict:
+                pass
+                if not isinstance(x, (int, dict)):
+                    raise TypeError
+                v_002 = type(x)
+            else:
+                if not isinstance(x, list):
+                    raise TypeError
+            return v_000
+    ''') == dedent('''
+        def check(x):
+            v_000 = True
+            v_001 = type(x)
+            if v_001 is list:
+                pass
+            elif v_001 is dict:
+                v_002 = v_001
+            else:
+                if not isinstance(x, list):
+                    raise TypeError
+            return v_000
+    ''')
+
+
+def test_dead_branches_kept():
+    # the value is rebound, or the check has an `else` branch
+    source = dedent('''
+        def check(x):
+            v_001 = type(x)
+            if v_001 is list:
+                x = list(x)
+                if not isinstance(x, list):
+                    raise TypeError
+                if not isinstance(x, (tuple, dict)):
+                    raise TypeError
+            if v_001 is int:
+                if not isinstance(x, int):
+                    raise TypeError
+                else:
+                    pass
+    ''')
+    assert optimize(source) == source
+
+
+def test_unpack_tuples():
+    assert optimize('''
+        def check(x):
+            v_001 = len(x)
+            if v_001 != 2:
+                return False
+            if not isinstance(x[0], int):
+                rt_type_fail("item #0 of x[0]", "int", x[0], **locals())
+            v_002 = len(x[1])
+            if v_002 != 1:
+                return False
+            return x[1][0]
+    ''') == dedent('''
+        def check(x):
+            v_001 = len(x)
+            if v_001 != 2:
+                return False
+            v_003, v_004 = x
+            if not isinstance(v_003, int):
+                rt_type_fail("item #0 of x[0]", "int", v_003, **locals())
+            v_002 = len(v_004)
+            if v_002 != 1:
+                return False
+            v_005, = v_004
+            return v_005
+    ''')
+
+
+def test_hoist_globals():
+    namespace = {'collections': collections, 'T_0': int}
+    assert optimize('''
+        def check(x, int):
+            for v_000 in x:
+                if not isinstance(v_000, (T_0, collections.Sized, int)):
+                    rt_type_fail("item", "int", v_000, **locals())
+                for v_001 in v_000:
+                    if not callable(v_001) and unknown:
+                        raise TypeError
+            for v_002 in x:
+                v_003 = [v_004 for v_004 in v_002 if isinstance(v_004, int)]
+    ''', namespace) == dedent('''
+        def check(x, int):
+            v_isinstance = isinstance
+            v_T_0 = T_0
+            v_collections_Sized = collections.Sized
+            v_callable = callable
+            for v_000 in x:
+                if not v_isinstance(v_000, (v_T_0, v_collections_Sized, int)):
+                    rt_type_fail("item", "int", v_000, **locals())
+                for v_001 in v_000:
+                    if not v_callable(v_001) and unknown:
+                        raise TypeError
+            for v_002 in x:
+                v_003 = [v_004 for v_004 in v_002 if isinstance(v_004, int)]
+    ''')
+
+
+@pytest.mark.parametrize('hint, values', [
+    (Tuple[int, Any, Tuple[str, float]], [(1, None, ('a', 1.0)), (1, 2, ('a', 1)), (1, 2),
+                                          (1, 2, ('a',)), ('a', 2, 3)]),
+    (Union[List[Any], Dict[str, T], None], [[], None, {'a': 1}, {'a': 1, 'b': 'c'}, {1: 1}, 1]),
+    (Union[T, List[int]], [1, [1], [1, 'a'], (1,)]),
+    (Sequence[Tuple[int, str]], [[(1, 'a')], [(1, 'a'), (1, 2)], [(1,)], [1], 1]),
+    (List[Optional[List[T]]], [[None, [1]], [[1], ['a']], [[1, None]], [1]]),
+])
+def test_equivalent(hint, values, monkeypatch):
+    monkeypatch.setattr(optimizer, 'enabled', True)
+    checkers = [compile_checker(hint)]
+    monkeypatch.setattr(optimizer, 'enabled', False)
+    checkers.append(compile_checker(hint))
+    for value in values:
+        errors = []
+        for check in checkers:
+            try:
+                check(value)
+                errors.append(None)
+            except TypeError as e:
+                errors.append(str(e))
+        assert errors[0] == errors[1]
+
+
+def test_code_dump(monkeypatch):
+    # only code that is actually compiled is dumped (and optimized, regardless of TYPO_OPTIMIZE)
+    monkeypatch.setattr(optimizer, 'enabled', True)
+    code_cache.clear()
+    output = io.StringIO()
+    optimizer.enable_code_dump(output)
+    try:
+        compile_checker(Union[int, List[Any]])
+        compile_checker(int)
+    finally:
+        optimizer.disable_code_dump()
+    diff, unchanged = output.getvalue().split('# unchanged\n')
+    assert diff.startswith('--- generated\n+++ optimized\n')
+    assert '-        try:\n' in diff and '+        pass\n' in diff
+    assert unchanged.startswith("def check(v_000, v_desc='input'):\n")
+    compile_checker(str)
+    assert len(output.getvalue()) == len(diff) + len('# unchanged\n') + len(unchanged)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from typing import Any, Dict, List, Sequence, Set, Tuple, TypeVar, Union
+
+from typo import predicate, is_instance
+
+T, U = TypeVar('T'), TypeVar('U', int, str)
+
+
+@pytest.mark.parametrize('hint, ok, fail', [
+    (Any, [None, 1, []], []),
+    (int, [1, True], ['1', None]),
+    (List[int], [[], [1, 2]], [(1,), [1, '2']]),
+    (Dict[str, List[int]], [{}, {'a': [1]}], [{'a': [1, 'b']}, {1: []}]),
+    (Tuple[int, str], [(1, 'a')], [(1, 2), (1,), [1, 'a']]),
+    (Set[Union[int, str]], [{1, 'a'}], [{1.5}]),
+    (Sequence[float], [(1.5,), [2.5]], [{1.5}, ['a']]),
+    (Union[List[int], Dict[str, int]], [[1], {'a': 1}], [[1.5], {'a': 'b'}, 1]),
+    (Tuple[T, List[T]], [(1, [2, 3]), ('a', [])], [(1, ['a']), (1, [2, 'a'])]),
+    (Tuple[U, Union[U, List[U]]], [(1, 2), ('a', ['b'])], [(1.5, 1.5), (1, ['a'])])
+])
+def test_predicate(hint, ok, fail):
+    check = predicate(hint)
+    for value in ok:
+        assert check(value) is True
+        assert is_instance(value, hint) is True
+    for value in fail:
+        assert check(value) is False
+        assert is_instance(value, hint) is False
+
+
+def test_predicate_memoized():
+    assert predicate(List[Dict[str, int]]) is predicate(List[Dict[str, int]])
+    assert predicate(List[int]) is not predicate(List[str])
+
+
+def test_predicate_no_exceptions():
+    source = predicate(Dict[str, List[Tuple[int, T]]]).__code__
+    assert 'rt_fail' not in source.co_names
+    assert 'enumerate' not in source.co_names
+    assert 'TypeError' not in source.co_names
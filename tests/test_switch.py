@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from typing import List
+
+from typo.decorator import type_check
+from typo.switch import enable, disable, reset, is_enabled, passthrough_code
+
+
+@pytest.fixture(autouse=True)
+def reset_switches():
+    reset()
+    yield
+    reset()
+
+
+def define(**options):
+    @type_check(**options)
+    def f(x: int, y: List[int]=[]) -> int:
+        return x
+    return f
+
+
+def check(f, enabled):
+    assert is_enabled(f) == enabled
+    if enabled:
+        pytest.raises_regexp(TypeError, 'invalid `x`', f, 'a')
+        pytest.raises_regexp(TypeError, 'invalid item #0 of `y`', f, 1, ['a'])
+    else:
+        assert f('a') == 'a'
+        assert f(1, y=['a']) == 1
+
+
+def test_function():
+    f, g = define(), define()
+    check(f, True)
+    disable(f)
+    assert f.__code__ is passthrough_code
+    check(f, False)
+    check(g, True)
+    enable(f)
+    check(f, True)
+
+
+def test_global():
+    f = define()
+    disable()
+    check(f, False)
+    check(define(), False)
+    enable(f)
+    check(f, True)
+    reset(f)
+    check(f, False)
+    enable()
+    check(f, True)
+
+
+def test_module():
+    f = define()
+    module = f.__module__
+    disable(module)
+    check(f, False)
+    assert is_enabled()
+    assert not is_enabled(module)
+    assert not is_enabled(module + '.submodule')
+    assert is_enabled(module + 'x')
+    disable()
+    enable(module)
+    check(f, True)
+    reset(module)
+    check(f, False)
+
+
+def test_tiered():
+    f = define(tiered=1)
+    check(f, True)
+    disable(f)
+    check(f, False)
+    enable(f)
+    check(f, True)
+    assert f.wrapper_code is not None
+    disable()
+    check(define(tiered=0), False)
+
+
+def test_invalid():
+    pytest.raises_regexp(ValueError, 'not a type-checked function', disable, lambda: None)
+    pytest.raises_regexp(ValueError, 'not a type-checked function', is_enabled, lambda: None)
@@ -1,5 +1,16 @@
 # -*- coding: utf-8 -*-
 
-from typo.decorator import type_check
+from typo.batch import validate_many
+from typo.cache import enable_cache, disable_cache, cache_info
+from typo.checked import checked_list, checked_dict
+from typo.decorator import type_check, type_check_class, call_stats
+from typo.instrumentation import enable_stats, disable_stats, reset_stats, stats, dump_stats
+from typo.ndarray import Array
+from typo.optimizer import enable_code_dump, disable_code_dump
+from typo.predicate import predicate, is_instance
+from typo.switch import enable, disable, reset, is_enabled
 
-__all__ = ('type_check',)
+__all__ = ('type_check', 'type_check_class', 'call_stats', 'Array', 'predicate', 'is_instance',
+           'validate_many', 'enable', 'disable', 'reset', 'is_enabled', 'enable_cache',
+           'disable_cache', 'cache_info', 'enable_stats', 'disable_stats', 'reset_stats', 'stats',
+           'dump_stats', 'enable_code_dump', 'disable_code_dump', 'checked_list', 'checked_dict')
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Iterable, Iterator, Tuple
+
+from typo.handlers import Handler
+
+
+def validate_many(values: Iterable[Any], hint: Any,
+                  fail_fast: bool=False) -> Iterator[Tuple[int, str]]:
+    # Values are consumed lazily, one at a time, so this works with streams of any length.
+    return Handler(hint).compile_many()(values, fail_fast)
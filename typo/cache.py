@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import importlib.util
+import marshal
+import os
+import tempfile
+import types
+
+from typing import Callable, Optional
+
+from typo._version import __version__
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses'])
+
+
+class CodeCache:
+    # Each entry is stored in a file named after the cache key (e.g. function location and
+    # signature), so that a function whose definition changes replaces its own entry. Entries
+    # are validated against a hash of the generated source, so stale entries are never used.
+
+    # Number of code objects kept in memory when the cache is disabled (or for uncached code).
+    memory_size = 1024
+
+    def __init__(self, path: Optional[str]=None) -> None:
+        self.path = None
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.enable(path)
+
+    def enable(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+    def disable(self) -> None:
+        self.path = None
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses)
+
+    def clear(self) -> None:
+        self.hits = self.misses = 0
+        self.memory.clear()
+        if self.path is not None:
+            for filename in os.listdir(self.path):
+                if filename.endswith('.pyc'):
+                    os.remove(os.path.join(self.path, filename))
+
+    def header(self, source: str) -> bytes:
+        digest = hashlib.sha1(source.encode('utf-8')).digest()
+        return importlib.util.MAGIC_NUMBER + __version__.encode('ascii') + b'\0' + digest
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pyc')
+
+    def load(self, filename: str, header: bytes) -> Optional[types.CodeType]:
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(header):
+            return None
+        try:
+            code = marshal.loads(data[len(header):])
+        except (EOFError, ValueError, TypeError):
+            return None
+        return code if isinstance(code, types.CodeType) else None
+
+    def store(self, filename: str, header: bytes, code: types.CodeType) -> None:
+        # Write to a temporary file first so that concurrent readers never see partial entries.
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            try:
+                with open(fd, 'wb') as f:
+                    f.write(header + marshal.dumps(code))
+                os.replace(tmp, filename)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError:
+            pass
+
+    def compile(self, source: str, key: Optional[str]=None,
+                transform: Optional[Callable[[str], str]]=None) -> types.CodeType:
+        # Entries are validated against the source before `transform` (e.g. optimization) is
+        # applied to it, so that cache hits skip the transformation as well.
+        if self.path is None or key is None:
+            return self.compile_memory(source, transform)
+        header, filename = self.header(source), self.filename(key)
+        code = self.load(filename, header)
+        if code is not None:
+            self.hits += 1
+            return code
+        self.misses += 1
+        code = compile(transform(source) if transform else source, '<string>', 'exec')
+        self.store(filename, header, code)
+        return code
+
+    def compile_memory(self, source: str,
+                       transform: Optional[Callable[[str], str]]) -> types.CodeType:
+        # Identical sources are generated for functions with the same signature (see
+        # `Codegen.compile`), so recently compiled code objects are reused within the process.
+        key = (source, transform is not None)
+        code = self.memory.get(key)
+        if code is not None:
+            self.memory.move_to_end(key)
+            return code
+        code = compile(transform(source) if transform else source, '<string>', 'exec')
+        self.memory[key] = code
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+        return code
+
+
+code_cache = CodeCache(os.environ.get('TYPO_CACHE_DIR') or None)
+
+
+def enable_cache(path: str) -> None:
+    code_cache.enable(path)
+
+
+def disable_cache() -> None:
+    code_cache.disable()
+
+
+def cache_info() -> CacheInfo:
+    return code_cache.info()
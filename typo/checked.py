@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Iterable, Mapping
+
+from typo.handlers import Handler, DictHandler, ListHandler, TupleHandler, UnionHandler
+from typo.utils import CheckedList, CheckedDict
+
+
+def type_only(handler: Handler) -> bool:
+    # True if the handler only checks the types of values (and of tuple items), so that values
+    # which have passed it can't become invalid, even if they're mutable.
+    if handler.is_any or handler.simple_types:
+        return True
+    elif isinstance(handler, TupleHandler):
+        return all(map(type_only, [handler.handler] if handler.ellipsis else handler.handlers))
+    elif isinstance(handler, UnionHandler):
+        return all(map(type_only, handler.handlers))
+    return False
+
+
+def checked_handler(hint: Any, tp: type) -> Handler:
+    # Typevars could only be bound consistently by checking all of the items every time, and
+    # items which could become invalid (e.g. nested lists) would have to be checked as well.
+    handler = Handler(hint)
+    if not isinstance(handler, tp) or handler.typevars:
+        raise ValueError('invalid type hint of a checked container: {!r}'.format(hint))
+    items = [handler.handler] if tp is ListHandler else [handler.key_handler,
+                                                         handler.value_handler]
+    if not all(map(type_only, items)):
+        raise ValueError('items of a checked container must be checked by type only: {!r}'
+                         .format(hint))
+    return handler
+
+
+def checked_list(hint: Any, items: Iterable[Any]=()) -> CheckedList:
+    # The items are copied and checked once; afterwards, only the added items are checked.
+    handler = checked_handler(hint, ListHandler)
+    desc = 'checked {}'.format(handler)
+    items = list(items)
+    handler.compile()(items, desc)
+    return CheckedList._from_checked(handler, items, desc)
+
+
+def checked_dict(hint: Any, items: Mapping[Any, Any]=None, **kwargs: Any) -> CheckedDict:
+    handler = checked_handler(hint, DictHandler)
+    desc = 'checked {}'.format(handler)
+    items = dict(items or (), **kwargs)
+    handler.compile()(items, desc)
+    return CheckedDict._from_checked(handler, items, desc)
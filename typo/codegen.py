@@ -1,37 +1,99 @@
 # -*- coding: utf-8 -*-
 
+import array
+import builtins
 import collections
 import contextlib
+import itertools
+import random
 import typing
 
-from typing import Any, Union, Tuple, List
+from typing import Any, Callable, Union, Tuple, List, Iterable, Optional
 
-from typo.utils import type_name
+from typo import instrumentation, optimizer
+from typo.cache import code_cache
+from typo.utils import (type_name, type_names, check_sample, deeply_immutable,
+                        rename_code, IterableProxy)
 
 
 class Codegen:
     _v_cache_seq = {list: True, tuple: True, str: True, bytes: True,
                     bytearray: True, memoryview: True}
     _v_cache_mut_seq = {list: True}
+    _v_cache_iter = {}
+    _v_cache_iterable = {list: True, tuple: True, dict: True, set: True, str: True}
+    _v_cache_gen = {}
+    _v_cache_aiter = {}
+    _v_cache_types = {}
 
-    def __init__(self, typevars=None):
+    # Handlers nested more deeply than this (in indentation levels) are checked by calling
+    # their own compiled checkers, which keeps functions within the limits of the compiler; so
+    # are handlers whose checks have already been inlined within the unit and took at least
+    # `max_repeated_lines` lines. Both may be changed to tune the size of the generated code.
+    max_inline_depth = 12
+    max_repeated_lines = 20
+
+    # Sequences known to be indexed by position, which can be sampled at random indices; other
+    # values accepted as sequences (which are checked by their interface) may be mappings.
+    indexable_types = (list, tuple, str, bytes, bytearray, range)
+
+    # Types of items of 1-dimensional buffers by their typecode / struct format.
+    buffer_item_types = dict([(c, int) for c in 'bBhHiIlLqQnN'] + [(c, float) for c in 'efd'] +
+                             [('?', bool), ('c', bytes), ('u', str)])
+
+    def __init__(self, typevars=None, sample: Optional[int]=None, typevar_branches: bool=False,
+                 predicate: bool=False):
         # TODO: accept list of handlers, build the set of typevars here
+        check_sample(sample)
+        self.sample = sample
+        # if set, failures are not described and `return False` instead of raising (or
+        # return whatever `predicate_fail` evaluates to, e.g. a call describing the failure)
+        self.predicate = predicate
+        self.predicate_fail = 'False'
+        self.cache_key = None
         self.lines = []
         self.indent_level = 0
         self.next_var_id = 0
         self.next_type_id = 0
         self.types = {}
-        self.typevars = sorted(typevars or [], key=str)
+        self.type_caches = {}
+        # variables that can be replaced by checking proxies, mapped to their descriptions
+        self.rebindable = {}
+        # number of lines written by handlers that have been inlined
+        self.inlined = {}
+        # if set, name of the instrumented function; `stats_path` holds the labels and
+        # handlers of the annotation nodes being written
+        self.stats = None
+        self.stats_path = []
         # TODO: all names injected through context should start with underscore
         self.context = {
             'collections': collections,
+            'itertools': itertools,
             'typing': typing,
             'rt_fail': self.rt_fail,
             'rt_type_fail': self.rt_type_fail,
             'rt_fail_msg': self.rt_fail_msg,
+            'rt_sample_items': self.rt_sample_items,
+            'rt_random': random.random,
+            'rt_check_types': self.rt_check_types,
+            'rt_check': self.rt_check,
+            'rt_remember': self.rt_remember,
+            'rt_buffer_type': self.rt_buffer_type,
+            'rt_wrap_iterable': self.rt_wrap_iterable,
+            'rt_clock': instrumentation.clock,
             'v_cache_seq': self._v_cache_seq,
             'v_cache_mut_seq': self._v_cache_mut_seq,
+            'v_cache_iter': self._v_cache_iter,
+            'v_cache_iterable': self._v_cache_iterable,
+            'v_cache_gen': self._v_cache_gen,
+            'v_cache_aiter': self._v_cache_aiter,
         }
+        self.set_typevars(typevars, typevar_branches)
+
+    def set_typevars(self, typevars, typevar_branches: bool=False):
+        # Typevars of the function being generated (there may be several in a single unit).
+        self.typevars = sorted(typevars or [], key=str)
+        self.typevar_branches = typevar_branches
         for i, tv in enumerate(self.typevars):
             if tv.__constraints__:
                 self.context['constraints_{}'.format(i)] = tv.__constraints__
@@ -39,13 +101,102 @@ class Codegen:
     def typevar_id(self, typevar):
         return self.typevars.index(typevar)
 
+    def typevar_var(self, typevar):
+        return 'tv_{}'.format(self.typevar_id(typevar))
+
     def init_typevars(self):
-        self.write_line('tv = [{!r}]'.format([None] * len(self.typevars)))
+        if self.typevar_branches:
+            # List of all possible assignments to type variables; assignments are tuples which
+            # are never modified, so the list itself can be saved and restored at no cost.
+            self.write_line('tv = [{!r}]'.format((None,) * len(self.typevars)))
+        else:
+            # There can only be a single assignment, so each typevar is a local variable.
+            self.write_line('{} = None'.format(' = '.join(map(self.typevar_var, self.typevars))))
+
+    def bind_typevar(self, typevar, value: str, varname: str, desc: Optional[str], msg: str,
+                     invalid: Optional[str]=None, op: str='is') -> None:
+        # Bind the typevar to `value` unless it's already bound to a different value (`op`
+        # compares the two) or unless the `invalid` condition holds when binding it.
+        op_not = {'is': 'is not', '==': '!='}[op]
+        if not self.typevar_branches:
+            var = self.typevar_var(typevar)
+            self.write_line('if {} {} {}:'.format(var, op_not, value))
+            with self.indent():
+                cond = '{} is not None'.format(var)
+                if invalid is not None:
+                    cond += ' or {}'.format(invalid)
+                self.write_line('if {}:'.format(cond))
+                with self.indent():
+                    self.fail_msg(desc, msg, varname)
+                self.write_line('{} = {}'.format(var, value))
+            return
 
-    def compile(self, name):
-        context = self.context.copy()
-        exec(str(self), context)
-        return context[name]
+        # Nothing is allocated unless one of the assignments changes.
+        index = self.typevar_id(typevar)
+        var_a, var_b, var_new = self.new_vars(3)
+        self.write_line('for {} in tv:'.format(var_a))
+        with self.indent():
+            self.write_line('if {}[{}] {} {}:'.format(var_a, index, op_not, value))
+            with self.indent():
+                self.write_line('{} = []'.format(var_new))
+                self.write_line('for {} in tv:'.format(var_b))
+                with self.indent():
+                    self.write_line('if {}[{}] {} {}:'.format(var_b, index, op, value))
+                    with self.indent():
+                        self.write_line('{}.append({})'.format(var_new, var_b))
+                    cond = '{}[{}] is None'.format(var_b, index)
+                    if invalid is not None:
+                        cond += ' and not {}'.format(invalid)
+                    self.write_line('elif {}:'.format(cond))
+                    with self.indent():
+                        self.write_line('{}.append({}[:{}] + ({},) + {}[{}:])'.format(
+                            var_new, var_b, index, value, var_b, index + 1))
+                self.write_line('if not {}:'.format(var_new))
+                with self.indent():
+                    self.fail_msg(desc, msg, varname)
+                self.write_line('tv = {}'.format(var_new))
+                self.write_line('break')
+
+    def compile(self, name, context=None):
+        # If the on-disk cache is enabled, code objects are looked up by `cache_key` (and
+        # codegen options) to avoid recompiling the same wrappers every time on startup.
+        # If `name` is None, the whole namespace is returned. The source is optimized before
+        # being compiled (cached code objects are already optimized).
+        key = None
+        if self.cache_key is not None:
+            key = '{}:sample={}:predicate={}:optimize={}'.format(
+                self.cache_key, self.sample, self.predicate, optimizer.enabled)
+        if context is None:
+            context = self.context.copy()
+        else:
+            context.update(self.context)
+
+        # A function is compiled under a placeholder name and renamed afterwards, so that
+        # functions differing only in their names share the same code object; the name isn't
+        # bound in the context, where it could shadow the globals used by the code.
+        source = str(self)
+        head = template = None
+        for prefix in ('def ', 'async def '):
+            if name is not None and source.startswith(prefix + name + '('):
+                head, template = prefix + name + '(', prefix + 'v_template('
+                source = template + source[len(head):]
+
+        def transform(src):
+            # The optimizer sees (and dumps) the source with the actual name.
+            if head is None:
+                return optimizer.optimize(src, context)
+            return optimizer.optimize(src.replace(template, head, 1),
+                                      context).replace(head, template, 1)
+
+        exec(code_cache.compile(source, key, transform if optimizer.enabled else None), context)
+        if name is None:
+            return context
+        if head is None:
+            return context[name]
+        func = context.pop('v_template')
+        func.__code__ = rename_code(func.__code__, name)
+        func.__name__ = func.__qualname__ = name
+        return func
 
     @staticmethod
     def rt_fail(desc: str, expected: str, var: Any, got: str, **kwargs):
@@ -62,6 +213,132 @@ class Codegen:
         raise TypeError('invalid {}: {}'.format(desc.format(**kwargs),
                                                 msg.format(tp=type_name(type(var)), **kwargs)))
 
+    @staticmethod
+    def rt_sample(n: int, k: int) -> Iterable[int]:
+        # First k indices, last k indices and k random indices in between (in order).
+        if n <= 3 * k:
+            return range(n)
+        middle = sorted(random.sample(range(k, n - k), k))
+        return itertools.chain(range(k), middle, range(n - k, n))
+
+    @staticmethod
+    def rt_sample_items(value: Any, k: int) -> Iterable[Tuple[int, Any]]:
+        # Sampled items along with their indices; sequences which can't be indexed by position
+        # are sampled like unordered containers, by their first few items.
+        if isinstance(value, Codegen.indexable_types):
+            return [(i, value[i]) for i in Codegen.rt_sample(len(value), k)]
+        return enumerate(itertools.islice(value, 3 * k))
+
+    @staticmethod
+    def rt_check_types(types: typing.Set[type], expected: Tuple[type, ...],
+                       cache: typing.Set[type]) -> bool:
+        if all(issubclass(tp, expected) for tp in types):
+            cache.update(types)
+            return True
+        return False
+
+    @staticmethod
+    def rt_check(desc: str, checker: Callable[[Any, str], None], var: Any, **kwargs):
+        checker(var, desc.format(**kwargs))
+
+    @staticmethod
+    def rt_remember(cache: collections.OrderedDict, value: Any, size: int) -> None:
+        # The cache holds references to the values, so their ids can't be reused while they
+        # are cached (immutable builtins don't support weak references).
+        if deeply_immutable(value):
+            cache[id(value)] = value
+            if len(cache) > size:
+                cache.popitem(last=False)
+
+    @staticmethod
+    def rt_buffer_type(value: Any) -> Optional[type]:
+        # Type of all items of a buffer object, which can be inferred without iterating.
+        tp = type(value)
+        if tp is bytes or tp is bytearray:
+            return int
+        elif tp is array.array:
+            return Codegen.buffer_item_types.get(value.typecode)
+        elif tp is memoryview and value.ndim == 1:
+            return Codegen.buffer_item_types.get(value.format.lstrip('@=<>!'))
+        return None
+
+    @staticmethod
+    def rt_wrap_iterable(value: Any, proxy: Callable, desc: str) -> Any:
+        # Iterators can only be iterated over once, so they're replaced with the proxy itself.
+        if iter(value) is value:
+            return proxy(value, desc)
+        return IterableProxy(value, proxy, desc)
+
+    def invoke(self, handler: 'typo.handlers.Handler', varname: str, desc: Optional[str],
+               role: str) -> None:
+        # Write the checks of a child node of the annotation, e.g. the `item` of a list; if the
+        # function is instrumented, they are counted and timed.
+        if self.stats is None:
+            self.write_checks(handler, varname, desc)
+            return
+        if self.stats_path:
+            role = '{}.{}'.format(type(self.stats_path[-1][1]).__name__[:-len('Handler')],
+                                  role)
+        self.stats_path.append((role, handler))
+        var_rec, var_t = self.new_vars(2)
+        path = tuple(label for label, _ in self.stats_path)
+        self.context[var_rec] = instrumentation.record(self.stats, path)
+        self.write_line('{} = rt_clock()'.format(var_t))
+        self.write_checks(handler, varname, desc)
+        self.write_line('{}[0] += 1'.format(var_rec))
+        self.write_line('{}[1] += rt_clock() - {}'.format(var_rec, var_t))
+        self.stats_path.pop()
+
+    def write_checks(self, handler: 'typo.handlers.Handler', varname: str,
+                     desc: Optional[str]) -> None:
+        # Inline the checks, unless they can be replaced by a call to the compiled checker of
+        # the handler and they should be.
+        if (not handler.shareable or (self.indent_level < self.max_inline_depth and
+                                      self.inlined.get(handler, 0) < self.max_repeated_lines)):
+            start = len(self.lines)
+            handler(self, varname, desc)
+            self.inlined.setdefault(handler, len(self.lines) - start)
+            return
+        self.call_checkers(handler, varname, desc)
+
+    def call_checkers(self, handler: 'typo.handlers.Handler', varname: str,
+                      desc: Optional[str], lazy: bool=False) -> None:
+        # Check the value by calling the compiled checkers of the handler; if `lazy`, they're
+        # only compiled when first called (e.g. if the handler refers to itself).
+        if self.sample is not None and not self.predicate:
+            # sampled items are only checked once, describing failures right away
+            checker = self.ref_checker(lambda: handler.compile(sample=self.sample), lazy)
+            if desc is None:
+                self.write_line("{}({}, '')".format(checker, varname))
+            else:
+                self.write_line('rt_check("{}", {}, {}, **locals())'
+                                .format(desc, checker, varname))
+            return
+        checker = self.ref_checker(handler.predicate, lazy)
+        self.write_line('if not {}({}):'.format(checker, varname))
+        with self.indent():
+            if desc is None or self.predicate:
+                self.fail(desc, str(handler), varname)
+            else:
+                diagnostic = self.ref_checker(handler.compile_diagnostic, lazy)
+                self.write_line('rt_check("{}", {}, {}, **locals())'
+                                .format(desc, diagnostic, varname))
+
+    def ref_checker(self, compile: Callable[[], Callable], lazy: bool) -> str:
+        # Lazily compiled checkers are stored in a list, replacing the function compiling them.
+        var = self.new_var()
+        if not lazy:
+            self.context[var] = compile()
+            return var
+        cell = self.context[var] = [None]
+
+        def compile_and_call(*args):
+            cell[0] = compile()
+            return cell[0](*args)
+
+        cell[0] = compile_and_call
+        return '{}[0]'.format(var)
+
     def write_line(self, line):
         self.lines.append(' ' * self.indent_level * 4 + line)
 
@@ -80,7 +357,7 @@ class Codegen:
         return tuple(self.new_var() for _ in range(n))
 
     def ref_type(self, tp):
-        if tp.__module__ == 'builtins':
+        if tp.__module__ == 'builtins' and getattr(builtins, tp.__name__, None) is tp:
             return tp.__name__
         elif tp.__module__ == 'collections.abc':
             return 'collections.' + tp.__name__
@@ -93,9 +370,26 @@ class Codegen:
             self.context[varname] = tp
         return self.types[tp]
 
+    def ref_types(self, tp: Union[type, Tuple[type, ...]]) -> str:
+        if isinstance(tp, tuple):
+            if len(tp) == 1:
+                return self.ref_type(tp[0])
+            return '({})'.format(', '.join(map(self.ref_type, tp)))
+        return self.ref_type(tp)
+
+    def ref_type_cache(self, tp: Tuple[type, ...]) -> str:
+        # Concrete types known to be subclasses of `tp` (shared across all codegen instances).
+        if tp not in self.type_caches:
+            varname = 'v_cache_types_{}'.format(len(self.type_caches))
+            self.type_caches[tp] = varname
+            self.context[varname] = self._v_cache_types.setdefault(tp, set())
+        return self.type_caches[tp]
+
     def fail(self, desc: str, expected: str, varname: str, got: str=None):
         if desc is None:
             self.write_line('raise TypeError')
+        elif self.predicate:
+            self.write_line('return {}'.format(self.predicate_fail))
         elif got is None:
             self.write_line('rt_type_fail("{}", "{}", {}, **locals())'
                             .format(desc, expected, varname))
@@ -106,49 +400,134 @@ class Codegen:
     def fail_msg(self, desc: str, msg: str, varname: str):
         if desc is None:
             self.write_line('raise TypeError')
+        elif self.predicate:
+            self.write_line('return {}'.format(self.predicate_fail))
         else:
             self.write_line('rt_fail_msg("{}", "{}", {}, **locals())'
                             .format(desc, msg, varname))
 
     def if_not_isinstance(self, varname: str, tp: Union[type, Tuple[type, ...]]) -> None:
-        if isinstance(tp, tuple):
-            if len(tp) == 1:
-                tp = self.ref_type(tp[0])
-            else:
-                tp = '({})'.format(', '.join(map(self.ref_type, tp)))
-        else:
-            tp = self.ref_type(tp)
-
-        self.write_line('if not isinstance({}, {}):'.format(varname, tp))
+        self.write_line('if not isinstance({}, {}):'.format(varname, self.ref_types(tp)))
 
     def check_type(self, varname: str, desc: str, tp: Union[Tuple[type, ...], type]):
-        if isinstance(tp, tuple):
-            if len(tp) == 1:
-                expected = type_name(tp)
-            else:
-                expected = ' or '.join(map(type_name, tp))
-        else:
-            expected = type_name(tp)
-
         self.if_not_isinstance(varname, tp)
         with self.indent():
-            self.fail(desc, expected, varname)
+            self.fail(desc, type_names(tp), varname)
+
+    @contextlib.contextmanager
+    def summarize_types(self, checks: List[Tuple[str, 'typo.handlers.Handler']]):
+        # If all item handlers only check item types, build the set of concrete item types
+        # at C level and check each distinct type once; the code written within this block
+        # (the item-by-item check) only runs if that fails, in order to locate the item.
+        # Items checked against a bare typevar are all bound at once if of the same type.
+        if self.sample is not None or not all(h.simple_types or h.is_typevar
+                                              for _, h in checks):
+            yield
+            return
+        conds = []
+        for iterable, handler in checks:
+            var_ts = self.new_var()
+            self.write_line('{} = set(map(type, {}))'.format(var_ts, iterable))
+            if handler.simple_types:
+                conds.append('{0} <= {1} or rt_check_types({0}, {2}, {1})'.format(
+                    var_ts, self.ref_type_cache(handler.simple_types),
+                    self.ref_types(handler.simple_types)))
+                continue
+            var_ok, var_v = self.new_vars(2)
+            self.write_line('{} = False'.format(var_ok))
+            self.write_line('if len({}) == 1:'.format(var_ts))
+            with self.indent():
+                self.write_line('{} = next(iter({}))'.format(var_v, iterable))
+                self.write_line('try:')
+                with self.indent():
+                    handler(self, var_v, None)
+                    self.write_line('{} = True'.format(var_ok))
+                self.write_line('except TypeError:')
+                with self.indent():
+                    self.write_line('pass')
+            conds.append(var_ok)
+        self.write_line('if not ({}):'.format(' and '.join(map('({})'.format, conds))
+                                              if len(conds) > 1 else conds[0]))
+        with self.indent():
+            yield
+
+    @contextlib.contextmanager
+    def remember_verdicts(self, varname: str, size: int):
+        # Skip the checks written within this block if the same deeply immutable object has
+        # already passed them; cache is bounded, least recently used values are evicted. If
+        # `size` is None, the checks are written as is.
+        if size is None:
+            yield
+            return
+        var_cache = self.new_var()
+        self.context[var_cache] = collections.OrderedDict()
+        self.write_line('if {}.get(id({})) is not {}:'.format(var_cache, varname, varname))
+        with self.indent():
+            yield
+            self.write_line('rt_remember({}, {}, {})'.format(var_cache, varname, size))
+        self.write_line('else:')
+        with self.indent():
+            self.write_line('{}.move_to_end(id({}))'.format(var_cache, varname))
+
+    @contextlib.contextmanager
+    def skip_checked(self, varname: str, handler: 'typo.handlers.Handler', tp: type):
+        # Checked containers (see typo.checked) of type `tp` only hold items which have passed
+        # the handler (and which can't become invalid, as they're only checked by type), so
+        # the checks written within this block are skipped for them; handlers binding typevars
+        # have to check the items every time.
+        if handler.typevars:
+            yield
+            return
+        var_h = self.new_var()
+        self.context[var_h] = handler
+        self.write_line('if type({0}) is not {1} or {0}.handler is not {2}:'
+                        .format(varname, self.ref_type(tp), var_h))
+        with self.indent():
+            yield
+
+    @contextlib.contextmanager
+    def check_buffer(self, varname: str, handler: 'typo.handlers.Handler'):
+        # If the value is a buffer whose item type satisfies the item handler, skip the
+        # code written within this block (which checks the items one by one).
+        if not handler.simple_types:
+            yield
+            return
+        var_t = self.new_var()
+        self.write_line('{} = rt_buffer_type({})'.format(var_t, varname))
+        self.write_line('if {0} is None or not issubclass({0}, {1}):'
+                        .format(var_t, self.ref_types(handler.simple_types)))
+        with self.indent():
+            yield
 
     def iter_and_check(self, varname: str, desc: str,
                        handler: 'typo.handlers.Handler') -> None:
         var_v = self.new_var()
-        self.write_line('for {} in {}:'.format(var_v, varname))
-        with self.indent():
-            handler(self, var_v, None if desc is None else
-                    'item of {}'.format(desc))
+        with self.summarize_types([(varname, handler)]):
+            self.write_line('for {} in {}:'.format(var_v, self.sampled(varname)))
+            with self.indent():
+                self.invoke(handler, var_v, None if desc is None else
+                            'item of {}'.format(desc), 'item')
+
+    def sampled(self, iterable: str) -> str:
+        # Unordered containers can't be indexed, so only the first few items are checked.
+        if self.sample is None:
+            return iterable
+        return 'itertools.islice({}, {})'.format(iterable, 3 * self.sample)
 
     def enumerate_and_check(self, varname: str, desc: str,
                             handler: 'typo.handlers.Handler') -> None:
         var_i, var_v = self.new_var(), self.new_var()
-        self.write_line('for {}, {} in enumerate({}):'.format(var_i, var_v, varname))
-        with self.indent():
-            handler(self, var_v, None if desc is None else
-                    'item #{{{}}} of {}'.format(var_i, desc))
+        with self.summarize_types([(varname, handler)]):
+            if self.sample is None and (desc is None or self.predicate):
+                self.write_line('for {} in {}:'.format(var_v, varname))
+            elif self.sample is None:
+                self.write_line('for {}, {} in enumerate({}):'.format(var_i, var_v, varname))
+            else:
+                self.write_line('for {}, {} in rt_sample_items({}, {}):'
+                                .format(var_i, var_v, varname, self.sample))
+            with self.indent():
+                self.invoke(handler, var_v, None if desc is None else
+                            'item #{{{}}} of {}'.format(var_i, desc), 'item')
 
     def check_attrs_cached(self, varname: str, desc: str, expected: str,
                            cache: str, attrs: List[str]) -> None:
@@ -1,12 +1,22 @@
 # -*- coding: utf-8 -*-
 
+import builtins
+import collections
 import inspect
 import functools
+import random
+import types
+import weakref
 
-from typing import Any, Callable, Optional
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Set, Tuple, TypeVar
 
+from typo import instrumentation, switch
+from typo.cache import code_cache
 from typo.codegen import Codegen
 from typo.handlers import Handler
+from typo.interpreter import Interpreter
+from typo.utils import check_sample, code_template, rename_code
 
 
 class KeywordArgsHandler(Handler):
@@ -17,14 +27,29 @@ class KeywordArgsHandler(Handler):
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         if not self.handler.is_any:
             var_k, var_v = gen.new_vars(2)
-            gen.write_line('for {}, {}, in {}.items():'.format(var_k, var_v, varname))
+            gen.write_line('for {}, {}, in {}:'.format(
+                var_k, var_v, gen.sampled('{}.items()'.format(varname))))
             with gen.indent():
-                self.handler(gen, var_v, None if desc is None else
-                             'keyword argument `{{{}}}`'.format(var_k))
+                gen.invoke(self.handler, var_v, None if desc is None else
+                           'keyword argument `{{{}}}`'.format(var_k), 'value')
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        if not self.handler.is_any:
+            for k, v in interp.sampled(value.items()):
+                self.handler.interpret(interp, v, None if desc is None else
+                                       'keyword argument `{}`'.format(k))
 
     def __str__(self) -> str:
         return 'KeywordArgs[{}]'.format(self.handler)
 
+    @property
+    def typevars(self) -> Set[type(TypeVar)]:
+        return self.handler.typevars
+
+    @property
+    def typevar_branches(self) -> bool:
+        return self.handler.typevar_branches
+
 
 class PositionalArgsHandler(Handler):
     def __init__(self, bound: Any) -> None:
@@ -35,75 +60,452 @@ class PositionalArgsHandler(Handler):
         if not self.handler.is_any:
             gen.enumerate_and_check(varname, desc, self.handler)
 
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        if not self.handler.is_any:
+            interp.enumerate_and_check(value, desc, self.handler)
+
     def __str__(self) -> str:
         return 'PositionalArgs[{}]'.format(self.handler)
 
+    @property
+    def typevars(self) -> Set[type(TypeVar)]:
+        return self.handler.typevars
+
+    @property
+    def typevar_branches(self) -> bool:
+        return self.handler.typevar_branches
+
+
+# Tier 0 of tiered wrappers: the arguments are passed as is to the interpreting checker.
+tier0_code = code_template('def wrapper(*args, **kwargs):\n'
+                           '    return tier0(args, kwargs)\n')
+
+# Same for coroutine functions (only compiled when needed, as it requires Python 3.5).
+tier0_async_source = ('async def wrapper(*args, **kwargs):\n'
+                      '    coro, finish = tier0.start_call(args, kwargs)\n'
+                      '    return finish(await coro)\n')
+
+# Same for async generator functions (Python 3.6), the wrapper yields the checked items.
+tier0_async_gen_source = ('async def wrapper(*args, **kwargs):\n'
+                          '    agen, finish = tier0.start_call(args, kwargs)\n'
+                          '    async for item in finish(agen):\n'
+                          '        yield item\n')
+
+
+CallStats = collections.namedtuple('CallStats', ['checked', 'skipped'])
+
+# Number of checked and skipped calls of wrappers that check only a part of all calls.
+call_counts = weakref.WeakKeyDictionary()
+
+
+class FunctionChecks:
+    # Everything needed to check a function's arguments and return value, used both for
+    # generating the wrapper code and for checking the function by interpreting handlers.
+
+    def __init__(self, func: Callable, sample: Optional[int]=None, rate: Optional[float]=None,
+                 every: Optional[int]=None, verdict_cache: Optional[int]=None,
+                 instrument: Optional[bool]=None, forward_ref_depth: Optional[int]=None,
+                 check_once: Optional[bool]=None) -> None:
+        check_sample(sample)
+        if rate is not None and every is not None:
+            raise ValueError('`rate` and `every` are mutually exclusive')
+        if sample is not None and verdict_cache is not None:
+            # a value passing a sampled check hasn't been fully checked, so it can't be cached
+            raise ValueError('`sample` and `verdict_cache` are mutually exclusive')
+        if rate is not None and (not isinstance(rate, (int, float)) or not 0 < rate <= 1):
+            raise ValueError('rate must be a number in (0, 1]: {!r}'.format(rate))
+        if every is not None and (not isinstance(every, int) or every <= 0):
+            raise ValueError('number of calls must be a positive integer: {!r}'.format(every))
+        if verdict_cache is not None and (not isinstance(verdict_cache, int) or
+                                          verdict_cache <= 0):
+            raise ValueError('cache size must be a positive integer: {!r}'
+                             .format(verdict_cache))
+        self.sample = sample
+        self.verdict_cache = verdict_cache
+        self.instrument = instrumentation.enabled if instrument is None else instrument
+        self.rate = rate
+        self.every = every
+        self.calls = [0, 0]
 
-def type_check(func: Callable) -> Callable:
-    annotations = func.__annotations__
-
-    # Extract function signature without type annotations -- this is because annotations
-    # may contain user types, so we don't want to stringify them and instead pass the
-    # annotations dict to the wrapped function as is.
-    func.__annotations__ = {}
-    signature = inspect.signature(func)
-    func.__annotations__ = annotations
-
-    # Build call arguments and type checking handlers for annotated arguments.
-    return_handler = Handler(annotations.get('return', Any))
-    call_args, handlers = [], {}
-    for arg, param in signature.parameters.items():
-        handler_type = Handler
-        call_prefix = arg + '='
-        if param.kind == inspect._VAR_KEYWORD:
-            handler_type = KeywordArgsHandler
-            call_prefix = '**'
-        elif param.kind == inspect._VAR_POSITIONAL:
-            handler_type = PositionalArgsHandler
-            call_prefix = '*'
-        call_args.append(call_prefix + arg)
-        if arg in annotations:
-            handlers[arg] = handler_type(annotations[arg])
-
-    # Generate a set of all typevars used in the function signature.
-    typevars = set.union(return_handler.typevars, *(h.typevars for h in handlers.values()))
-
-    # Store the function itself in the codegen context (wrapper closure).
-    gen = Codegen(typevars=typevars)
-    func_var, return_var = gen.new_vars(2)
-    gen.context[func_var] = func
-
-    # Generate code for the function body.
-    gen.write_line('def {}{}:'.format(func.__name__, str(signature)))
-    with gen.indent():
-        # Initialize typevars if required.
-        if gen.typevars:
-            gen.init_typevars()
-
-        # Execute all handlers.
-        for arg in signature.parameters:
-            if arg in handlers:
-                handler = handlers[arg]
+        self.func = func
+        # Coroutine functions get a coroutine wrapper awaiting the result before checking it.
+        self.is_coroutine = inspect.iscoroutinefunction(func)
+        # Async generator functions get an async generator wrapper delegating to the result.
+        self.is_async_gen = (hasattr(inspect, 'isasyncgenfunction') and
+                             inspect.isasyncgenfunction(func))
+        self.annotations = annotations = func.__annotations__
+
+        # Extract function signature without type annotations -- this is because annotations
+        # may contain user types, so we don't want to stringify them and instead pass the
+        # annotations dict to the wrapped function as is.
+        func.__annotations__ = {}
+        self.signature = inspect.signature(func)
+        func.__annotations__ = annotations
+
+        # Build call arguments and type checking handlers for annotated arguments (with the
+        # given limits of forward references, if any).
+        limits = forward_ref_depth, check_once
+        self.return_handler = Handler(annotations.get('return', Any), *limits)
+        self.call_args, self.checks = [], []
+        for arg, param in self.signature.parameters.items():
+            handler_type = Handler
+            call_prefix = arg + '='
+            desc = '`{}`'.format(arg)
+            if param.kind in (inspect._POSITIONAL_ONLY, inspect._POSITIONAL_OR_KEYWORD):
+                # Must be passed positionally in case there's a `*args` parameter following it.
+                call_prefix = ''
+            elif param.kind == inspect._VAR_KEYWORD:
+                handler_type = KeywordArgsHandler
+                call_prefix = '**'
+                desc = 'keyword arguments'
+            elif param.kind == inspect._VAR_POSITIONAL:
+                handler_type = PositionalArgsHandler
+                call_prefix = '*'
+                desc = '`*{}`'.format(arg)
+            self.call_args.append(call_prefix + arg)
+            if arg in annotations:
+                handler = handler_type(annotations[arg], *limits)
                 if not handler.is_any:
-                    var_desc = {
-                        KeywordArgsHandler: 'keyword arguments',
-                        PositionalArgsHandler: '`*{}`'.format(arg)
-                    }.get(type(handler), '`{}`'.format(arg))
-                    handler(gen, arg, var_desc)
-
-        # Call the function and remember the return value.
-        # Optionally, also check the return value type before returning.
-        func_call = '{}({})'.format(func_var, ', '.join(call_args))
-        if not return_handler.is_any:
-            gen.write_line('{} = {}'.format(return_var, func_call))
-            return_handler(gen, return_var, 'return value')
-            gen.write_line('return {}'.format(return_var))
+                    self.checks.append((arg, handler, desc))
+
+        # Generate a set of all typevars used in the function signature.
+        self.typevars = set.union(self.return_handler.typevars,
+                                  *(h.typevars for _, h, _ in self.checks))
+        self.typevar_branches = (self.return_handler.typevar_branches or
+                                 any(h.typevar_branches for _, h, _ in self.checks))
+
+    @property
+    def cache_key(self) -> Optional[str]:
+        code = getattr(self.func, '__code__', None)
+        if code is None:
+            return None
+        return '{}:{}:{}:{}:{}'.format(
+            code.co_filename, code.co_firstlineno, self.func.__qualname__, self.signature,
+            ', '.join('{}: {!r}'.format(k, self.annotations[k])
+                      for k in sorted(self.annotations)))
+
+    @property
+    def result_desc(self) -> str:
+        # Description of the returned iterator or generator, if it's checked lazily.
+        return '`{}()`'.format(self.func.__name__)
+
+    @property
+    def partial(self) -> bool:
+        return self.rate is not None or self.every is not None
+
+    def skip_call(self) -> bool:
+        # Same as the code generated in `codegen()`, decides whether to check this call.
+        if self.rate is not None:
+            skip = random.random() >= self.rate
+        elif self.every is not None:
+            skip = (self.calls[0] + self.calls[1]) % self.every != 0
         else:
-            gen.write_line('return {}'.format(func_call))
+            return False
+        self.calls[1 if skip else 0] += 1
+        return skip
+
+    def codegen(self) -> Codegen:
+        gen = Codegen(sample=self.sample)
+        if code_cache.path is not None:
+            # The key includes the annotations' repr, which is only worth it for the disk cache.
+            gen.cache_key = self.cache_key
+        self.write_wrapper(gen)
+        return gen
+
+    def write_wrapper(self, gen: Codegen, name: Optional[str]=None) -> str:
+        # Writes the wrapper function (possibly along with other wrappers sharing the same
+        # context, under the given name) and returns the name of the variable holding the
+        # original function.
+        func = self.func
+        gen.set_typevars(self.typevars, self.typevar_branches)
 
-    # Compile the wrapper and reattach docstring, annotations, qualname, etc.
-    compiled = gen.compile(func.__name__)
-    wrapper = functools.wraps(func)(compiled)
-    wrapper.wrapper_code = str(gen)
+        # Store the function itself in the codegen context (wrapper closure).
+        func_var, return_var = gen.new_vars(2)
+        gen.context[func_var] = func
+        func_call = '{}({})'.format(func_var, ', '.join(self.call_args))
+        if self.is_coroutine:
+            func_call = 'await ' + func_call
+
+        # Generate code for the function body.
+        is_async = self.is_coroutine or self.is_async_gen
+        gen.write_line('{}def {}{}:'.format('async ' if is_async else '',
+                                            name or func.__name__, str(self.signature)))
+        with gen.indent():
+            # If only some of the calls are checked, decide whether to check this one and
+            # count checked and skipped calls.
+            if self.partial:
+                calls_var = gen.new_var()
+                gen.context[calls_var] = self.calls
+                if self.rate is not None:
+                    gen.write_line('if rt_random() >= {!r}:'.format(self.rate))
+                else:
+                    gen.write_line('if ({0}[0] + {0}[1]) % {1}:'.format(calls_var, self.every))
+                with gen.indent():
+                    gen.write_line('{}[1] += 1'.format(calls_var))
+                    self.write_return(gen, func_call, early=True)
+                gen.write_line('{}[0] += 1'.format(calls_var))
+
+            # If instrumented, count the calls; the checks are timed by `gen.invoke()`.
+            gen.stats = instrumentation.function_name(func) if self.instrument else None
+            if self.instrument:
+                calls_var = gen.new_var()
+                gen.context[calls_var] = instrumentation.record(gen.stats, ())
+                gen.write_line('{}[0] += 1'.format(calls_var))
+
+            # Initialize typevars if required.
+            if gen.typevars:
+                gen.init_typevars()
+
+            # Named arguments and the return value may be replaced with lazily checking proxies.
+            gen.rebindable = {arg: desc for arg, _, desc in self.checks}
+            gen.rebindable[return_var] = self.result_desc
+
+            # Execute all handlers; anything more complex than an isinstance() check is done by
+            # calling the compiled checker of the handler, which is shared between functions
+            # (unless there are typevars which are bound across the whole signature, unless
+            # the value may be replaced, or unless the function is instrumented). If enabled,
+            # verdicts for deeply immutable values are cached by their identity.
+            for arg, handler, desc in self.checks:
+                node = '{}.{}'.format(func.__name__, arg)
+                if handler.simple_types or handler.typevars or handler.lazy:
+                    gen.invoke(handler, arg, desc, node)
+                elif self.instrument:
+                    with gen.remember_verdicts(arg, self.verdict_cache):
+                        gen.invoke(handler, arg, desc, node)
+                else:
+                    checker = gen.new_var()
+                    gen.context[checker] = handler.compile(sample=self.sample)
+                    with gen.remember_verdicts(arg, self.verdict_cache):
+                        gen.write_line('{}({}, {!r})'.format(checker, arg, desc))
+
+            # Call the function and remember the return value.
+            # Optionally, also check the return value type before returning.
+            if not self.return_handler.is_any:
+                gen.write_line('{} = {}'.format(return_var, func_call))
+                gen.invoke(self.return_handler, return_var, 'return value',
+                           '{}.return'.format(func.__name__))
+                self.write_return(gen, return_var)
+            else:
+                self.write_return(gen, func_call)
+
+        return func_var
+
+    def write_return(self, gen: Codegen, value: str, early: bool=False) -> None:
+        # Async generator wrappers can't return a value, so they yield the items instead.
+        if self.is_async_gen:
+            var_item = gen.new_var()
+            gen.write_line('async for {} in {}:'.format(var_item, value))
+            with gen.indent():
+                gen.write_line('yield {}'.format(var_item))
+            if early:
+                gen.write_line('return')
+        else:
+            gen.write_line('return {}'.format(value))
+
+    def interpret(self, interp: Interpreter, arguments: OrderedDict,
+                  describe: bool=False) -> None:
+        for arg, handler, desc in self.checks:
+            handler.interpret(interp, arguments[arg], desc if describe else None)
+
+    def wrap(self, arguments: OrderedDict) -> None:
+        # Same as in the generated code, to be called after the arguments have been checked.
+        for arg, handler, desc in self.checks:
+            if handler.lazy:
+                arguments[arg] = handler.wrap(arguments[arg], desc)
+
+
+class TieredChecker:
+    # Tier 0 of a tiered wrapper: checks calls by interpreting handlers, so that decorating a
+    # function is nearly free; after a given number of calls, the code of the wrapper is
+    # replaced with the compiled one (with codegen context injected into wrapper's globals).
+
+    def __init__(self, checks: FunctionChecks, threshold: int) -> None:
+        self.checks = checks
+        self.threshold = threshold
+        self.calls = 0
+        self.wrapper = None
+
+    def promote(self) -> None:
+        wrapper = self.wrapper
+        gen = self.checks.codegen()
+        compiled = gen.compile(self.checks.func.__name__, context=wrapper.__globals__)
+        switch.set_code(wrapper, compiled.__code__, compiled.__defaults__,
+                        compiled.__kwdefaults__)
+        wrapper.wrapper_code = str(gen)
+
+    def start_call(self, args: Tuple[Any, ...], kwargs: dict) -> Tuple[Any, Callable]:
+        # Checks the arguments and calls the function, returning its result (a coroutine, for
+        # coroutine functions) along with a function that checks the (awaited) result.
+        self.calls += 1
+        if self.calls > self.threshold:
+            self.promote()
+            return self.wrapper(*args, **kwargs), unchecked
+
+        checks = self.checks
+        if checks.skip_call():
+            return checks.func(*args, **kwargs), unchecked
+        arguments = checks.signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+
+        # Errors are described only when rerunning the checks after a failure.
+        interp = Interpreter(checks.sample)
+        try:
+            checks.interpret(interp, arguments.arguments)
+        except TypeError:
+            checks.interpret(Interpreter(), arguments.arguments, describe=True)
+            raise
+        checks.wrap(arguments.arguments)
+
+        result = checks.func(*arguments.args, **arguments.kwargs)
+        if checks.return_handler.is_any:
+            return result, unchecked
+        return result, functools.partial(self.check_result, arguments, interp)
+
+    def check_result(self, arguments: inspect.BoundArguments, interp: Interpreter,
+                     result: Any) -> Any:
+        checks = self.checks
+        try:
+            checks.return_handler.interpret(interp, result, None)
+        except TypeError:
+            interp = Interpreter()
+            checks.interpret(interp, arguments.arguments, describe=True)
+            checks.return_handler.interpret(interp, result, 'return value')
+            raise
+        return checks.return_handler.wrap(result, checks.result_desc)
+
+    def __call__(self, args: Tuple[Any, ...], kwargs: dict) -> Any:
+        result, finish = self.start_call(args, kwargs)
+        return finish(result)
+
+
+def unchecked(result: Any) -> Any:
+    return result
+
+
+def type_check(func: Optional[Callable]=None, *, sample: Optional[int]=None,
+               tiered: Optional[int]=None, rate: Optional[float]=None,
+               every: Optional[int]=None, verdict_cache: Optional[int]=None,
+               instrument: Optional[bool]=None, forward_ref_depth: Optional[int]=None,
+               check_once: Optional[bool]=None) -> Callable:
+    # Allow the decorator to be used with options, e.g. `@type_check(sample=10)`.
+    if func is None:
+        return functools.partial(type_check, sample=sample, tiered=tiered, rate=rate,
+                                 every=every, verdict_cache=verdict_cache, instrument=instrument,
+                                 forward_ref_depth=forward_ref_depth, check_once=check_once)
+
+    checks = FunctionChecks(func, sample=sample, rate=rate, every=every,
+                            verdict_cache=verdict_cache, instrument=instrument,
+                            forward_ref_depth=forward_ref_depth, check_once=check_once)
+
+    if tiered is not None:
+        # Tiered mode: interpret handlers for the first `tiered` calls, then compile.
+        if not isinstance(tiered, int) or tiered < 0:
+            raise ValueError('number of calls must be a non-negative integer: {!r}'
+                             .format(tiered))
+        checker = TieredChecker(checks, tiered)
+        if checks.is_async_gen:
+            code = code_template(tier0_async_gen_source)
+        elif checks.is_coroutine:
+            code = code_template(tier0_async_source)
+        else:
+            code = tier0_code
+        # Builtins are needed by `async for` (StopAsyncIteration) in Python 3.6.
+        wrapper = types.FunctionType(code, {'tier0': checker, '__builtins__': builtins},
+                                     func.__name__)
+        wrapper = checker.wrapper = functools.wraps(func)(wrapper)
+        wrapper.wrapper_code = None
+    else:
+        # Compile the wrapper and reattach docstring, annotations, qualname, etc.
+        gen = checks.codegen()
+        compiled = gen.compile(func.__name__)
+        wrapper = functools.wraps(func)(compiled)
+        wrapper.wrapper_code = str(gen)
+
+    if checks.partial:
+        call_counts[wrapper] = checks.calls
+
+    # Register the wrapper so that checking can be switched on and off at runtime.
+    switch.register(wrapper, func)
 
     return wrapper
+
+
+def type_check_class(cls: Optional[type]=None, *, sample: Optional[int]=None,
+                     rate: Optional[float]=None, every: Optional[int]=None,
+                     verdict_cache: Optional[int]=None, instrument: Optional[bool]=None,
+                     forward_ref_depth: Optional[int]=None,
+                     check_once: Optional[bool]=None) -> type:
+    # Wraps all annotated methods of a class (including static and class methods and property
+    # accessors) that aren't type-checked yet; the wrappers are generated as a single unit,
+    # compiled at once and share the same context, i.e. their globals.
+    if cls is None:
+        return functools.partial(type_check_class, sample=sample, rate=rate, every=every,
+                                 verdict_cache=verdict_cache, instrument=instrument,
+                                 forward_ref_depth=forward_ref_depth, check_once=check_once)
+
+    attrs = list(cls.__dict__.items())
+    funcs = []
+    for _, value in attrs:
+        if isinstance(value, (staticmethod, classmethod)):
+            funcs.append(value.__func__)
+        elif isinstance(value, property):
+            funcs.extend((value.fget, value.fset, value.fdel))
+        else:
+            funcs.append(value)
+    funcs = [f for f in OrderedDict.fromkeys(funcs) if isinstance(f, types.FunctionType)
+             and f.__annotations__ and f not in switch.wrappers]
+    if not funcs:
+        return cls
+
+    # Wrappers are defined under unique names and renamed afterwards, since e.g. property
+    # accessors share the same name, and their names must not shadow builtins or the globals
+    # used by the generated code.
+    gen = Codegen(sample=sample)
+    units = []
+    for func in funcs:
+        checks = FunctionChecks(func, sample=sample, rate=rate, every=every,
+                                verdict_cache=verdict_cache, instrument=instrument,
+                                forward_ref_depth=forward_ref_depth, check_once=check_once)
+        start = len(gen.lines)
+        wrapper_var = gen.new_var()
+        func_var = checks.write_wrapper(gen, wrapper_var)
+        code = '\n'.join(gen.lines[start:]).replace(wrapper_var, func.__name__, 1) + '\n'
+        units.append((checks, func_var, wrapper_var, code))
+    if code_cache.path is not None:
+        cache_keys = [checks.cache_key for checks, _, _, _ in units]
+        if None not in cache_keys:
+            gen.cache_key = '\n'.join(cache_keys)
+    context = gen.compile(None)
+
+    wrappers = {}
+    for checks, func_var, wrapper_var, code in units:
+        wrapper = context.pop(wrapper_var)
+        wrapper.__code__ = rename_code(wrapper.__code__, checks.func.__name__)
+        wrapper = wrappers[checks.func] = functools.wraps(checks.func)(wrapper)
+        wrapper.wrapper_code = code
+        if checks.partial:
+            call_counts[wrapper] = checks.calls
+        switch.register(wrapper, checks.func, func_var)
+
+    def wrap(func: Optional[Callable]) -> Optional[Callable]:
+        return wrappers.get(func, func)
+
+    for name, value in attrs:
+        if isinstance(value, (staticmethod, classmethod)):
+            if value.__func__ in wrappers:
+                setattr(cls, name, type(value)(wrap(value.__func__)))
+        elif isinstance(value, property):
+            if any(f in wrappers for f in (value.fget, value.fset, value.fdel)):
+                setattr(cls, name, value.getter(wrap(value.fget)).setter(wrap(value.fset))
+                        .deleter(wrap(value.fdel)))
+        elif isinstance(value, types.FunctionType) and value in wrappers:
+            setattr(cls, name, wrappers[value])
+    return cls
+
+
+def call_stats(func: Callable) -> CallStats:
+    # Number of checked and skipped calls of a function decorated with `rate` or `every`.
+    if func not in call_counts:
+        raise ValueError('call statistics are only collected for functions decorated '
+                         'with `rate` or `every`: {!r}'.format(func))
+    return CallStats(*call_counts[func])
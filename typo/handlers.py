@@ -2,20 +2,55 @@
 
 import abc
 import collections
+import contextlib
+import sys
+import threading
+import typing
 
 from typing import (
     Any, Dict, List, Tuple, Union, Optional, Callable, Sequence, MutableSequence, Set,
-    TypeVar, _ForwardRef
+    TypeVar, Iterable, Iterator, Generator, _ForwardRef
 )
 
 from typo.codegen import Codegen
-from typo.utils import type_name
+from typo.interpreter import Interpreter
+from typo.utils import type_name, RecursionGuard, CheckedList, CheckedDict
+
+# Missing in typing < 3.5.2 (e.g. the standard library of Python 3.5.0 and 3.5.1).
+AsyncIterator = getattr(typing, 'AsyncIterator', None)
+
+
+# Annotations equivalent to other ones; abstract base classes missing in older Python versions
+# are skipped.
+aliases = {Tuple: Tuple[Any, ...], None: type(None)}
+aliases.update((getattr(collections, tp.__name__), tp)
+               for tp in (Sequence, MutableSequence, Iterator, Iterable, Generator, AsyncIterator)
+               if tp is not None and hasattr(collections, tp.__name__))
 
 
 class HandlerMeta(abc.ABCMeta):
     origin_handlers = {}
     subclass_handlers = {}
 
+    # Handlers are immutable, so equal annotations may share the same handler instance (and
+    # its compiled checkers); least recently used handlers are evicted when the table is full.
+    interned = collections.OrderedDict()
+    max_interned = 4096
+
+    # Limits of forward references (see ForwardRefHandler) of the handlers being created, which
+    # are inherited by the nested handlers they create.
+    creating = threading.local()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def creating_with(limits: Tuple[Optional[int], bool]):
+        outer = getattr(HandlerMeta.creating, 'limits', None)
+        HandlerMeta.creating.limits = limits
+        try:
+            yield
+        finally:
+            HandlerMeta.creating.limits = outer
+
     def __new__(meta, name, bases, ns, *, origin=None, subclass=None):
         cls = super().__new__(meta, name, bases, ns)
         if origin is not None:
@@ -27,25 +62,39 @@ class HandlerMeta(abc.ABCMeta):
     def __init__(self, name, bases, ns, **kwargs):
         super().__init__(name, bases, ns)
 
-    def __call__(cls, bound: Any) -> None:
+    def __call__(cls, bound: Any, max_depth: Optional[int]=None,
+                 check_once: Optional[bool]=None) -> None:
+        # Limits which aren't given are inherited from the handler being created, if any, or
+        # default to the attributes of ForwardRefHandler.
+        if max_depth is not None and (not isinstance(max_depth, int) or max_depth <= 0):
+            raise ValueError('forward reference depth must be a positive integer: {!r}'
+                             .format(max_depth))
+        default = (getattr(cls.creating, 'limits', None) or
+                   (ForwardRefHandler.max_depth, ForwardRefHandler.check_once))
+        limits = (default[0] if max_depth is None else max_depth,
+                  default[1] if check_once is None else bool(check_once))
+
+        # Note that repr is a part of the key since e.g. Union[int, str] == Union[str, int];
+        # so are the limits, as handlers with different limits generate different code.
+        try:
+            key = (cls, bound, repr(bound), limits)
+            instance = cls.interned.get(key)
+        except TypeError:
+            key = instance = None
+        if instance is not None:
+            cls.interned.move_to_end(key)
+            return instance
+
         if cls is not Handler:
             tp = cls
         else:
-            bound = {
-                Tuple: Tuple[Any, ...],
-                collections.Sequence: Sequence,
-                collections.MutableSequence: MutableSequence
-            }.get(bound, bound)
+            bound = aliases.get(bound, bound)
 
             origin = getattr(bound, '__origin__', None)
 
-            # Note that it should be possible to resolve forward references since they
-            # store frames in which they were declared; would require a bit more work.
             if isinstance(bound, _ForwardRef):
-                raise ValueError('forward references are not currently supported: {}'
-                                 .format(bound))
-
-            if bound in (object, Any):
+                tp = ForwardRefHandler
+            elif bound in (object, Any):
                 tp = AnyHandler
             elif origin in cls.origin_handlers:
                 tp = cls.origin_handlers[origin]
@@ -60,18 +109,32 @@ class HandlerMeta(abc.ABCMeta):
                 raise TypeError('invalid type annotation: {!r}'.format(bound))
 
         instance = object.__new__(tp)
-        instance.__init__(bound)
+        with cls.creating_with(limits):
+            instance.__init__(bound)
+
+        if key is not None:
+            cls.interned[key] = instance
+            if len(cls.interned) > cls.max_interned:
+                cls.interned.popitem(last=False)
         return instance
 
 
 class Handler(metaclass=HandlerMeta):
     def __init__(self, bound: Any) -> None:
         self.bound = bound
+        self.compiled = {}
+        self.compiled_diagnostic = {}
+        self.compiled_predicate = None
+        self.compiled_many = None
 
     @abc.abstractmethod
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def __str__(self) -> str:
         raise NotImplementedError
@@ -82,24 +145,168 @@ class Handler(metaclass=HandlerMeta):
             return self.bound.__args__
         return self.bound.__parameters__
 
-    def compile(self) -> Callable[[Any], None]:
-        gen = Codegen(typevars=self.typevars)
+    def compile(self, sample: Optional[int]=None) -> Callable[[Any, str], None]:
+        # Compiled checkers are cached, so they are shared by all users of the handler. Values
+        # are first checked by a fast path which doesn't describe failures (same as the
+        # predicate); if it fails, the diagnostic checker is compiled and run on the value to
+        # raise the error. Sampled items may differ between the two runs, so sampling
+        # checkers describe failures right away.
+        if sample in self.compiled:
+            return self.compiled[sample]
+        if sample is not None:
+            self.compiled[sample] = self.compile_diagnostic(sample)
+            return self.compiled[sample]
+        gen = Codegen(typevars=self.typevars, typevar_branches=self.typevar_branches,
+                      predicate=True)
+        gen.cache_key = 'handler-fast:{!r}'.format(self.bound)
+        var, var_diagnose = gen.new_vars(2)
+        gen.context[var_diagnose] = self.diagnose
+        gen.predicate_fail = '{}({}, v_desc)'.format(var_diagnose, var)
+        gen.write_line("def check({}, v_desc='input'):".format(var))
+        with gen.indent():
+            if self.typevars:
+                gen.init_typevars()
+            self(gen, var, '{v_desc}')
+        self.compiled[sample] = gen.compile('check')
+        return self.compiled[sample]
+
+    def compile_diagnostic(self, sample: Optional[int]=None) -> Callable[[Any, str], None]:
+        # Checker describing failures as it goes.
+        if sample in self.compiled_diagnostic:
+            return self.compiled_diagnostic[sample]
+        gen = Codegen(typevars=self.typevars, sample=sample,
+                      typevar_branches=self.typevar_branches)
+        gen.cache_key = 'handler:{!r}'.format(self.bound)
         var = gen.new_var()
-        gen.write_line('def check({}):'.format(var))
+        gen.write_line("def check({}, v_desc='input'):".format(var))
+        with gen.indent():
+            if self.typevars:
+                gen.init_typevars()
+            self(gen, var, '{v_desc}')
+        self.compiled_diagnostic[sample] = gen.compile('check')
+        return self.compiled_diagnostic[sample]
+
+    def diagnose(self, value: Any, desc: str='input') -> None:
+        # Called by the fast path of the compiled checker if the value fails it.
+        self.compile_diagnostic()(value, desc)
+        raise TypeError('invalid {}: expected {}'.format(desc, self))
+
+    def predicate(self) -> Callable[[Any], bool]:
+        # Same as the compiled checker but returns False instead of raising a TypeError, and
+        # doesn't describe failures at all (so there's no need to track item indices etc).
+        if self.compiled_predicate is not None:
+            return self.compiled_predicate
+        gen = Codegen(typevars=self.typevars, typevar_branches=self.typevar_branches,
+                      predicate=True)
+        gen.cache_key = 'handler:{!r}'.format(self.bound)
+        var = gen.new_var()
+        gen.write_line('def predicate({}):'.format(var))
         with gen.indent():
             if self.typevars:
                 gen.init_typevars()
             self(gen, var, 'input')
-        return gen.compile('check')
+            gen.write_line('return True')
+        self.compiled_predicate = gen.compile('predicate')
+        return self.compiled_predicate
+
+    def compile_many(self) -> Callable[[Iterable[Any], bool], Iterator[Tuple[int, str]]]:
+        # Generator checking all values of an iterable within a single loop, yielding indices
+        # and error messages of the invalid ones (and stopping at the first one if asked to).
+        if self.compiled_many is not None:
+            return self.compiled_many
+        # Rows are checked by a loop in predicate mode which returns the first invalid row
+        # (resuming the same iterator when called again), so only invalid rows are described
+        # by the diagnostic checker.
+        gen = Codegen(typevars=self.typevars, typevar_branches=self.typevar_branches,
+                      predicate=True)
+        gen.cache_key = 'handler-many:{!r}'.format(self.bound)
+        var_values, var_fail_fast, var_rows, var_i, var, var_e = gen.new_vars(6)
+        var_scan, var_invalid, var_diagnose = gen.new_vars(3)
+        gen.context[var_diagnose] = self.diagnose
+        gen.predicate_fail = '{}, {}'.format(var_i, var)
+        gen.write_line('def validate_many({}, {}):'.format(var_values, var_fail_fast))
+        with gen.indent():
+            gen.write_line('{} = enumerate({})'.format(var_rows, var_values))
+            gen.write_line('while True:')
+            with gen.indent():
+                gen.write_line('{} = {}({})'.format(var_invalid, var_scan, var_rows))
+                gen.write_line('if {} is None:'.format(var_invalid))
+                with gen.indent():
+                    gen.write_line('return')
+                gen.write_line('{}, {} = {}'.format(var_i, var, var_invalid))
+                gen.write_line('try:')
+                with gen.indent():
+                    gen.write_line("{}({}, 'row #{{}}'.format({}))"
+                                   .format(var_diagnose, var, var_i))
+                gen.write_line('except TypeError as {}:'.format(var_e))
+                with gen.indent():
+                    gen.write_line('yield {}, str({})'.format(var_i, var_e))
+                gen.write_line('if {}:'.format(var_fail_fast))
+                with gen.indent():
+                    gen.write_line('return')
+        gen.write_line('def {}({}):'.format(var_scan, var_rows))
+        with gen.indent():
+            gen.write_line('for {}, {} in {}:'.format(var_i, var, var_rows))
+            with gen.indent():
+                if self.typevars:
+                    gen.init_typevars()
+                self(gen, var, 'row')
+            gen.write_line('return None')
+        self.compiled_many = gen.compile('validate_many')
+        return self.compiled_many
+
+    def validate(self, value: Any, desc: str='input', sample: Optional[int]=None) -> None:
+        # Same as calling the compiled checker but without compiling anything. The value is
+        # first checked without building error descriptions, which is only done on failure.
+        try:
+            self.interpret(Interpreter(sample), value, None)
+        except TypeError:
+            self.interpret(Interpreter(), value, desc)
+            raise
 
     @property
     def is_any(self) -> bool:
         return False
 
+    @property
+    def is_typevar(self) -> bool:
+        return False
+
+    @property
+    def shareable(self) -> bool:
+        # True if the checks can be replaced by a call to the compiled checker of the handler,
+        # which can't bind typevars or replace values.
+        return not (self.simple_types or self.typevars or self.lazy or self.is_any)
+
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        # If set, the handler rejects all values that are not instances of this class.
+        return None
+
+    @property
+    def lazy(self) -> bool:
+        # True if the handler may replace values with proxies checking them lazily.
+        return False
+
+    def wrap(self, value: Any, desc: str) -> Any:
+        # Replace a value that has already been checked with a lazily checking proxy.
+        return value
+
+    @property
+    def simple_types(self) -> Optional[Tuple[type, ...]]:
+        # Non-empty if the handler only checks whether the value is an instance of these types.
+        return None
+
     @property
     def typevars(self) -> Set[type(TypeVar)]:
         return set()
 
+    @property
+    def typevar_branches(self) -> bool:
+        # True if checking may yield multiple alternative assignments to type variables (or
+        # if failed checks need to be rolled back), otherwise they're just local variables.
+        return False
+
     @property
     def valid_typevar_bound(self) -> bool:
         return False
@@ -117,11 +324,18 @@ class SingleArgumentHandler(Handler):
     def typevars(self) -> Set[type(TypeVar)]:
         return self.handler.typevars
 
+    @property
+    def typevar_branches(self) -> bool:
+        return self.handler.typevar_branches
+
 
 class AnyHandler(Handler):
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         gen.write_line('pass')
 
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        pass
+
     def __str__(self) -> str:
         return 'Any'
 
@@ -138,9 +352,16 @@ class TypeHandler(Handler):
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         gen.check_type(varname, desc, self.bound)
 
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, self.bound)
+
     def __str__(self) -> str:
         return type_name(self.bound)
 
+    @property
+    def simple_types(self) -> Optional[Tuple[type, ...]]:
+        return (self.bound,)
+
     @property
     def valid_typevar_bound(self) -> bool:
         return True
@@ -177,98 +398,115 @@ class TypeVarHandler(Handler, subclass=TypeVar('')):
         return self.bound_handler is not None
 
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
-        # TODO: don't need outer list if there are no generic unions
         # TODO: can infer when the typevar has been definitely set
         # TODO: can infer when the typevar is definitely uninitialized
-        # TODO: more efficient typevar processing for sequences
         # TODO: simplify indent/write_line, make them accept fmt args
         # TODO: List, Dict, Sequence, etc should be valid bounds
         # TODO: support forward references (_ForwardRef), care about recursion
-        var_i, var_tv, var_tp, var_len, var_k = gen.new_vars(5)
-        index = gen.typevar_id(self.bound)
-        tv = '{}[{}]'.format(var_tv, index)
+        var_tp = gen.new_var()
         gen.write_line('{} = type({})'.format(var_tp, varname))
-        gen.write_line('{} = len(tv)'.format(var_len))
-
-        # for all possible assignments to type variables
-        gen.write_line('for {}, {} in enumerate(list(tv)):'.format(var_i, var_tv))
+        msg = 'cannot assign {{tp}} to {}'.format(self)
+
+        # generic constraints may yield multiple assignments, see below
+        if self.typevar_constraints:
+            self.bind_generic(gen, varname, var_tp, desc, msg)
+            return
+
+        # otherwise, the type variable is bound to the class of the value, unless it
+        # doesn't satisfy the upper bound or the invariant constraints
+        invalid = None
+        if self.has_bound and self.bound_handler.simple_types:
+            invalid = 'not isinstance({}, {})'.format(
+                varname, gen.ref_types(self.bound_handler.simple_types))
+        elif self.has_constraints:
+            invalid = '{} not in ({}, )'.format(
+                var_tp, ', '.join(gen.ref_type(tp) for tp in self.type_constraints))
+        gen.bind_typevar(self.bound, var_tp, varname, desc, msg, invalid)
+
+    def bind_generic(self, gen: Codegen, varname: str, var_tp: str, desc: Optional[str],
+                     msg: str) -> None:
+        # Same as Codegen.bind_typevar() except that each of the assignments in which the type
+        # variable is not set yet may be replaced with multiple ones (one for each satisfied
+        # generic constraint, which may bind other type variables in turn).
+        index = gen.typevar_id(self.bound)
+        var_a, var_b, var_new, var_bound, var_old_tv = gen.new_vars(5)
+        gen.write_line('for {} in tv:'.format(var_a))
         with gen.indent():
-            gen.write_line('{} = {} + len(tv) - {}'.format(var_k, var_i, var_len))
-
-            # if the type variable of interest is already set in this assignment
-            gen.write_line('if {} is not None:'.format(tv))
+            gen.write_line('if {}[{}] is not {}:'.format(var_a, index, var_tp))
             with gen.indent():
-                # check if value type matches it exactly
-                gen.write_line('if {} is not {}:'.format(tv, var_tp))
-                with gen.indent():
-                    # if not, the assignment is inconsistent, remove it
-                    gen.write_line('tv.pop({})'.format(var_k))
-                # and go on to the next assignment
-                gen.write_line('continue')
-
-            # otherwise, the type variable has not been bound; first, consider
-            # the case where the type variable has a specified upper bound
-            if self.has_bound:
-                # try to run the bound handler
-                gen.write_line('try:')
-                with gen.indent():
-                    self.bound_handler(gen, varname, None)
-                    # if it succeeds, bind the type variable to class of the value
-                    gen.write_line('{} = {}'.format(tv, var_tp))
-                gen.write_line('except TypeError:')
+                gen.write_line('{} = []'.format(var_new))
+                gen.write_line('for {} in tv:'.format(var_b))
                 with gen.indent():
-                    # otherwise, the assignment is inconsistent, remove it
-                    gen.write_line('tv.pop({})'.format(var_k))
-
-            # second, if the type variable has invariant constraints
-            elif self.has_constraints:
-                # if there are simple class constraints, check them first
-                if self.type_constraints:
-                    types = ', '.join(gen.ref_type(tp) for tp in self.type_constraints) + ', '
-                    # if the class of the value matches one of the constraints exactly
-                    gen.write_line('if {} in ({}):'.format(var_tp, types))
+                    gen.write_line('if {}[{}] is {}:'.format(var_b, index, var_tp))
                     with gen.indent():
-                        # then bind the type variable to the class of the value and go on
-                        gen.write_line('{} = {}'.format(tv, var_tp))
+                        gen.write_line('{}.append({})'.format(var_new, var_b))
                         gen.write_line('continue')
-
-                # if there are no simple class constraints or if they are not satisfied,
-                # check if there are any generic constraints
-                if self.typevar_constraints:
-                    # this is complicated... (somewhat similar to union type)
-                    # ... should really use linked lists for all of this stuff
-                    var_old_tv, var_tv_init, var_tv_res = gen.new_vars(3)
-                    gen.write_line('{} = [list({})]'.format(var_tv_init, var_tv))
-                    gen.write_line('{}[0][{}] = {}'.format(var_tv_init, index, var_tp))
+                    gen.write_line('if {}[{}] is not None:'.format(var_b, index))
+                    with gen.indent():
+                        gen.write_line('continue')
+                    gen.write_line('{} = {}[:{}] + ({},) + {}[{}:]'.format(
+                        var_bound, var_b, index, var_tp, var_b, index + 1))
+                    # if the class of the value matches one of the simple constraints exactly
+                    if self.type_constraints:
+                        types = ', '.join(gen.ref_type(tp) for tp in self.type_constraints)
+                        gen.write_line('if {} in ({}, ):'.format(var_tp, types))
+                        with gen.indent():
+                            gen.write_line('{}.append({})'.format(var_new, var_bound))
+                            gen.write_line('continue')
+                    # otherwise, try each of the generic constraints separately
                     gen.write_line('{} = tv'.format(var_old_tv))
-                    gen.write_line('tv.pop({})'.format(var_k))
                     for handler in self.typevar_constraints:
-                        # TODO: simplify this down a bit
-                        gen.write_line('tv = [list({}[0])]'.format(var_tv_init))
+                        gen.write_line('tv = [{}]'.format(var_bound))
                         gen.write_line('try:')
                         with gen.indent():
-                            handler(gen, varname, None)
-                            gen.write_line('for {} in tv:'.format(var_tv_res))
-                            with gen.indent():
-                                gen.write_line('{}.insert({}, {})'
-                                               .format(var_old_tv, var_k, var_tv_res))
+                            gen.invoke(handler, varname, None, str(handler))
+                            gen.write_line('{}.extend(tv)'.format(var_new))
                         gen.write_line('except TypeError:')
                         with gen.indent():
                             gen.write_line('pass')
                     gen.write_line('tv = {}'.format(var_old_tv))
-
-                # there are no generic constraints, and simple constraints failed
-                else:
-                    gen.write_line('tv.pop({})'.format(var_k))
-
-            # there are no bounds nor constraints, just bind the type variable
+                gen.write_line('if not {}:'.format(var_new))
+                with gen.indent():
+                    gen.fail_msg(desc, msg, varname)
+                gen.write_line('tv = {}'.format(var_new))
+                gen.write_line('break')
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        # Same logic as in the generated code above, see the comments there.
+        tp = type(value)
+        assignments = interp.tv
+        interp.tv = []
+        for tv in assignments:
+            if self.bound in tv:
+                if tv[self.bound] is tp:
+                    interp.tv.append(tv)
+                continue
+            bound_tv = dict(tv)
+            bound_tv[self.bound] = tp
+            if self.has_bound:
+                try:
+                    self.bound_handler.interpret(interp, value, None)
+                except TypeError:
+                    continue
+                interp.tv.append(bound_tv)
+            elif self.has_constraints:
+                if tp in self.type_constraints:
+                    interp.tv.append(bound_tv)
+                    continue
+                valid = interp.tv
+                for handler in self.typevar_constraints:
+                    interp.tv = [bound_tv]
+                    try:
+                        handler.interpret(interp, value, None)
+                    except TypeError:
+                        pass
+                    else:
+                        valid.extend(interp.tv)
+                interp.tv = valid
             else:
-                gen.write_line('{} = {}'.format(tv, var_tp))
-
-        # if the list of valid assignments is now empty, it is a fail
-        gen.write_line('if not tv:')
-        with gen.indent():
-            gen.fail_msg(desc, 'cannot assign {{tp}} to {}'.format(self), varname)
+                interp.tv.append(bound_tv)
+        if not interp.tv:
+            interp.fail_msg(desc, 'cannot assign {{tp}} to {}'.format(self), value)
 
     def __str__(self) -> str:
         return self.bound.__name__
@@ -277,6 +515,14 @@ class TypeVarHandler(Handler, subclass=TypeVar('')):
     def typevars(self) -> Set[type(TypeVar)]:
         return {self.bound}
 
+    @property
+    def typevar_branches(self) -> bool:
+        return bool(self.typevar_constraints)
+
+    @property
+    def is_typevar(self) -> bool:
+        return True
+
     @property
     def valid_typevar_bound(self) -> bool:
         # Technically, this is possible but would require a bit more codegen work. The problem
@@ -305,34 +551,72 @@ class DictHandler(Handler, origin=Dict):
         gen.check_type(varname, desc, dict)
         if not self.key_handler.is_any or not self.value_handler.is_any:
             var_k, var_v = gen.new_var(), gen.new_var()
-            gen.write_line('for {}, {} in {}.items():'.format(var_k, var_v, varname))
-            with gen.indent():
-                self.key_handler(gen, var_k, None if desc is None else
-                                 'key of {}'.format(desc))
-                self.value_handler(gen, var_v, None if desc is None else
-                                   'value at {{{}!r}} of {}'.format(var_k, desc))
+            checks = [(it, h) for it, h in [(varname, self.key_handler),
+                                            ('{}.values()'.format(varname), self.value_handler)]
+                      if not h.is_any]
+            with gen.skip_checked(varname, self, CheckedDict), gen.summarize_types(checks):
+                gen.write_line('for {}, {} in {}:'.format(
+                    var_k, var_v, gen.sampled('{}.items()'.format(varname))))
+                with gen.indent():
+                    gen.invoke(self.key_handler, var_k, None if desc is None else
+                               'key of {}'.format(desc), 'key')
+                    gen.invoke(self.value_handler, var_v, None if desc is None else
+                               'value at {{{}!r}} of {}'.format(var_k, desc), 'value')
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, dict)
+        if (not self.key_handler.is_any or not self.value_handler.is_any) and not (
+                type(value) is CheckedDict and value.handler is self and not self.typevars):
+            if ((self.key_handler.is_any or interp.types_match(value, self.key_handler)) and
+                    (self.value_handler.is_any or
+                     interp.types_match(value.values(), self.value_handler))):
+                return
+            for k, v in interp.sampled(value.items()):
+                self.key_handler.interpret(interp, k, None if desc is None else
+                                           'key of {}'.format(desc))
+                self.value_handler.interpret(interp, v, None if desc is None else
+                                             'value at {!r} of {}'.format(k, desc))
 
     def __str__(self) -> str:
         if self.key_handler.is_any and self.value_handler.is_any:
             return 'dict'
         return 'Dict[{}, {}]'.format(self.key_handler, self.value_handler)
 
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        return dict
+
     @property
     def typevars(self) -> Set[type(TypeVar)]:
         return self.key_handler.typevars | self.value_handler.typevars
 
+    @property
+    def typevar_branches(self) -> bool:
+        return self.key_handler.typevar_branches or self.value_handler.typevar_branches
+
 
 class ListHandler(SingleArgumentHandler, origin=List):
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         gen.check_type(varname, desc, list)
         if not self.handler.is_any:
-            gen.enumerate_and_check(varname, desc, self.handler)
+            with gen.skip_checked(varname, self, CheckedList):
+                gen.enumerate_and_check(varname, desc, self.handler)
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, list)
+        if not self.handler.is_any and not (type(value) is CheckedList and
+                                            value.handler is self and not self.typevars):
+            interp.enumerate_and_check(value, desc, self.handler)
 
     def __str__(self) -> str:
         if self.handler.is_any:
             return 'list'
         return 'List[{}]'.format(self.handler)
 
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        return list
+
 
 class UnionHandler(Handler, subclass=Union):
     def __init__(self, bound: Any) -> None:
@@ -343,43 +627,133 @@ class UnionHandler(Handler, subclass=Union):
         self.types = tuple(h.bound for h in self.all_handlers
                            if isinstance(h, TypeHandler))
 
+        # For values of exactly one of the dispatch types of the members, only the members
+        # with that dispatch type or without one at all need to be tried (in the same
+        # order); None means that the values are instances of one of the simple types.
+        self.dispatch = collections.OrderedDict()
+        for h in self.handlers:
+            tp = h.dispatch_type
+            if tp is None or tp in self.dispatch:
+                continue
+            self.dispatch[tp] = None
+            if not any(issubclass(tp, t) for t in self.types):
+                self.dispatch[tp] = [h for h in self.handlers if h.dispatch_type in (tp, None)]
+
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
         if not self.handlers and not self.types:
             gen.write_line('pass')
         elif len(self.handlers) == 1 and not self.types:
-            self.handlers[0](gen, varname, desc)
+            gen.invoke(self.handlers[0], varname, desc, str(self.handlers[0]))
         elif not self.handlers and self.types:
             gen.check_type(varname, desc, self.types)
         else:
             var = gen.new_var()
             gen.write_line('{} = True'.format(var))
-            handlers = self.handlers
-            if self.types:
-                handlers = [self.types] + handlers
-            for handler in handlers:
-                if isinstance(handler, tuple):
-                    gen.if_not_isinstance(varname, handler)
-                else:
-                    gen.write_line('try:')
+            if not self.dispatch:
+                self.try_handlers(gen, varname, self.handlers, var)
+            else:
+                var_tp = gen.new_var()
+                gen.write_line('{} = type({})'.format(var_tp, varname))
+                for i, (tp, handlers) in enumerate(self.dispatch.items()):
+                    gen.write_line('{} {} is {}:'.format('elif' if i else 'if', var_tp,
+                                                         gen.ref_type(tp)))
                     with gen.indent():
-                        handler(gen, varname, None)
-                    gen.write_line('except TypeError:')
-                gen.indent_level += 1
-            gen.write_line('{} = False'.format(var))
-            gen.indent_level -= len(handlers)
+                        if handlers is None:
+                            gen.write_line('pass')
+                        else:
+                            self.try_handlers(gen, varname, handlers, var, types=False)
+                gen.write_line('else:')
+                with gen.indent():
+                    self.try_handlers(gen, varname, self.handlers, var)
             gen.write_line('if not {}:'.format(var))
-            expected = '{} or {}'.format(
-                ', '.join(map(str, self.all_handlers[:-1])), self.all_handlers[-1])
             with gen.indent():
-                gen.fail(desc, expected, varname)
+                gen.fail(desc, self.expected, varname)
+
+    def try_handlers(self, gen: Codegen, varname: str, handlers: List[Handler], var: str,
+                     types: bool=True) -> None:
+        # Try each of the handlers in turn (after the simple types) until one of them
+        # succeeds; if all of them fail, set `var` to False.
+        if types and self.types:
+            handlers = [self.types] + handlers
+        for handler in handlers:
+            if isinstance(handler, tuple):
+                gen.if_not_isinstance(varname, handler)
+                gen.indent_level += 1
+                continue
+            # typevar assignments are immutable, so they are restored after a failure
+            var_tv = None
+            if handler.typevars:
+                var_tv = gen.new_var()
+                gen.write_line('{} = tv'.format(var_tv))
+            gen.write_line('try:')
+            with gen.indent():
+                gen.invoke(handler, varname, None, str(handler))
+            gen.write_line('except TypeError:')
+            gen.indent_level += 1
+            if var_tv is not None:
+                gen.write_line('tv = {}'.format(var_tv))
+        gen.write_line('{} = False'.format(var))
+        gen.indent_level -= len(handlers)
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        if not self.handlers and not self.types:
+            pass
+        elif len(self.handlers) == 1 and not self.types:
+            self.handlers[0].interpret(interp, value, desc)
+        elif not self.handlers and self.types:
+            interp.check_type(value, desc, self.types)
+        elif not self.types or not isinstance(value, self.types):
+            # unlike the generated code, failed branches don't affect typevar assignments
+            assignments = interp.tv
+            for handler in self.dispatch.get(type(value)) or self.handlers:
+                interp.tv = list(assignments)
+                try:
+                    handler.interpret(interp, value, None)
+                except TypeError:
+                    continue
+                return
+            interp.tv = assignments
+            interp.fail(desc, self.expected, value)
+
+    @property
+    def expected(self) -> str:
+        return '{} or {}'.format(
+            ', '.join(map(str, self.all_handlers[:-1])), self.all_handlers[-1])
 
     def __str__(self) -> str:
-        return 'Union[{}]'.format(', '.join(map(str, self.all__handlers)))
+        return 'Union[{}]'.format(', '.join(map(str, self.all_handlers)))
+
+    @property
+    def simple_types(self) -> Optional[Tuple[type, ...]]:
+        if not self.handlers and self.types:
+            return self.types
+        return None
 
     @property
     def typevars(self) -> Set[type(TypeVar)]:
         return set(t for h in self.handlers for t in h.typevars)
 
+    @property
+    def typevar_branches(self) -> bool:
+        # assignments made by a failed branch have to be discarded
+        return bool(self.typevars)
+
+    @property
+    def lazy(self) -> bool:
+        return any(h.lazy for h in self.handlers)
+
+    def wrap(self, value: Any, desc: str) -> Any:
+        # Same as the generated code: the value is wrapped by the first matching member.
+        if self.types and isinstance(value, self.types):
+            return value
+        for handler in self.dispatch.get(type(value)) or self.handlers:
+            try:
+                handler.interpret(Interpreter(), value, None)
+            except TypeError:
+                continue
+            return handler.wrap(value, desc)
+        return value
+
 
 class TupleHandler(Handler, subclass=Tuple):
     def __init__(self, bound: Any) -> None:
@@ -404,8 +778,21 @@ class TupleHandler(Handler, subclass=Tuple):
                 gen.fail(desc, 'tuple of length {}'.format(n), varname,
                          got='tuple of length {{{}}}'.format(var_n))
             for i, handler in enumerate(self.handlers):
-                handler(gen, '{}[{}]'.format(varname, i),
-                        None if desc is None else 'item #{} of {}'.format(i, desc))
+                gen.invoke(handler, '{}[{}]'.format(varname, i),
+                           None if desc is None else 'item #{} of {}'.format(i, desc), str(i))
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, tuple)
+        if self.ellipsis:
+            interp.enumerate_and_check(value, desc, self.handler)
+        else:
+            n = len(self.handlers)
+            if len(value) != n:
+                interp.fail(desc, 'tuple of length {}'.format(n), value,
+                            got='tuple of length {}'.format(len(value)))
+            for i, handler in enumerate(self.handlers):
+                handler.interpret(interp, value[i],
+                                  None if desc is None else 'item #{} of {}'.format(i, desc))
 
     def __str__(self) -> str:
         if self.ellipsis:
@@ -414,19 +801,36 @@ class TupleHandler(Handler, subclass=Tuple):
             return 'Tuple[{}, ...]'.format(self.handler)
         return 'Tuple[{}]'.format(', '.join(map(str, self.handlers)))
 
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        return tuple
+
     @property
     def typevars(self) -> Set[type(TypeVar)]:
         if self.ellipsis:
             return self.handler.typevars
         return set(t for h in self.handlers for t in h.typevars)
 
+    @property
+    def typevar_branches(self) -> bool:
+        if self.ellipsis:
+            return self.handler.typevar_branches
+        return any(h.typevar_branches for h in self.handlers)
+
 
 class SequenceHandler(SingleArgumentHandler, origin=Sequence):
+    attrs = ['__iter__', '__getitem__', '__len__', '__contains__']
+
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
-        gen.check_attrs_cached(varname, desc, 'sequence', 'v_cache_seq',
-                               ['__iter__', '__getitem__', '__len__', '__contains__'])
+        gen.check_attrs_cached(varname, desc, 'sequence', 'v_cache_seq', self.attrs)
         if not self.handler.is_any:
-            gen.enumerate_and_check(varname, desc, self.handler)
+            with gen.check_buffer(varname, self.handler):
+                gen.enumerate_and_check(varname, desc, self.handler)
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_attrs_cached(value, desc, 'sequence', 'v_cache_seq', self.attrs)
+        if not self.handler.is_any and not interp.buffer_matches(value, self.handler):
+            interp.enumerate_and_check(value, desc, self.handler)
 
     def __str__(self) -> str:
         if self.handler.is_any:
@@ -435,12 +839,19 @@ class SequenceHandler(SingleArgumentHandler, origin=Sequence):
 
 
 class MutableSequenceHandler(SingleArgumentHandler, origin=MutableSequence):
+    attrs = ['__iter__', '__getitem__', '__len__', '__contains__', '__setitem__', '__delitem__']
+
     def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
-        gen.check_attrs_cached(varname, desc, 'mutable sequence', 'v_cache_mut_seq',
-                               ['__iter__', '__getitem__', '__len__', '__contains__',
-                                '__setitem__', '__delitem__'])
+        gen.check_attrs_cached(varname, desc, 'mutable sequence', 'v_cache_mut_seq', self.attrs)
         if not self.handler.is_any:
-            gen.enumerate_and_check(varname, desc, self.handler)
+            with gen.check_buffer(varname, self.handler):
+                gen.enumerate_and_check(varname, desc, self.handler)
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_attrs_cached(value, desc, 'mutable sequence', 'v_cache_mut_seq',
+                                  self.attrs)
+        if not self.handler.is_any and not interp.buffer_matches(value, self.handler):
+            interp.enumerate_and_check(value, desc, self.handler)
 
     def __str__(self) -> str:
         if self.handler.is_any:
@@ -454,7 +865,291 @@ class SetHandler(SingleArgumentHandler, origin=Set):
         if not self.handler.is_any:
             gen.iter_and_check(varname, desc, self.handler)
 
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, set)
+        if not self.handler.is_any:
+            interp.iter_and_check(value, desc, self.handler)
+
     def __str__(self) -> str:
         if self.handler.is_any:
             return 'set'
         return 'Set[{}]'.format(self.handler)
+
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        return set
+
+
+class ForwardRefHandler(Handler):
+    # Forward references are resolved in the frame where they were declared when first
+    # checked, and checked by calling the compiled checkers of the resolved type hint, so
+    # recursive type hints are checked by recursive calls. The limits are given when creating
+    # the outermost handler (the attributes below are the defaults): values nested more deeply
+    # than `max_depth` forward references aren't checked, and with `check_once`, each value is
+    # checked against a forward reference once per outermost check, which stops at cycles.
+    # Lazy type hints can't be referenced, as the values couldn't be replaced.
+    max_depth = None
+    check_once = False
+
+    def __init__(self, bound: Any) -> None:
+        super().__init__(bound)
+        self.resolved = None
+        self.limits = HandlerMeta.creating.limits
+        self.guard = None
+        if self.limits != (None, False):
+            self.guard = RecursionGuard(*self.limits)
+
+    @property
+    def target(self) -> Handler:
+        if self.resolved is None:
+            frame = self.bound.__forward_frame__
+            try:
+                hint = self.bound._eval_type(frame.f_globals, frame.f_locals)
+            except Exception as e:
+                raise ValueError('cannot resolve forward reference {!r}: {}'
+                                 .format(self.bound.__forward_arg__, e)) from e
+            with HandlerMeta.creating_with(self.limits):
+                handler = Handler(hint)
+            if handler.typevars:
+                raise ValueError('forward references to generic type hints are not '
+                                 'supported: {!r}'.format(self.bound.__forward_arg__))
+            if handler.lazy:
+                raise ValueError('forward references to lazy type hints are not '
+                                 'supported: {!r}'.format(self.bound.__forward_arg__))
+            self.resolved = handler
+        return self.resolved
+
+    def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
+        if self.guard is None:
+            gen.call_checkers(self, varname, desc, lazy=True)
+            return
+        var_guard = gen.new_var()
+        gen.context[var_guard] = self.guard
+        gen.write_line('if {}.enter({}):'.format(var_guard, varname))
+        with gen.indent():
+            gen.write_line('try:')
+            with gen.indent():
+                gen.call_checkers(self, varname, desc, lazy=True)
+                gen.write_line('{}.done({})'.format(var_guard, varname))
+            gen.write_line('finally:')
+            with gen.indent():
+                gen.write_line('{}.leave({})'.format(var_guard, varname))
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        if self.guard is None:
+            self.target.interpret(interp, value, desc)
+        elif self.guard.enter(value):
+            try:
+                self.target.interpret(interp, value, desc)
+                self.guard.done(value)
+            finally:
+                self.guard.leave(value)
+
+    def compile(self, sample: Optional[int]=None) -> Callable[[Any, str], None]:
+        return self.target.compile(sample)
+
+    def compile_diagnostic(self, sample: Optional[int]=None) -> Callable[[Any, str], None]:
+        return self.target.compile_diagnostic(sample)
+
+    def predicate(self) -> Callable[[Any], bool]:
+        return self.target.predicate()
+
+    def __str__(self) -> str:
+        return self.bound.__forward_arg__
+
+    @property
+    def shareable(self) -> bool:
+        # the checks are calls already
+        return False
+
+
+class LazyHandler(Handler):
+    # Lazy values (e.g. iterators) can't be checked upfront. If the value can be replaced (it's
+    # an argument or the return value of a type-checked function), it's wrapped in a proxy
+    # generator checking the items as they flow through; otherwise, only its interface is
+    # checked. Type variables are bound separately for each of the proxies.
+    attrs = []
+    expected = None
+    cache = None
+    proxy_def = 'def'
+
+    def __init__(self, bound: Any) -> None:
+        super().__init__(bound)
+        self.handlers = [Handler(arg) for arg in self.args]
+        self.compiled_proxy = None
+
+    def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
+        gen.check_attrs_cached(varname, desc, self.expected, self.cache, self.attrs)
+        if self.checks_items and varname in gen.rebindable:
+            var_proxy = gen.new_var()
+            gen.context[var_proxy] = self.proxy()
+            gen.write_line('{} = {}({}, {!r})'.format(
+                varname, var_proxy, varname, gen.rebindable[varname]))
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_attrs_cached(value, desc, self.expected, self.cache, self.attrs)
+
+    def wrap(self, value: Any, desc: str) -> Any:
+        if not self.checks_items:
+            return value
+        return self.proxy()(value, desc)
+
+    def proxy(self) -> Callable[[Any, str], Any]:
+        if self.compiled_proxy is not None:
+            return self.compiled_proxy
+        typevars = set(t for h in self.handlers for t in h.typevars)
+        gen = Codegen(typevars=typevars,
+                      typevar_branches=any(h.typevar_branches for h in self.handlers))
+        gen.cache_key = 'proxy:{!r}'.format(self.bound)
+        var, var_desc = gen.new_var(), 'v_desc'
+        gen.write_line('{} proxy({}, {}):'.format(self.proxy_def, var, var_desc))
+        with gen.indent():
+            if typevars:
+                gen.init_typevars()
+            self.write_proxy(gen, var)
+        self.compiled_proxy = gen.compile('proxy')
+        return self.compiled_proxy
+
+    @abc.abstractmethod
+    def write_proxy(self, gen: Codegen, varname: str) -> None:
+        raise NotImplementedError
+
+    @property
+    def checks_items(self) -> bool:
+        return not all(h.is_any for h in self.handlers)
+
+    @property
+    def lazy(self) -> bool:
+        return True
+
+
+class IteratorHandler(LazyHandler, origin=Iterator):
+    attrs = ['__iter__', '__next__']
+    expected = 'iterator'
+    cache = 'v_cache_iter'
+
+    def write_proxy(self, gen: Codegen, varname: str) -> None:
+        var_i, var_v = gen.new_vars(2)
+        gen.write_line('for {}, {} in enumerate({}):'.format(var_i, var_v, varname))
+        with gen.indent():
+            self.handlers[0](gen, var_v, 'item #{{{}}} of {{v_desc}}'.format(var_i))
+            gen.write_line('yield {}'.format(var_v))
+
+    def __str__(self) -> str:
+        if self.handlers[0].is_any:
+            return 'Iterator'
+        return 'Iterator[{}]'.format(self.handlers[0])
+
+
+class IterableHandler(IteratorHandler, origin=Iterable):
+    # Collections are finite and can be iterated over multiple times, so they're checked
+    # eagerly (and aren't replaced); other iterables are wrapped unless they're iterators.
+    attrs = ['__iter__']
+    expected = 'iterable'
+    cache = 'v_cache_iterable'
+
+    def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
+        gen.check_attrs_cached(varname, desc, self.expected, self.cache, self.attrs)
+        if self.checks_items:
+            gen.write_line('if isinstance({}, collections.Sized):'.format(varname))
+            with gen.indent():
+                gen.iter_and_check(varname, desc, self.handlers[0])
+            if varname in gen.rebindable:
+                var_proxy = gen.new_var()
+                gen.context[var_proxy] = self.proxy()
+                gen.write_line('else:')
+                with gen.indent():
+                    gen.write_line('{} = rt_wrap_iterable({}, {}, {!r})'.format(
+                        varname, varname, var_proxy, gen.rebindable[varname]))
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        super().interpret(interp, value, desc)
+        if self.checks_items and isinstance(value, collections.Sized):
+            interp.iter_and_check(value, desc, self.handlers[0])
+
+    def wrap(self, value: Any, desc: str) -> Any:
+        if not self.checks_items or isinstance(value, collections.Sized):
+            return value
+        return Codegen.rt_wrap_iterable(value, self.proxy(), desc)
+
+    def __str__(self) -> str:
+        if self.handlers[0].is_any:
+            return 'Iterable'
+        return 'Iterable[{}]'.format(self.handlers[0])
+
+
+class GeneratorHandler(LazyHandler, origin=Generator):
+    attrs = ['__iter__', '__next__', 'send', 'throw', 'close']
+    expected = 'generator'
+    cache = 'v_cache_gen'
+
+    def write_proxy(self, gen: Codegen, varname: str) -> None:
+        # Same as `return (yield from generator)`, with yielded, sent and returned values
+        # checked along the way (except for None sent by next()).
+        yield_handler, send_handler, return_handler = self.handlers
+        var_i, var_send, var_arg, var_v, var_stop, var_exc = gen.new_vars(6)
+        gen.write_line('{} = 0'.format(var_i))
+        gen.write_line('{}, {} = {}.send, None'.format(var_send, var_arg, varname))
+        gen.write_line('while True:')
+        with gen.indent():
+            gen.write_line('try:')
+            with gen.indent():
+                gen.write_line('{} = {}({})'.format(var_v, var_send, var_arg))
+            gen.write_line('except StopIteration as {}:'.format(var_stop))
+            with gen.indent():
+                if not return_handler.is_any:
+                    gen.write_line('{} = {}.value'.format(var_v, var_stop))
+                    return_handler(gen, var_v, 'return value of {v_desc}')
+                    gen.write_line('return {}'.format(var_v))
+                else:
+                    gen.write_line('return {}.value'.format(var_stop))
+            if not yield_handler.is_any:
+                yield_handler(gen, var_v, 'item #{{{}}} of {{v_desc}}'.format(var_i))
+            gen.write_line('{} += 1'.format(var_i))
+            gen.write_line('try:')
+            with gen.indent():
+                gen.write_line('{} = yield {}'.format(var_arg, var_v))
+            gen.write_line('except GeneratorExit:')
+            with gen.indent():
+                gen.write_line('{}.close()'.format(varname))
+                gen.write_line('raise')
+            gen.write_line('except BaseException as {}:'.format(var_exc))
+            with gen.indent():
+                gen.write_line('{}, {} = {}.throw, {}'.format(var_send, var_arg, varname, var_exc))
+            gen.write_line('else:')
+            with gen.indent():
+                if not send_handler.is_any:
+                    gen.write_line('if {} is not None:'.format(var_arg))
+                    with gen.indent():
+                        send_handler(gen, var_arg, 'value sent to {v_desc}')
+                gen.write_line('{} = {}.send'.format(var_send, varname))
+
+    def __str__(self) -> str:
+        return 'Generator[{}]'.format(', '.join(map(str, self.handlers)))
+
+
+class AsyncIteratorHandler(LazyHandler, origin=AsyncIterator):
+    # Items can only be checked by an async generator proxy (Python 3.6+); AsyncIterator is
+    # None in typing < 3.5.2, in which case the handler isn't registered (see HandlerMeta).
+    attrs = ['__aiter__', '__anext__']
+    expected = 'async iterator'
+    cache = 'v_cache_aiter'
+    proxy_def = 'async def'
+
+    def write_proxy(self, gen: Codegen, varname: str) -> None:
+        var_i, var_v = gen.new_vars(2)
+        gen.write_line('{} = 0'.format(var_i))
+        gen.write_line('async for {} in {}:'.format(var_v, varname))
+        with gen.indent():
+            self.handlers[0](gen, var_v, 'item #{{{}}} of {{v_desc}}'.format(var_i))
+            gen.write_line('{} += 1'.format(var_i))
+            gen.write_line('yield {}'.format(var_v))
+
+    def __str__(self) -> str:
+        if self.handlers[0].is_any:
+            return 'AsyncIterator'
+        return 'AsyncIterator[{}]'.format(self.handlers[0])
+
+    @property
+    def checks_items(self) -> bool:
+        return sys.version_info >= (3, 6) and super().checks_items
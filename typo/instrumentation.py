@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+import sys
+import time
+
+from typing import Any, Callable, List, Optional, TextIO
+
+# Instrumented wrappers count calls and time the checks of each node of the annotations, e.g.
+# `f.x -> Dict.value -> List.item`; time of a node includes the time of its children. Only the
+# wrappers generated while instrumentation is enabled (or with `instrument=True`) are affected.
+enabled = bool(os.environ.get('TYPO_STATS'))
+
+# Number of calls and total time in nanoseconds by function name and annotation path (the
+# path is empty for the number of calls of the function itself).
+records = collections.OrderedDict()
+
+clock = getattr(time, 'perf_counter_ns', None) or (lambda: int(time.perf_counter() * 1e9))
+
+NodeStats = collections.namedtuple('NodeStats', ['path', 'count', 'total_ns'])
+FunctionStats = collections.namedtuple('FunctionStats', ['name', 'calls', 'total_ns', 'nodes'])
+
+
+def enable_stats() -> None:
+    global enabled
+    enabled = True
+
+
+def disable_stats() -> None:
+    global enabled
+    enabled = False
+
+
+def reset_stats() -> None:
+    # Counters of existing wrappers are reset rather than removed, since wrappers keep them.
+    for record in records.values():
+        record[:] = [0, 0]
+
+
+def record(func: str, path: tuple) -> List[int]:
+    return records.setdefault((func, path), [0, 0])
+
+
+def function_name(func: Callable) -> str:
+    return '{}.{}'.format(func.__module__, getattr(func, '__qualname__', func.__name__))
+
+
+def stats() -> List[FunctionStats]:
+    # Functions sorted by the total time spent checking them, each with nodes of annotations
+    # sorted the same way.
+    functions = collections.OrderedDict()
+    for (func, path), (count, total_ns) in records.items():
+        calls, nodes = functions.setdefault(func, [0, []])
+        if path:
+            nodes.append(NodeStats(' -> '.join(path), count, total_ns))
+        else:
+            functions[func][0] = count
+    result = []
+    for func, (calls, nodes) in functions.items():
+        total_ns = sum(node.total_ns for node in nodes if ' -> ' not in node.path)
+        nodes.sort(key=lambda node: -node.total_ns)
+        result.append(FunctionStats(func, calls, total_ns, nodes))
+    result.sort(key=lambda func: -func.total_ns)
+    return result
+
+
+def dump_stats(file: Optional[TextIO]=None, limit: Optional[int]=None) -> None:
+    # Writes a report of the (first `limit`) functions taking the most time to check.
+    file = file or sys.stdout
+    print('{:>10} {:>12} {:>10}  {}'.format('calls', 'total ms', 'us/call', 'function / node'),
+          file=file)
+    for func in stats()[:limit]:
+        print_row(file, func.calls, func.total_ns, func.name)
+        for node in func.nodes:
+            print_row(file, node.count, node.total_ns, '    ' + node.path)
+
+
+def print_row(file: TextIO, count: int, total_ns: int, name: Any) -> None:
+    per_call = total_ns / count / 1e3 if count else 0
+    print('{:>10} {:>12.3f} {:>10.3f}  {}'.format(count, total_ns / 1e6, per_call, name),
+          file=file)
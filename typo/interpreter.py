@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+from typing import Any, Union, Tuple, List, Iterable, Optional
+
+from typo.codegen import Codegen
+from typo.utils import type_name, type_names, check_sample
+
+
+class Interpreter:
+    # Checks values by walking the handler tree directly instead of generating code; this
+    # mirrors the helpers of Codegen, and each handler implements both (`__call__` and
+    # `interpret`). It is much slower per call, but there's nothing to compile upfront.
+
+    caches = {
+        'v_cache_seq': Codegen._v_cache_seq,
+        'v_cache_mut_seq': Codegen._v_cache_mut_seq,
+        'v_cache_iter': Codegen._v_cache_iter,
+        'v_cache_iterable': Codegen._v_cache_iterable,
+        'v_cache_gen': Codegen._v_cache_gen,
+        'v_cache_aiter': Codegen._v_cache_aiter,
+    }
+
+    def __init__(self, sample: Optional[int]=None) -> None:
+        check_sample(sample)
+        self.sample = sample
+        # list of all possible assignments to type variables, each one is a dict
+        # mapping typevars to types; assignments are never modified in place
+        self.tv = [{}]
+
+    @staticmethod
+    def fail(desc: Optional[str], expected: str, var: Any, got: str=None) -> None:
+        if desc is None:
+            raise TypeError
+        raise TypeError('invalid {}: expected {}, got {}'.format(
+            desc, expected, type_name(type(var)) if got is None else got))
+
+    @staticmethod
+    def fail_msg(desc: Optional[str], msg: str, var: Any) -> None:
+        if desc is None:
+            raise TypeError
+        raise TypeError('invalid {}: {}'.format(desc, msg.format(tp=type_name(type(var)))))
+
+    def check_type(self, value: Any, desc: Optional[str],
+                   tp: Union[Tuple[type, ...], type]) -> None:
+        if not isinstance(value, tp):
+            self.fail(desc, type_names(tp), value)
+
+    def types_match(self, iterable: Iterable[Any], handler: 'typo.handlers.Handler') -> bool:
+        # See Codegen.summarize_types().
+        if self.sample is not None or not handler.simple_types:
+            return False
+        types = set(map(type, iterable))
+        cache = Codegen._v_cache_types.setdefault(handler.simple_types, set())
+        return types <= cache or Codegen.rt_check_types(types, handler.simple_types, cache)
+
+    def buffer_matches(self, value: Any, handler: 'typo.handlers.Handler') -> bool:
+        # See Codegen.check_buffer().
+        if not handler.simple_types:
+            return False
+        tp = Codegen.rt_buffer_type(value)
+        return tp is not None and issubclass(tp, handler.simple_types)
+
+    def sampled(self, iterable: Iterable[Any]) -> Iterable[Any]:
+        if self.sample is None:
+            return iterable
+        return itertools.islice(iterable, 3 * self.sample)
+
+    def iter_and_check(self, value: Any, desc: Optional[str],
+                       handler: 'typo.handlers.Handler') -> None:
+        if self.types_match(value, handler):
+            return
+        for v in self.sampled(value):
+            handler.interpret(self, v, None if desc is None else 'item of {}'.format(desc))
+
+    def enumerate_and_check(self, value: Any, desc: Optional[str],
+                            handler: 'typo.handlers.Handler') -> None:
+        if self.types_match(value, handler):
+            return
+        if self.sample is None:
+            items = enumerate(value)
+        else:
+            items = Codegen.rt_sample_items(value, self.sample)
+        for i, v in items:
+            handler.interpret(self, v, None if desc is None else
+                              'item #{} of {}'.format(i, desc))
+
+    def check_attrs_cached(self, value: Any, desc: Optional[str], expected: str,
+                           cache: str, attrs: List[str]) -> None:
+        cache = self.caches[cache]
+        tp = type(value)
+        if tp in cache:
+            ok = cache[tp]
+        else:
+            ok = cache[tp] = all(hasattr(value, attr) for attr in attrs)
+        if not ok:
+            self.fail(desc, expected, value)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable, Optional, Set, Tuple, TypeVar
+
+from typo.codegen import Codegen
+from typo.handlers import Handler
+from typo.interpreter import Interpreter
+
+
+class ArrayType:
+    # Annotation for numpy arrays: `Array`, `Array[dtype]` or `Array[dtype, shape]`, where
+    # shape is either the number of dimensions or a tuple of dimensions, each of which is an
+    # int, None (any size) or a typevar (same size everywhere in the signature). numpy
+    # itself is only imported once an annotation is turned into a handler.
+
+    def __init__(self, dtype: Any=None, shape: Optional[Tuple[Any, ...]]=None) -> None:
+        self.dtype = dtype
+        self.shape = shape
+
+    def __getitem__(self, params: Any) -> 'ArrayType':
+        if self.dtype is not None or self.shape is not None:
+            raise TypeError('cannot parametrize {!r}'.format(self))
+        if not isinstance(params, tuple):
+            params = (params,)
+        if not 1 <= len(params) <= 2:
+            raise TypeError('expected Array[dtype] or Array[dtype, shape], got {} parameters'
+                            .format(len(params)))
+        dtype, shape = params[0], params[1] if len(params) > 1 else None
+        if dtype is Any:
+            dtype = None
+        if isinstance(shape, int) and not isinstance(shape, bool):
+            if shape < 0:
+                raise TypeError('invalid number of array dimensions: {!r}'.format(shape))
+            shape = (None,) * shape
+        elif shape is not None:
+            if not isinstance(shape, tuple):
+                raise TypeError('invalid array shape: {!r}'.format(shape))
+            shape = tuple(None if dim is Any else dim for dim in shape)
+            for dim in shape:
+                if isinstance(dim, TypeVar):
+                    if dim.__constraints__ or dim.__bound__ is not None:
+                        raise TypeError('array dimension typevars cannot have bounds or '
+                                        'constraints: {!r}'.format(dim))
+                elif dim is not None and (not isinstance(dim, int) or isinstance(dim, bool)
+                                          or dim < 0):
+                    raise TypeError('invalid array dimension: {!r}'.format(dim))
+        return ArrayType(dtype, shape)
+
+    def __call__(self, *args, **kwargs) -> None:
+        # typing only accepts callables as parameters, e.g. in `Optional[Array[float, 2]]`.
+        raise TypeError('cannot instantiate {!r}'.format(self))
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ArrayType):
+            return NotImplemented
+        return (self.dtype, self.shape) == (other.dtype, other.shape)
+
+    def __hash__(self) -> int:
+        return hash((self.dtype, self.shape))
+
+    def __repr__(self) -> str:
+        if self.dtype is None and self.shape is None:
+            return 'Array'
+        return params_str(self.dtype, self.shape, repr)
+
+
+def params_str(dtype: Any, shape: Optional[Tuple[Any, ...]], fmt: Callable) -> str:
+    params = ['Any' if dtype is None else getattr(dtype, '__name__', fmt(dtype))]
+    if shape is not None:
+        dims = ['Any' if dim is None else getattr(dim, '__name__', str(dim)) for dim in shape]
+        params.append('({})'.format(dims[0] + ',' if len(dims) == 1 else ', '.join(dims)))
+    return 'Array[{}]'.format(', '.join(params))
+
+
+Array = ArrayType()
+
+
+class ArrayHandler(Handler, subclass=Array):
+    def __init__(self, bound: Any) -> None:
+        super().__init__(bound)
+        import numpy
+
+        self.ndarray = numpy.ndarray
+        self.abstract = False
+        self.dtype = bound.dtype
+        if self.dtype is not None:
+            abstract_types = (numpy.generic, numpy.number, numpy.integer, numpy.signedinteger,
+                              numpy.unsignedinteger, numpy.inexact, numpy.floating,
+                              numpy.complexfloating, numpy.flexible, numpy.character)
+            if self.dtype in abstract_types:
+                self.abstract = True
+            else:
+                try:
+                    self.dtype = numpy.dtype(self.dtype)
+                except TypeError:
+                    raise TypeError('invalid array dtype: {!r}'.format(self.dtype)) from None
+
+        # Fixed dimensions are checked at once, symbolic ones are bound like typevars.
+        self.shape = bound.shape
+        self.fixed_dims, self.symbolic_dims = [], []
+        for i, dim in enumerate(self.shape or ()):
+            if isinstance(dim, TypeVar):
+                self.symbolic_dims.append((i, dim))
+            elif dim is not None:
+                self.fixed_dims.append((i, dim))
+
+    def __call__(self, gen: Codegen, varname: str, desc: Optional[str]) -> None:
+        # Only the array metadata is inspected, so the checks don't depend on the array size.
+        gen.check_type(varname, desc, self.ndarray)
+        if self.dtype is not None:
+            var_dt = gen.new_var()
+            gen.write_line('{} = {}.dtype'.format(var_dt, varname))
+            if self.abstract:
+                gen.write_line('if not issubclass({}.type, {}):'
+                               .format(var_dt, gen.ref_type(self.dtype)))
+            else:
+                var_ref = gen.new_var()
+                gen.context[var_ref] = self.dtype
+                gen.write_line('if {} != {}:'.format(var_dt, var_ref))
+            with gen.indent():
+                gen.fail(desc, str(self), varname, got='array of {{{}}}'.format(var_dt))
+        if self.shape is not None:
+            var_s = gen.new_var()
+            gen.write_line('{} = {}.shape'.format(var_s, varname))
+            conds = ['len({}) != {}'.format(var_s, len(self.shape))]
+            conds.extend('{}[{}] != {}'.format(var_s, i, dim) for i, dim in self.fixed_dims)
+            gen.write_line('if {}:'.format(' or '.join(conds)))
+            with gen.indent():
+                gen.fail(desc, str(self), varname, got='array with shape {{{}}}'.format(var_s))
+            for i, dim in self.symbolic_dims:
+                gen.bind_typevar(dim, '{}[{}]'.format(var_s, i), varname, desc,
+                                 'cannot assign dimension {{{}[{}]}} to {}'
+                                 .format(var_s, i, dim.__name__), op='==')
+
+    def interpret(self, interp: Interpreter, value: Any, desc: Optional[str]) -> None:
+        interp.check_type(value, desc, self.ndarray)
+        if self.dtype is not None:
+            dtype = value.dtype
+            if not (issubclass(dtype.type, self.dtype) if self.abstract else
+                    dtype == self.dtype):
+                interp.fail(desc, str(self), value, got='array of {}'.format(dtype))
+        if self.shape is not None:
+            shape = value.shape
+            if len(shape) != len(self.shape) or any(shape[i] != d for i, d in self.fixed_dims):
+                interp.fail(desc, str(self), value, got='array with shape {}'.format(shape))
+            for i, dim in self.symbolic_dims:
+                assignments = interp.tv
+                interp.tv = []
+                for tv in assignments:
+                    if dim not in tv:
+                        tv = dict(tv)
+                        tv[dim] = shape[i]
+                    elif tv[dim] != shape[i]:
+                        continue
+                    interp.tv.append(tv)
+                if not interp.tv:
+                    interp.fail_msg(desc, 'cannot assign dimension {} to {}'
+                                    .format(shape[i], dim.__name__), value)
+
+    def __str__(self) -> str:
+        if self.dtype is None and self.shape is None:
+            return 'Array'
+        return params_str(self.dtype, self.shape, str)
+
+    @property
+    def dispatch_type(self) -> Optional[type]:
+        return self.ndarray
+
+    @property
+    def simple_types(self) -> Optional[Tuple[type, ...]]:
+        if self.dtype is None and self.shape is None:
+            return (self.ndarray,)
+        return None
+
+    @property
+    def typevars(self) -> Set[type(TypeVar)]:
+        return set(dim for _, dim in self.symbolic_dims)
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import builtins
+import collections
+import difflib
+import keyword
+import os
+import re
+import sys
+import types
+
+from typing import Any, Dict, List, Optional, Set, TextIO, Tuple
+
+# Peephole passes over the generated source, run right before it's compiled. Handlers write
+# code without knowing what surrounds it, so e.g. a member of a Union checks the type that the
+# Union has already dispatched on; the passes remove such redundancies. Each of them only
+# rewrites the exact patterns written by the codegen and leaves everything else as is.
+enabled = os.environ.get('TYPO_OPTIMIZE', '1') != '0'
+
+# If set, the source before and after the optimization is written to this file (as a diff).
+dump_file = sys.stderr if os.environ.get('TYPO_DUMP_CODE') else None
+
+strings = re.compile(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')')
+# Names other than keywords and the variables allocated by the codegen (`v_000` etc.).
+names = re.compile(r'(?<![\w.])(?!v_\d|(?:{})\b)([A-Za-z_]\w*)(?:\.([A-Za-z_]\w*))?'
+                   .format('|'.join(keyword.kwlist)))
+targets = re.compile(r'(?:(?:async )?for ([\w, ]+) in |([\w, ]+?) ?[-+]?=(?!=))')
+type_of = re.compile(r'(\w+) = type\((\w+)\)$')
+alias_of = re.compile(r'(\w+) = (\w+)$')
+dispatch = re.compile(r'(?:el)?if (\w+) is ([\w.]+):$')
+nested_scope = re.compile(r'^(?:async )?def |^class |(?<!async) for ', re.M)
+dispatch_line = re.compile(r'if \w+ is [\w.]+:\n')
+len_of = re.compile(r'(\w+) = len\((\w+)\)$')
+fail_prefixes = ('raise', 'return', 'rt_fail(', 'rt_type_fail(', 'rt_fail_msg(')
+headers = ('if', 'elif', 'else', 'for', 'async', 'while', 'try', 'except', 'finally', 'with',
+           'def', 'class')
+
+
+def enable_code_dump(file: Optional[TextIO]=None) -> None:
+    global dump_file
+    dump_file = file or sys.stderr
+
+
+def disable_code_dump() -> None:
+    global dump_file
+    dump_file = None
+
+
+def optimize(source: str, namespace: Dict[str, Any]) -> str:
+    # `namespace` holds the globals the code will be executed with.
+    if not enabled:
+        return source
+    result = Optimizer(source, namespace).run()
+    if dump_file is not None:
+        before, after = source.splitlines(True), result.splitlines(True)
+        diff = list(difflib.unified_diff(before, after, 'generated', 'optimized',
+                                         n=max(len(before), len(after))))
+        dump_file.write(''.join(diff) if diff else '# unchanged\n' + source)
+    return result
+
+
+def sub_code(pattern: Any, repl: Any, text: str) -> str:
+    # Same as re.sub(), except that string literals are left as they are.
+    parts = strings.split(text)
+    parts[::2] = [pattern.sub(repl, part) for part in parts[::2]]
+    return ''.join(parts)
+
+
+def find_code(pattern: Any, text: str) -> List[Any]:
+    return [m for part in strings.split(text)[::2] for m in pattern.finditer(part)]
+
+
+def is_header(text: str) -> bool:
+    return text.endswith(':') and text.split(' ', 1)[0].rstrip(':') in headers
+
+
+class Optimizer:
+    def __init__(self, source: str, namespace: Dict[str, Any]) -> None:
+        # Lines are (indent, text) pairs; the codegen writes a single statement per line.
+        self.lines = []
+        for line in source.splitlines():
+            text = line.lstrip(' ')
+            if text:
+                self.lines.append((len(line) - len(text), text))
+        self.source = source
+        self.namespace = namespace
+        self.aliases = set()
+        self.next_var_id = None
+
+    def run(self) -> str:
+        # Passes are skipped unless the source contains what they look for; blocks can only be
+        # left empty by dropping dead branches.
+        if self.source.count(' = type(') > 1:
+            self.reuse_types()
+        if dispatch_line.search(self.source) and self.drop_dead_branches():
+            self.drop_empty_blocks()
+        if 'pass' in self.source:
+            self.drop_passes()
+        if ' = len(' in self.source:
+            self.unpack_tuples()
+        if 'for ' in self.source:
+            self.hoist_globals()
+        return ''.join(' ' * indent + text + '\n' for indent, text in self.lines)
+
+    def new_var(self) -> str:
+        if self.next_var_id is None:
+            ids = [int(i) for i in re.findall(r'\bv_(\d+)\b', self.source)]
+            self.next_var_id = max(ids + [-1]) + 1
+        varname = 'v_{:03d}'.format(self.next_var_id)
+        self.next_var_id += 1
+        return varname
+
+    def block_end(self, i: int) -> int:
+        # Index of the first line after the block (or the statement) starting at line i.
+        indent = self.lines[i][0]
+        for j in range(i + 1, len(self.lines)):
+            if self.lines[j][0] <= indent:
+                return j
+        return len(self.lines)
+
+    def dominates(self, i: int, j: int) -> bool:
+        # Whether line i is always executed before line j (within the same function).
+        indent = self.lines[i][0]
+        return i < j and self.lines[j][0] >= indent and all(
+            self.lines[k][0] >= indent for k in range(i + 1, j))
+
+    def assigned(self, i: int, j: int, names: Set[str]) -> bool:
+        # Whether any of the names may be rebound between lines i and j.
+        for _, text in self.lines[i + 1:j]:
+            m = targets.match(text)
+            if m is not None and names & set(re.findall(r'\w+', m.group(1) or m.group(2))):
+                return True
+        return False
+
+    def reuse_types(self) -> None:
+        # `v = type(x)` becomes `v = w` if `w = type(x)` has always been evaluated before,
+        # e.g. by a Union dispatching on the type of a value bound to a typevar.
+        known = []
+        for i, (indent, text) in enumerate(self.lines):
+            m = type_of.match(text)
+            if m is None:
+                continue
+            var, arg = m.groups()
+            for j, other, other_arg in known:
+                if (other_arg == arg and self.dominates(j, i) and
+                        not self.assigned(j, i, {arg, other})):
+                    self.lines[i] = (indent, '{} = {}'.format(var, other))
+                    break
+            else:
+                known.append((i, var, arg))
+
+    def drop_dead_branches(self) -> bool:
+        # Within `if v is tp:` where `v = type(x)`, `if not isinstance(x, tp):` never holds,
+        # e.g. when a member of a Union checks the type the Union has dispatched on.
+        type_vars = {}
+        dropped = False
+        i = 0
+        while i < len(self.lines):
+            indent, text = self.lines[i]
+            m = type_of.match(text)
+            if m is not None:
+                type_vars[m.group(1)] = (i, m.group(2))
+            m = alias_of.match(text)
+            if m is not None and m.group(2) in type_vars:
+                type_vars[m.group(1)] = (i, type_vars[m.group(2)][1])
+            m = dispatch.match(text)
+            if m is not None and m.group(1) in type_vars:
+                var, tp = m.groups()
+                start, arg = type_vars[var]
+                if self.dominates(start, i) and not self.assigned(start, i, {var, arg}):
+                    dropped |= self.drop_isinstance(i, start, arg, tp)
+            i += 1
+        return dropped
+
+    def drop_isinstance(self, i: int, start: int, arg: str, tp: str) -> bool:
+        cond = re.compile(r'if not isinstance\({}, (\(([\w., ]+)\)|[\w.]+)\):$'
+                          .format(re.escape(arg)))
+        dropped = False
+        k = i + 1
+        while k < self.block_end(i):
+            m = cond.match(self.lines[k][1])
+            end = self.block_end(k)
+            if (m is not None and tp in ([m.group(1)] if m.group(2) is None else
+                                         m.group(2).replace(' ', '').split(',')) and
+                    not self.assigned(start, k, {arg}) and not (
+                        end < len(self.lines) and self.lines[end][0] == self.lines[k][0] and
+                        self.lines[end][1].startswith(('elif ', 'else:')))):
+                del self.lines[k:end]
+                dropped = True
+            else:
+                k += 1
+        return dropped
+
+    def drop_empty_blocks(self) -> None:
+        # Blocks left empty get a `pass`, except for `try:` blocks which are removed along with
+        # their `except` clauses (nothing is raised by an empty block).
+        i = len(self.lines) - 1
+        while i >= 0:
+            indent, text = self.lines[i]
+            if not is_header(text) or (i + 1 < len(self.lines) and
+                                       self.lines[i + 1][0] > indent):
+                i -= 1
+                continue
+            end = i + 1
+            while (end < len(self.lines) and self.lines[end][0] == indent and
+                   self.lines[end][1].startswith('except')):
+                end = self.block_end(end)
+            if text == 'try:' and end > i + 1 and not (
+                    end < len(self.lines) and self.lines[end][0] == indent and
+                    self.lines[end][1] in ('else:', 'finally:')):
+                del self.lines[i:end]
+            else:
+                self.lines.insert(i + 1, (indent + 4, 'pass'))
+            i -= 1
+
+    def drop_passes(self) -> None:
+        # `pass` is only needed if it's the only statement of its block.
+        lines = []
+        for i, (indent, text) in enumerate(self.lines):
+            if text == 'pass' and ((lines and lines[-1][0] >= indent) or (
+                    i + 1 < len(self.lines) and self.lines[i + 1][0] == indent)):
+                continue
+            lines.append((indent, text))
+        self.lines = lines
+
+    def unpack_tuples(self) -> None:
+        # After `n = len(x)` and `if n != k:` (which fails), items of the tuple are unpacked
+        # once instead of indexing the tuple on every use.
+        i = 0
+        while i + 2 < len(self.lines):
+            indent, text = self.lines[i]
+            m = len_of.match(text) if ' = len(' in text else None
+            if (m is None or self.lines[i + 1][0] != indent or
+                    not re.match(r'if {} != (\d+):$'.format(m.group(1)), self.lines[i + 1][1])):
+                i += 1
+                continue
+            arg, n = m.group(2), int(self.lines[i + 1][1].split()[-1][:-1])
+            start = end = self.block_end(i + 1)
+            fail = self.lines[i + 2:start]
+            while end < len(self.lines) and self.lines[end][0] >= indent:
+                end += 1
+            item = re.compile(r'(?<![\w.]){}\[(\d+)\]'.format(re.escape(arg)))
+            indices = set(int(m.group(1)) for _, text in self.lines[start:end]
+                          for m in find_code(item, text))
+            i += 1
+            if (not indices or max(indices) >= n or arg == m.group(1) or
+                    self.assigned(i, end, {arg}) or
+                    len(fail) != 1 or not fail[0][1].startswith(fail_prefixes)):
+                continue
+            items = [self.new_var() for _ in range(n)]
+            for k in range(start, end):
+                self.lines[k] = (self.lines[k][0], sub_code(
+                    item, lambda m: items[int(m.group(1))], self.lines[k][1]))
+            self.lines.insert(start, (indent, '{}{} = {}'.format(
+                ', '.join(items), ',' if n == 1 else '', arg)))
+
+    def hoist_globals(self) -> None:
+        # Globals and builtins used within loops (other than to report failures) are bound to
+        # local variables right before the outermost loop, so they're looked up only once.
+        i = 0
+        while i < len(self.lines):
+            indent, text = self.lines[i]
+            if not text.startswith(('for ', 'async for ')) or not is_header(text):
+                i += 1
+                continue
+            func = self.enclosing_function(i)
+            end = self.block_end(i)
+            body = self.lines[i + 1:end]
+            hoisted = {} if func is None else self.loop_globals(func, body)
+            if hoisted:
+                texts = sub_code(names, lambda m: self.hoisted_name(hoisted, *m.groups()),
+                                 '\n'.join(text for _, text in body)).split('\n')
+                self.lines[i + 1:end] = [(line[0], text) for line, text in zip(body, texts)]
+                self.lines[i:i] = [(indent, '{} = {}'.format(alias, key))
+                                   for key, alias in hoisted.items()]
+            i = end + len(hoisted)
+
+    @staticmethod
+    def hoisted_name(hoisted: Dict[str, str], name: str, attr: Optional[str]) -> str:
+        if attr is None:
+            return hoisted.get(name, name)
+        key = '{}.{}'.format(name, attr)
+        return hoisted.get(key) or '{}.{}'.format(hoisted.get(name, name), attr)
+
+    def enclosing_function(self, i: int) -> Optional[int]:
+        indent = self.lines[i][0]
+        for j in range(i - 1, -1, -1):
+            if self.lines[j][0] < indent:
+                if self.lines[j][1].startswith(('def ', 'async def ')):
+                    return j
+                indent = self.lines[j][0]
+        return None
+
+    def loop_globals(self, func: int, body: List[Tuple[int, str]]) -> Dict[str, str]:
+        # Loops with nested scopes are left alone, since the names would become closures.
+        code = '\n'.join(text for _, text in body if not text.startswith(fail_prefixes))
+        if 'lambda' in code or nested_scope.search(code):
+            return {}
+
+        # Besides the parameters, the codegen only assigns its own variables (`v_000`, `tv`).
+        local = set(re.findall(r'\w+', self.lines[func][1]))
+        hoisted = collections.OrderedDict()
+        for name, attr in (m.groups() for m in find_code(names, code)):
+            if name in local or name.startswith('tv'):
+                continue
+            if attr is not None and isinstance(self.namespace.get(name), types.ModuleType):
+                key = '{}.{}'.format(name, attr)
+            elif name in self.namespace or hasattr(builtins, name):
+                key = name
+            else:
+                continue
+            alias = 'v_' + key.replace('.', '_')
+            if key not in hoisted and alias not in self.aliases and alias not in self.source:
+                hoisted[key] = alias
+                self.aliases.add(alias)
+        return hoisted
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+from typing import Any, Callable
+
+from typo.handlers import Handler
+
+
+def predicate(hint: Any) -> Callable[[Any], bool]:
+    # Compiled predicates are cached by the (interned) handlers, so this is cheap to call.
+    return Handler(hint).predicate()
+
+
+def is_instance(value: Any, hint: Any) -> bool:
+    return Handler(hint).predicate()(value)
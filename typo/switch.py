@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import inspect
+import types
+import weakref
+
+from typing import Callable, Optional, Union
+
+from typo.utils import code_template
+
+
+# Code of disabled wrappers: a plain call of the original function (stored in wrapper globals,
+# by default as `_typo_func`, unless globals are shared by several wrappers).
+passthrough_source = ('def wrapper(*args, **kwargs):\n'
+                      '    return {func}(*args, **kwargs)\n')
+passthrough_async_source = ('async def wrapper(*args, **kwargs):\n'
+                            '    return await {func}(*args, **kwargs)\n')
+passthrough_async_gen_source = ('async def wrapper(*args, **kwargs):\n'
+                                '    async for item in {func}(*args, **kwargs):\n'
+                                '        yield item\n')
+passthrough_code = code_template(passthrough_source.format(func='_typo_func'))
+
+# Checking can be switched on and off globally (None key) and per module (and submodules).
+switches = {None: True}
+
+# Per-function switch (None if not set), followed by code, defaults and kwdefaults to restore
+# when the wrapper is enabled again, and the name of the original function in wrapper globals;
+# this also serves as the registry of all wrappers.
+wrappers = weakref.WeakKeyDictionary()
+
+
+def register(wrapper: types.FunctionType, func: Callable, func_var: Optional[str]=None) -> None:
+    # If `func_var` is set, the function is already stored in wrapper globals under that name.
+    if func_var is None:
+        func_var = '_typo_func'
+        wrapper.__globals__[func_var] = func
+    wrappers[wrapper] = [None, None, None, None, func_var]
+    set_code(wrapper, wrapper.__code__, wrapper.__defaults__, wrapper.__kwdefaults__)
+
+
+def set_code(wrapper: types.FunctionType, code: types.CodeType, defaults: Optional[tuple],
+             kwdefaults: Optional[dict]) -> None:
+    # Replace the code of an enabled wrapper (it will only be installed when it's enabled).
+    wrappers[wrapper][1:4] = code, defaults, kwdefaults
+    apply(wrapper)
+
+
+def passthrough(wrapper: types.FunctionType) -> types.CodeType:
+    # Coroutine wrappers stay coroutine functions (e.g. for inspect.iscoroutinefunction()),
+    # and async generator wrappers stay async generator functions.
+    func_var = wrappers[wrapper][4]
+    if hasattr(inspect, 'isasyncgenfunction') and inspect.isasyncgenfunction(wrapper):
+        return code_template(passthrough_async_gen_source.format(func=func_var))
+    elif inspect.iscoroutinefunction(wrapper):
+        return code_template(passthrough_async_source.format(func=func_var))
+    elif func_var != '_typo_func':
+        return code_template(passthrough_source.format(func=func_var))
+    return passthrough_code
+
+
+def apply(wrapper: types.FunctionType) -> None:
+    if is_enabled(wrapper):
+        wrapper.__code__, wrapper.__defaults__, wrapper.__kwdefaults__ = wrappers[wrapper][1:4]
+    else:
+        wrapper.__code__, wrapper.__defaults__, wrapper.__kwdefaults__ = \
+            passthrough(wrapper), None, None
+
+
+def module_enabled(module: Optional[str]) -> bool:
+    while module:
+        if module in switches:
+            return switches[module]
+        module = module.rpartition('.')[0]
+    return switches[None]
+
+
+def is_enabled(target: Union[None, str, types.ModuleType, Callable]=None) -> bool:
+    if target is None or isinstance(target, (str, types.ModuleType)):
+        return module_enabled(getattr(target, '__name__', target))
+    elif target not in wrappers:
+        raise ValueError('not a type-checked function: {!r}'.format(target))
+    elif wrappers[target][0] is not None:
+        return wrappers[target][0]
+    return module_enabled(target.__module__)
+
+
+def switch(target: Union[None, str, types.ModuleType, Callable], enabled: Optional[bool]) -> None:
+    if target is None or isinstance(target, (str, types.ModuleType)):
+        module = getattr(target, '__name__', target)
+        if enabled is None and module is not None:
+            switches.pop(module, None)
+        else:
+            switches[module] = True if enabled is None else enabled
+        for wrapper in list(wrappers):
+            apply(wrapper)
+    elif target not in wrappers:
+        raise ValueError('not a type-checked function: {!r}'.format(target))
+    else:
+        wrappers[target][0] = enabled
+        apply(target)
+
+
+def enable(target: Union[None, str, types.ModuleType, Callable]=None) -> None:
+    # Enable checking globally, for a module (and its submodules) or for a function.
+    switch(target, True)
+
+
+def disable(target: Union[None, str, types.ModuleType, Callable]=None) -> None:
+    # Disable checking globally, for a module (and its submodules) or for a function.
+    switch(target, False)
+
+
+def reset(target: Union[None, str, types.ModuleType, Callable]=None) -> None:
+    # Remove the switch for a module or a function so that it follows its parent; if no
+    # target is specified, remove all module and function switches and enable checking.
+    if target is not None:
+        switch(target, None)
+    else:
+        switches.clear()
+        switches[None] = True
+        for state in wrappers.values():
+            state[0] = None
+        for wrapper in list(wrappers):
+            apply(wrapper)
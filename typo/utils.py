@@ -1,7 +1,217 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import threading
+import types
+
+from typing import Optional, Tuple, Union
+
 
 def type_name(tp: type) -> str:
     if tp.__module__ in ('builtins', 'abc', 'typing'):
         return tp.__name__
     return tp.__module__ + '.' + getattr(tp, '__qualname__', tp.__name__)
+
+
+def type_names(tp: Union[type, Tuple[type, ...]]) -> str:
+    if isinstance(tp, tuple):
+        return ' or '.join(map(type_name, tp))
+    return type_name(tp)
+
+
+def check_sample(sample: Optional[int]) -> None:
+    if sample is not None and (not isinstance(sample, int) or sample <= 0):
+        raise ValueError('sample size must be a positive integer: {!r}'.format(sample))
+
+
+@functools.lru_cache(maxsize=None)
+def code_template(source: str) -> types.CodeType:
+    # Code of a function named `wrapper` that can be used with any globals.
+    context = {}
+    exec(source, context)
+    return context['wrapper'].__code__
+
+
+def rename_code(code: types.CodeType, name: str) -> types.CodeType:
+    # Same code with a different name, as shown in tracebacks.
+    if hasattr(code, 'replace'):
+        if hasattr(code, 'co_qualname'):
+            return code.replace(co_name=name, co_qualname=name)
+        return code.replace(co_name=name)
+    return types.CodeType(code.co_argcount, code.co_kwonlyargcount, code.co_nlocals,
+                          code.co_stacksize, code.co_flags, code.co_code, code.co_consts,
+                          code.co_names, code.co_varnames, code.co_filename, name,
+                          code.co_firstlineno, code.co_lnotab, code.co_freevars,
+                          code.co_cellvars)
+
+
+immutable_types = {int, float, complex, bool, str, bytes, type(None)}
+
+
+def deeply_immutable(value: object) -> bool:
+    # Only exact built-in types, since subclasses may add mutable state.
+    tp = type(value)
+    if tp is tuple or tp is frozenset:
+        return all(map(deeply_immutable, value))
+    return tp in immutable_types
+
+
+class IterableProxy:
+    # Wrapper of an iterable which checks its items lazily every time it's iterated over.
+    __slots__ = ('__wrapped__', 'proxy', 'desc')
+
+    def __init__(self, wrapped, proxy, desc):
+        self.__wrapped__ = wrapped
+        self.proxy = proxy
+        self.desc = desc
+
+    def __iter__(self):
+        return self.proxy(iter(self.__wrapped__), self.desc)
+
+    def __repr__(self):
+        return '<checked {!r}>'.format(self.__wrapped__)
+
+
+class RecursionGuard(threading.local):
+    # Tracks checks nested through a forward reference: values nested more deeply than
+    # `max_depth` aren't checked, and with `check_once`, neither are values that are being
+    # checked (i.e. cycles) or that have already passed within the same outermost check.
+    # The state is thread-local, so concurrent checks in other threads don't interfere.
+
+    def __init__(self, max_depth: Optional[int], check_once: bool) -> None:
+        self.max_depth = max_depth
+        self.check_once = check_once
+        self.depth = 0
+        self.active = set()
+        self.passed = set()
+
+    def enter(self, value: object) -> bool:
+        if self.max_depth is not None and self.depth >= self.max_depth:
+            return False
+        if self.check_once:
+            key = id(value)
+            if key in self.active or key in self.passed:
+                return False
+            self.active.add(key)
+        self.depth += 1
+        return True
+
+    def done(self, value: object) -> None:
+        if self.check_once:
+            self.passed.add(id(value))
+
+    def leave(self, value: object) -> None:
+        self.depth -= 1
+        if self.check_once:
+            self.active.discard(id(value))
+            if not self.depth:
+                self.passed.clear()
+
+
+class CheckedList(list):
+    # List checked against a `List[...]` handler, which only checks the items being added or
+    # replaced; checks against the same handler are skipped for it (see Codegen.skip_checked).
+    __slots__ = ('handler', 'desc')
+
+    def __init__(self, items=()):
+        # Same as list.__init__ (which replaces the items), for lists created by checked_list().
+        if getattr(self, 'handler', None) is None:
+            raise TypeError('checked lists can only be created by typo.checked_list()')
+        items = list(items)
+        self.check_items(items, 0)
+        super().__init__(items)
+
+    @classmethod
+    def _from_checked(cls, handler, items, desc):
+        # The items have already been checked against the handler.
+        self = cls.__new__(cls)
+        self.handler = handler
+        self.desc = desc
+        list.__init__(self, items)
+        return self
+
+    def check_items(self, items, start):
+        # Items are only checked one by one (to locate the invalid one) if the list fails.
+        if not self.handler.predicate()(items):
+            check = self.handler.handler.compile()
+            for i, item in enumerate(items, start):
+                check(item, 'item #{} of {}'.format(i, self.desc))
+
+    def append(self, item):
+        self.check_items([item], len(self))
+        super().append(item)
+
+    def insert(self, index, item):
+        # Same as `self[index:index] = [item]`, so the position is normalized like a slice.
+        self.check_items([item], slice(index, index).indices(len(self))[0])
+        super().insert(index, item)
+
+    def extend(self, items):
+        items = list(items)
+        self.check_items(items, len(self))
+        super().extend(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            self.check_items(value, index.indices(len(self))[0])
+        else:
+            self.check_items([value], index + len(self) if index < 0 else index)
+        super().__setitem__(index, value)
+
+    def __reduce__(self):
+        # Copies are plain lists, as with list.copy().
+        return list, (list(self),)
+
+
+class CheckedDict(dict):
+    # Same as CheckedList, for a `Dict[...]` handler.
+    __slots__ = ('handler', 'desc')
+
+    def __init__(self, *args, **kwargs):
+        # Same as dict.__init__ (which adds the items), for dicts created by checked_dict().
+        if getattr(self, 'handler', None) is None:
+            raise TypeError('checked dicts can only be created by typo.checked_dict()')
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def _from_checked(cls, handler, items, desc):
+        self = cls.__new__(cls)
+        self.handler = handler
+        self.desc = desc
+        dict.__init__(self, items)
+        return self
+
+    def check_items(self, items):
+        if not self.handler.predicate()(items):
+            self.handler.compile_diagnostic()(items, self.desc)
+
+    def __setitem__(self, key, value):
+        self.check_items({key: value})
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.check_items({key: default})
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        self.check_items(items)
+        super().update(items)
+
+    def __ior__(self, items):
+        self.update(items)
+        return self
+
+    @classmethod
+    def fromkeys(cls, keys, value=None):
+        # There's no handler to check against, so it's a plain dict, as are copies.
+        return dict.fromkeys(keys, value)
+
+    def __reduce__(self):
+        return dict, (dict(self),)